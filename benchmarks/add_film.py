@@ -0,0 +1,50 @@
+""" Write path of database.add_film: statements, commits and time per inserted film.
+
+Run from repository root:
+    python -m benchmarks.add_film [--films 10000] [--inserts 200]
+"""
+import argparse
+import time
+from datetime import datetime
+from sqlalchemy import event
+from .common import setup_app, seed_films, median
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--films", type=int, default=10000, help="catalog size before inserts")
+    parser.add_argument("--inserts", type=int, default=200, help="films added for every names case")
+    args = parser.parse_args()
+
+    films_app, db = setup_app()
+    from films_library import database
+    seed_films(db, args.films)
+    counters = {"statements": 0, "commits": 0}
+
+    def count_statement(*_):
+        counters["statements"] += 1
+
+    def count_commit(*_):
+        counters["commits"] += 1
+    event.listen(db.engine, "before_cursor_execute", count_statement)
+    event.listen(db.engine, "commit", count_commit)
+
+    print(f"{'names':<8}{'statements':>12}{'commits':>10}{'median ms':>12}")
+    # directors and genres already in database, then every film with its own new director and genre
+    for case in ("known", "new"):
+        counters.update(statements=0, commits=0)
+        durations = []
+        for i in range(args.inserts):
+            directors = ["director2", "director3"] if case == "known" else [f"new director {i}"]
+            genres = "genre1,genre2" if case == "known" else f"new genre {i}"
+            begin = time.perf_counter()
+            database.add_film(title=f"Added {case} {i}", release_date=datetime(2021, 1, 1), user=1,
+                              directors=directors, genres=genres, description="benchmark", rate=5)
+            durations.append((time.perf_counter() - begin) * 1000)
+        print(f"{case:<8}{counters['statements'] / args.inserts:>12.1f}{counters['commits'] / args.inserts:>10.1f}"
+              f"{median(durations):>12.2f}")
+    db.session.remove()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+""" API hot paths benchmark: search, add, edit, delete and login through films_app.test_client()
+at several catalog sizes. Results are saved as JSON, two saved runs can be compared.
+
+Run from repository root:
+    python -m benchmarks.api run [--sizes 1000,100000,1000000] [--requests 200] [--output results.json]
+    python -m benchmarks.api compare base.json new.json [--threshold 10]
+
+Notices:
+ - every size is seeded from scratch to sqlite file (or to --database-uri, local Postgres for example,
+   which is wiped!). Random parameters are made with fixed seed, so runs are comparable.
+ - search responses cache is disabled unless --search-cache is passed, otherwise repeated searches
+   measure the cache only.
+ - compare exits with code 1 if p50 or p95 of any scenario grew more than threshold percents.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import sys
+import time
+from collections import Counter
+from datetime import datetime
+from .common import setup_app, seed_films, BENCH_EMAIL, BENCH_PASSWORD
+
+SCENARIOS = ("search", "add", "edit", "delete", "login")
+COMPARED = ("p50_ms", "p95_ms")
+FILMS_URL = "/api/films/"
+LOGIN_URL = "/api/users/login/"
+LOGOUT_URL = "/api/users/logout/"
+LOGIN_DATA = {"email": BENCH_EMAIL, "password": BENCH_PASSWORD}
+SEED = 2022
+
+
+def percentile(values: list, percent: float):
+    """ Nearest-rank percentile of not empty list """
+    values = sorted(values)
+    rank = max(int(round(percent / 100 * len(values) + 0.5)) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+def measure(send, items: list, after=None):
+    """ Call send for every item timing every call.
+
+    :param send: callable(item) making request and returning response
+
+    :param after: (optional) callable(item) which runs after every request untimed
+
+    :returns: dict with latency percentiles in milliseconds, throughput and counts of response statuses
+    """
+    durations, statuses = [], Counter()
+    for item in items:
+        begin = time.perf_counter()
+        response = send(item)
+        durations.append(time.perf_counter() - begin)
+        statuses[str(response.status_code)] += 1
+        if after is not None:
+            after(item)
+    total = sum(durations)
+    return dict(requests=len(durations), statuses=dict(sorted(statuses.items())),
+                p50_ms=round(percentile(durations, 50) * 1000, 3),
+                p95_ms=round(percentile(durations, 95) * 1000, 3),
+                p99_ms=round(percentile(durations, 99) * 1000, 3),
+                mean_ms=round(total / len(durations) * 1000, 3),
+                throughput_rps=round(len(durations) / total, 1) if total else 0.0)
+
+
+def search_params(rng: random.Random, size: int, directors_count: int = 1000, genres_count: int = 20):
+    """ Random search parameters like real clients send, for catalog made by seed_films """
+    params = {"pagination_size": 10, "page_number": rng.randint(1, 50)}
+    kind = rng.choice(("template", "genres", "directors", "sorted", "dates", "search"))
+    if kind == "template":
+        params["template"] = f"Film {rng.randint(1, size)}"
+    elif kind == "genres":
+        params["genres"] = ",".join(f"genre{rng.randint(1, genres_count)}" for _ in range(rng.randint(1, 3)))
+    elif kind == "directors":
+        params["directors"] = f"director{rng.randint(2, directors_count)}"
+    elif kind == "sorted":
+        params.update(sort_by=rng.choice(("rate", "date")), sort_type=rng.choice(("asc", "desc")))
+    elif kind == "dates":
+        year = rng.randint(1950, 2010)
+        params.update(date_from=f"{year}.01.01", date_to=f"{year + 5}.01.01")
+    else:
+        params["search"] = f"description {rng.randint(1, size)}"
+    return params
+
+
+def run_size(films_app, db, size: int, count: int):
+    """ Seed catalog of given size and measure all scenarios on it
+
+    :returns: dict scenario -> measure() result
+    """
+    from films_library.api import search_cache
+    from films_library.cache import directors_ids, genres_ids, users_cache
+    from films_library.models import Films
+    seed_films(db, size)
+    # caches of previous size know rows of the wiped database
+    for cache in (search_cache, directors_ids, genres_ids, users_cache._snapshots):
+        cache.clear()
+    rng = random.Random(SEED)
+    client = films_app.test_client()
+    results = {}
+
+    searches = [search_params(rng, size) for _ in range(count)]
+    results["search"] = measure(lambda params: client.get(FILMS_URL, query_string=params), searches)
+
+    client.post(LOGIN_URL, data=LOGIN_DATA)
+    film_data = dict(description="benchmark film", directors="director2,new director", rate=5,
+                     date="2021.01.01", poster_url="https://", genres="genre1,genre2")
+    results["add"] = measure(lambda i: client.post(FILMS_URL, data=dict(film_data, title=f"Benchmark {i}")),
+                             range(count))
+    added = db.session.execute(db.select(Films.id).where(Films.title.like("Benchmark %"))).scalars().all()
+    results["edit"] = measure(lambda film_id: client.put(FILMS_URL, data={"id": film_id, "title": f"Edited {film_id}",
+                                                                          "genres": "genre3"}), added)
+    results["delete"] = measure(lambda film_id: client.delete(FILMS_URL, data={"id": film_id}), added)
+    client.get(LOGOUT_URL)
+
+    results["login"] = measure(lambda _: client.post(LOGIN_URL, data=LOGIN_DATA), range(count),
+                               after=lambda _: client.get(LOGOUT_URL))
+    db.session.remove()
+    return results
+
+
+def run(args):
+    """ Measure scenarios at every catalog size and save results """
+    if not args.search_cache:
+        os.environ["SEARCH_CACHE_SIZE"] = "0"
+    os.environ.setdefault("LOG_MODE", "ERROR")
+    films_app, db = setup_app(database_uri=args.database_uri)
+    sizes = [int(size) for size in args.sizes.split(",")]
+    report = dict(meta=dict(started=datetime.now().isoformat(timespec="seconds"), python=sys.version.split()[0],
+                            platform=platform.platform(), sqlite=sqlite3.sqlite_version,
+                            database=db.engine.dialect.name, requests=args.requests,
+                            search_cache=args.search_cache),
+                  results={})
+    print(f"{'size':>9} {'scenario':<8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>10}  statuses")
+    for size in sizes:
+        results = report["results"][str(size)] = run_size(films_app, db, size, args.requests)
+        for scenario in SCENARIOS:
+            result = results[scenario]
+            print(f"{size:>9} {scenario:<8}{result['p50_ms']:>10.2f}{result['p95_ms']:>10.2f}"
+                  f"{result['p99_ms']:>10.2f}{result['throughput_rps']:>10.1f}  {result['statuses']}")
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"Saved to {args.output}")
+
+
+def compare(args):
+    """ Print changes between two saved runs, exit with 1 if some scenario became slower than threshold """
+    with open(args.base) as file:
+        base = json.load(file)["results"]
+    with open(args.new) as file:
+        new = json.load(file)["results"]
+    regressions = 0
+    print(f"{'size':>9} {'scenario':<8}{'metric':>8}{'base':>10}{'new':>10}{'change':>9}")
+    for size in sorted(base.keys() & new.keys(), key=int):
+        for scenario in SCENARIOS:
+            if scenario not in base[size] or scenario not in new[size]:
+                continue
+            for metric in COMPARED:
+                old_value, new_value = base[size][scenario][metric], new[size][scenario][metric]
+                change = (new_value - old_value) / old_value * 100 if old_value else 0.0
+                flag = ""
+                if change > args.threshold:
+                    flag = "  REGRESSION"
+                    regressions += 1
+                print(f"{size:>9} {scenario:<8}{metric[:3]:>8}{old_value:>10.2f}{new_value:>10.2f}{change:>8.1f}%{flag}")
+    print(f"{regressions} regressions over {args.threshold}%")
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="measure and save results")
+    run_parser.add_argument("--sizes", default="1000,100000,1000000", help="catalog sizes divided by ','")
+    run_parser.add_argument("--requests", type=int, default=200, help="requests of every scenario")
+    run_parser.add_argument("--output", default="benchmark_results.json")
+    run_parser.add_argument("--database-uri", default=None, help="database instead of sqlite file, WILL BE WIPED")
+    run_parser.add_argument("--search-cache", action="store_true", help="keep search responses cache enabled")
+    compare_parser = commands.add_parser("compare", help="compare two saved results")
+    compare_parser.add_argument("base")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--threshold", type=float, default=10.0, help="allowed slowdown in percents")
+    args = parser.parse_args()
+    if args.command == "run":
+        run(args)
+    else:
+        sys.exit(compare(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+""" Shared helpers for benchmarks. Every benchmark works with its own throwaway sqlite database. """
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# credentials of seeded user 1
+BENCH_EMAIL = "bench@mail.ua"
+BENCH_PASSWORD = "bench"
+# films_library package is imported as top level one inside flask_app directory
+sys.path.insert(0, os.path.join(ROOT, "flask_app"))
+
+
+def setup_app(db_path: str = None, database_uri: str = None):
+    """ Point films_app to sqlite database file (or any database by uri) and import it.
+    Must be called before any films_library import.
+
+    :returns: tuple (films_app, db)
+    """
+    if db_path is None:
+        db_path = os.path.join(tempfile.gettempdir(), "films_benchmark.db")
+    os.environ["SQLALCHEMY_DATABASE_URI"] = database_uri or "sqlite:///" + db_path
+    os.environ.setdefault("LOG_MODE", "ERROR")
+    from films_library import films_app, db
+    from films_library.api import films_api
+    return films_app, db
+
+
+def seed_films(db, count: int, directors_count: int = 1000, genres_count: int = 20, batch: int = 10000):
+    """ Recreate schema and fill it by count simple films with one director and one genre each. """
+    from sqlalchemy import text
+    from werkzeug.security import generate_password_hash
+    from films_library import facets, film_search, search
+    from films_library.models import Films, Directors, Genres, User, films_directors, films_genres, users_films
+    db.session.remove()
+    db.drop_all()
+    db.create_all()
+    # create_all() doesn't know PostgreSQL search_vector column of migration
+    search.create_index()
+    db.session.execute(User.__table__.insert(), [{"id": 1, "nickname": "bench", "email": BENCH_EMAIL,
+                                                  "password": generate_password_hash(BENCH_PASSWORD),
+                                                  "is_admin": True}])
+    db.session.execute(Directors.__table__.insert(), [{"id": 1, "full_name": "unknown"}] +
+                       [{"id": i, "full_name": f"director{i}"} for i in range(2, directors_count + 1)])
+    db.session.execute(Genres.__table__.insert(), [{"id": i, "name": f"genre{i}"} for i in range(1, genres_count + 1)])
+    start = datetime(1950, 1, 1)
+    for first in range(1, count + 1, batch):
+        ids = range(first, min(first + batch, count + 1))
+        db.session.execute(Films.__table__.insert(), [
+            {"id": i, "title": f"Film {i}", "description": f"description {i}", "rate": i % 11,
+             "release_date": start + timedelta(days=i % 25000), "poster_url": "https://", "user_id": 1}
+            for i in ids])
+        db.session.execute(films_directors.insert(), [{"film_id": i, "director_id": i % directors_count + 1}
+                                                      for i in ids])
+        db.session.execute(films_genres.insert(), [{"film_id": i, "genres_id": i % genres_count + 1} for i in ids])
+        db.session.execute(users_films.insert(), [{"film_id": i, "user_id": 1} for i in ids])
+    if db.session.get_bind().dialect.name == "postgresql":
+        # rows were inserted with explicit ids, sequences must continue after them
+        for table in (Films.__table__, Directors.__table__, Genres.__table__, User.__table__):
+            db.session.execute(text(f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+                                    f"(SELECT max(id) FROM {table.name}))"))
+    db.session.commit()
+    search.rebuild_index()
+    facets.rebuild()
+    film_search.rebuild()
+    db.session.execute(text("ANALYZE"))
+    db.session.commit()
+
+
+def timeit(func, repeat: int = 20):
+    """ Call func repeat times.
+
+    :returns: list of durations in milliseconds
+    """
+    durations = []
+    for _ in range(repeat):
+        begin = time.perf_counter()
+        func()
+        durations.append((time.perf_counter() - begin) * 1000)
+    return durations
+
+
+def median(values: list):
+    """ Median of not empty list """
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2
@@ -0,0 +1,64 @@
+""" Per-call overhead of films_library Log against the old synchronous logger
+(f-string and strftime on every call, FileHandler written by calling thread).
+
+Run from repository root:
+    python -m benchmarks.logger [--calls 20000]
+"""
+import argparse
+import datetime
+import logging
+import os
+import tempfile
+import time
+from .common import setup_app
+
+
+def per_call_us(func, calls: int):
+    """ Average duration of one func call in microseconds """
+    begin = time.perf_counter()
+    for i in range(calls):
+        func(i)
+    return (time.perf_counter() - begin) / calls * 1e6
+
+
+def old_logger(path: str, level: int):
+    """ Logger configured the way films_library.logger did before queue handler """
+    logger = logging.getLogger("benchmark_old")
+    logger.propagate = False
+    logger.handlers = []
+    handler = logging.FileHandler(path, encoding="utf-8")
+    logger.addHandler(handler)
+    logger.setLevel(level)
+    return logger
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=20000)
+    args = parser.parse_args()
+    setup_app()
+    from films_library.logger import Log
+    params = {"template": "film", "genres": ["Action", "Drama"], "page_number": 3}
+    Log.console_handler.setLevel(logging.CRITICAL)
+
+    def event_time():
+        return datetime.datetime.strftime(datetime.datetime.now(), "%Y.%m.%d-%H:%M")
+
+    print(f"{'level':<10}{'old us':>10}{'new us':>10}")
+    for level_name, level in (("disabled", logging.INFO), ("enabled", logging.DEBUG)):
+        old = old_logger(os.path.join(tempfile.gettempdir(), "films_benchmark_old.log"), level)
+        Log.logger.setLevel(level)
+
+        def old_call(i):
+            old.debug(f"[{event_time()}] -  Films with given params not found. Params: {params}, call {i}")
+
+        def new_call(i):
+            Log.debug("Films with given params not found. Params: %s, call %s", params, i)
+        old_us = per_call_us(old_call, args.calls)
+        new_us = per_call_us(new_call, args.calls)
+        print(f"{level_name:<10}{old_us:>10.2f}{new_us:>10.2f}")
+    Log.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+""" Offset vs keyset (cursor) pagination of films search: page 1 against page 10,000.
+
+Run from repository root:
+    python -m benchmarks.pagination [--films 101000] [--page 10000]
+"""
+import argparse
+from .common import setup_app, seed_films, timeit, median
+
+PAGE_SIZE = 10
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--films", type=int, default=101000, help="catalog size")
+    parser.add_argument("--page", type=int, default=10000, help="deep page number")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    films_app, db = setup_app()
+    from films_library import database
+    seed_films(db, args.films)
+
+    print(f"{'sort':<12}{'page':>8}{'offset ms':>12}{'cursor ms':>12}")
+    for sort_by in (None, "rate", "date"):
+        for sort_type in ("asc", "desc"):
+            for page in (1, args.page):
+                def offset_search():
+                    database.find_films_by_filters(template="", page_number=page, pagination_size=PAGE_SIZE,
+                                                   sort_by=sort_by, sort_type=sort_type)
+                # cursor pointing right before wanted page, as client would get it from previous response
+                if page == 1:
+                    cursor = ""
+                else:
+                    previous = database.find_films_by_filters(template="", page_number=page - 1,
+                                                              pagination_size=PAGE_SIZE,
+                                                              sort_by=sort_by, sort_type=sort_type)
+                    cursor = database.encode_cursor(previous[-1], sort_by=sort_by, sort_type=sort_type)
+
+                def cursor_search():
+                    database.find_films_after_cursor(cursor=cursor, template="", pagination_size=PAGE_SIZE,
+                                                     sort_by=sort_by, sort_type=sort_type)
+                offset_ms = median(timeit(offset_search, args.repeat))
+                cursor_ms = median(timeit(cursor_search, args.repeat))
+                print(f"{(sort_by or 'id') + ' ' + sort_type:<12}{page:>8}{offset_ms:>12.2f}{cursor_ms:>12.2f}")
+    db.session.remove()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+""" Concurrency benchmark of films search: films_app under gunicorn sync workers against async read service
+under uvicorn, with the same count of worker processes on the same seeded catalog.
+
+Run from repository root:
+    python -m benchmarks.read_service [--films 100000] [--workers 4] [--concurrency 1,8,32,128] [--requests 400]
+
+Notices:
+ - catalog is seeded to sqlite file (or to --database-uri, local Postgres for example, which is wiped!).
+   Async service gains most when database round trips are long, so Postgres over network is the fair case.
+ - before measuring, responses of both servers to every search are checked to be byte-identical.
+ - search responses cache is disabled in both servers, otherwise repeated searches measure the cache only.
+ - every request opens its own connection, gunicorn sync workers don't keep connections alive.
+ - client is a thread pool of this process, at high concurrency it may become the bottleneck itself.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+from .api import FILMS_URL, SEED, percentile, search_params
+from .common import ROOT, setup_app, seed_films
+
+APP_DIR = os.path.join(ROOT, "flask_app")
+SERVERS = ("sync", "async")
+
+
+def get(port: int, query: dict):
+    """ One search request by new connection
+
+    :returns: tuple (seconds, status, body)
+    """
+    begin = time.perf_counter()
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+    try:
+        connection.request("GET", FILMS_URL + "?" + urlencode(query))
+        response = connection.getresponse()
+        body = response.read()
+    finally:
+        connection.close()
+    return time.perf_counter() - begin, response.status, body
+
+
+def start_server(kind: str, port: int, workers: int, env: dict):
+    """ Start gunicorn with films_app or uvicorn with read service and wait until it answers """
+    if kind == "sync":
+        command = [sys.executable, "-m", "gunicorn", "-w", str(workers), "-b", f"127.0.0.1:{port}", "app:films_app"]
+    else:
+        command = [sys.executable, "-m", "uvicorn", "films_library.read_service:app", "--workers", str(workers),
+                   "--port", str(port), "--log-level", "warning"]
+    server = subprocess.Popen(command, cwd=APP_DIR, env=env, stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            get(port, {"pagination_size": 1})
+            return server
+        except OSError:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError(f"{kind} server didn't start: {' '.join(command)}")
+
+
+def load(port: int, queries: list, concurrency: int):
+    """ Send all queries by concurrency clients at once
+
+    :returns: dict with latency percentiles in milliseconds, throughput and counts of response statuses
+    """
+    begin = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(lambda query: get(port, query), queries))
+    seconds = time.perf_counter() - begin
+    durations = [duration for duration, _, _ in results]
+    statuses = {}
+    for _, status, _ in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return dict(requests=len(results), statuses=dict(sorted(statuses.items())),
+                p50_ms=round(percentile(durations, 50) * 1000, 3), p95_ms=round(percentile(durations, 95) * 1000, 3),
+                throughput_rps=round(len(results) / seconds, 1))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--films", type=int, default=100000, help="catalog size")
+    parser.add_argument("--workers", type=int, default=4, help="worker processes of every server")
+    parser.add_argument("--concurrency", default="1,8,32,128", help="concurrent clients counts divided by ','")
+    parser.add_argument("--requests", type=int, default=400, help="requests of every concurrency level")
+    parser.add_argument("--ports", default="5101,5102", help="sync and async servers ports")
+    parser.add_argument("--database-uri", default=None, help="database instead of sqlite file, WILL BE WIPED")
+    parser.add_argument("--output", default="read_service_results.json")
+    args = parser.parse_args()
+
+    films_app, db = setup_app(database_uri=args.database_uri)
+    seed_films(db, args.films)
+    db.session.remove()
+    env = dict(os.environ, SEARCH_CACHE_SIZE="0", LOG_MODE="ERROR",
+               SQLALCHEMY_DATABASE_URI=films_app.config["SQLALCHEMY_DATABASE_URI"])
+    ports = dict(zip(SERVERS, (int(port) for port in args.ports.split(","))))
+    rng = random.Random(SEED)
+    queries = [search_params(rng, args.films) for _ in range(args.requests)]
+    servers = {kind: start_server(kind, ports[kind], args.workers, env) for kind in SERVERS}
+    try:
+        different = [query for query in queries[:50] if get(ports["sync"], query)[1:] != get(ports["async"], query)[1:]]
+        if different:
+            raise RuntimeError(f"Servers answered differently to {len(different)} searches, first: {different[0]}")
+        report = dict(meta=dict(films=args.films, workers=args.workers, requests=args.requests,
+                                database=db.engine.dialect.name), results={})
+        print(f"{'clients':>8} {'server':<6}{'p50 ms':>10}{'p95 ms':>10}{'req/s':>10}  statuses")
+        for concurrency in [int(value) for value in args.concurrency.split(",")]:
+            for kind in SERVERS:
+                result = report["results"].setdefault(str(concurrency), {})[kind] = \
+                    load(ports[kind], queries, concurrency)
+                print(f"{concurrency:>8} {kind:<6}{result['p50_ms']:>10.2f}{result['p95_ms']:>10.2f}"
+                      f"{result['throughput_rps']:>10.1f}  {result['statuses']}")
+    finally:
+        for server in servers.values():
+            server.terminate()
+            server.wait()
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"Saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
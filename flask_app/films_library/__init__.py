@@ -1,28 +1,56 @@
 """ Main films_app package entrypoint  """
 import os
+import tempfile
 from flask import Flask
 from flask_login import LoginManager
 from flask_restx import Api
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from .logger import Log
+from .routing import RoutingSession, REPLICA_PREFIX
+from . import pools
 
 
 def create_app():
     """ Films_app factory function """
     app = Flask(__name__)
+    replicas = [uri.strip() for uri in os.environ.get('REPLICA_DATABASE_URIS', default='').split(',') if uri.strip()]
     app.config.from_mapping(SECRET_KEY=os.environ.get('SECRET_KEY', default='dev'),
                             SQLALCHEMY_TRACK_MODIFICATIONS=False,
-                            SQLALCHEMY_DATABASE_URI=os.environ.get('SQLALCHEMY_DATABASE_URI'))
+                            SQLALCHEMY_DATABASE_URI=os.environ.get('SQLALCHEMY_DATABASE_URI'),
+                            # async read service database, SQLALCHEMY_DATABASE_URI with async driver by default
+                            ASYNC_DATABASE_URI=os.environ.get('ASYNC_DATABASE_URI'),
+                            # read replicas, see routing.py. Binds don't take SQLALCHEMY_ENGINE_OPTIONS
+                            SQLALCHEMY_BINDS={f"{REPLICA_PREFIX}{i}": dict(pools.engine_options(uri), url=uri)
+                                              for i, uri in enumerate(replicas)},
+                            # pools of primary and replicas, see pools.py
+                            SQLALCHEMY_ENGINE_OPTIONS=pools.engine_options(os.environ.get('SQLALCHEMY_DATABASE_URI')),
+                            DB_STATEMENT_TIMEOUT_MS=int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', default=0)),
+                            READ_YOUR_WRITES_SECONDS=float(os.environ.get('READ_YOUR_WRITES_SECONDS', default=5)),
+                            TRIGRAM_INDEX=os.environ.get('TRIGRAM_INDEX', default='0') == '1',
+                            TRIGRAM_INDEX_MAX_FILMS=int(os.environ.get('TRIGRAM_INDEX_MAX_FILMS', default=500000)),
+                            TRIGRAM_INDEX_CHECK_SECONDS=float(os.environ.get('TRIGRAM_INDEX_CHECK_SECONDS', default=5)),
+                            SEARCH_CACHE_SIZE=int(os.environ.get('SEARCH_CACHE_SIZE', default=1024)),
+                            SEARCH_CACHE_TTL=float(os.environ.get('SEARCH_CACHE_TTL', default=60)),
+                            IMPORT_WORKERS=int(os.environ.get('IMPORT_WORKERS', default=2)),
+                            NAMES_CACHE_SIZE=int(os.environ.get('NAMES_CACHE_SIZE', default=10000)),
+                            USERS_CACHE_SIZE=int(os.environ.get('USERS_CACHE_SIZE', default=10000)),
+                            USERS_CACHE_TTL=float(os.environ.get('USERS_CACHE_TTL', default=60)),
+                            USERS_CACHE_STAMP=os.environ.get('USERS_CACHE_STAMP', default=os.path.join(
+                                tempfile.gettempdir(), "films_library_users.stamp")),
+                            FACETS_LIMIT=int(os.environ.get('FACETS_LIMIT', default=20)),
+                            SLOW_QUERY_MS=float(os.environ.get('SLOW_QUERY_MS', default=0)),
+                            SLOW_QUERY_SAMPLE_RATE=float(os.environ.get('SLOW_QUERY_SAMPLE_RATE', default=1.0)))
     db.init_app(app)
     migrate.init_app(app, db)
     login_manager.init_app(app)
     app.app_context().push()
-    Log.debug(f"Created app. SQLALCHEMY_DATABASE_URI={os.environ.get('SQLALCHEMY_DATABASE_URI')}")
+    pools.setup(app)
+    Log.debug("Created app. SQLALCHEMY_DATABASE_URI=%s", os.environ.get('SQLALCHEMY_DATABASE_URI'))
     return app
 
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 login_manager = LoginManager()
 migrate = Migrate()
 
@@ -1,12 +1,31 @@
 """ Api for general things """
+import json
+import zlib
 from datetime import datetime
+from flask import request, Response, stream_with_context
 from flask_login import login_required, current_user, login_user, logout_user
-from flask_restx import Resource, fields, reqparse
+from flask_restx import Resource, fields, reqparse, marshal, inputs
+from werkzeug.http import quote_etag
 from . import films_api
 from . import database
 from . import models
+from . import bulk_import
+from . import metrics
+from . import slow_queries
+from . import pools
+from .routing import replica_reads
 from .errors import NotAuthenticatedError, UserPermissionError, NotFoundError, BadRequestError
 from .logger import Log
+from .cache import LRUCache, catalog_state, catalog_generation, sync_names_caches, search_key, catalog_etag
+from . import films_app
+
+# GET /api/films/ responses by catalog generation and search parameters
+search_cache = LRUCache(max_size=films_app.config["SEARCH_CACHE_SIZE"], ttl=films_app.config["SEARCH_CACHE_TTL"],
+                        name="search")
+# films counts of searches by filters only, so all pages and sortings of search share one count
+totals_cache = LRUCache(max_size=films_app.config["SEARCH_CACHE_SIZE"], ttl=films_app.config["SEARCH_CACHE_TTL"],
+                        name="totals")
+TOTAL_MODES = ("exact", "estimate")
 
 # json models
 film_model = films_api.model("Film", {"id": fields.Integer(required=True),
@@ -24,16 +43,86 @@ user_model = films_api.model("User", {"id": fields.Integer(), "nickname": fields
                                       "city": fields.String(), "street": fields.String(),
                                       "is_admin": fields.Boolean(), "films": fields.List(fields.String)})
 
+film_export_model = films_api.inherit("FilmExport", film_model, {"updated_at": fields.DateTime()})
+
 director_model = films_api.model("Director", {"id": fields.Integer(), "full_name": fields.String()})
 
 
+def etag_headers(etag: str):
+    """ Headers of successful response, client revalidates it by If-None-Match """
+    return {"ETag": quote_etag(etag, weak=True)}
+
+
+def not_modified(etag: str, req=None):
+    """ Empty 304 response if client's cached response has the same ETag
+
+    :param req: (optional) request, current one by default
+
+    :returns: Response or None if client has no such response
+    """
+    if (req or request).if_none_match.contains_weak(etag):
+        return Response(status=304, headers=etag_headers(etag))
+
+
+def films_total(generation: int, mode: str, **filters):
+    """ Count of films found by filters, cached until catalog changes
+
+    :param int generation: current catalog generation
+
+    :param str mode: 'exact' or 'estimate'
+
+    :returns: tuple (count, True if count is exact)
+    """
+    key = generation, mode, search_key(**filters)
+    total = totals_cache.get(key)
+    if total is None:
+        total = database.count_films(estimate=mode == "estimate", **filters)
+        totals_cache.set(key, total)
+    return total
+
+
+def films_search_params(req=None):
+    """ Parse GET /api/films/ parameters filling defaults of not passed ones.
+
+    :param req: (optional) request to parse instead of current one
+
+    :returns: dict with template, page_number, pagination_size, date_from, date_to, genres, directors, sort_by,
+              sort_type, search, match_mode, cursor, facets and total keys. Aborts with 400 on wrong values
+    """
+    parser = reqparse.RequestParser()
+    parser.add_argument("template")
+    parser.add_argument("page_number", type=int, help="Integer number of viewing page.")
+    parser.add_argument("pagination_size", type=int, help="Count of items on 1 page.")
+    parser.add_argument("date_from", help="Beginning of dates filter range. ")
+    parser.add_argument("date_to", help="End of dates filter range. ")
+    parser.add_argument("genres", help="List of genres for filter. ")
+    parser.add_argument("directors", help="List of genres for filter. ")
+    parser.add_argument("sort_by", help="sorting mode 'rate', 'date' or None. None is Default.")
+    parser.add_argument("sort_type", help="sorting mode 'asc' (ascending) or 'desc' (descending).'asc' is Default")
+    parser.add_argument("search", help="Full-text search by title and description words.")
+    parser.add_argument("match_mode", help="'any' (default) or 'all' of passed genres/directors must match.")
+    parser.add_argument("cursor", help="Keyset pagination cursor. Empty for the first page.")
+    parser.add_argument("facets", type=inputs.boolean, default=False,
+                        help="Add counts of found films by genres, directors and years.")
+    parser.add_argument("total", choices=TOTAL_MODES, help="Add count of found films, 'exact' or 'estimate'.")
+    params = parser.parse_args(req=req)
+    # fix params if not in GET
+    return dict(template="" if params["template"] is None else params["template"],
+                page_number=1 if params["page_number"] is None else int(params["page_number"]),
+                pagination_size=10 if params["pagination_size"] is None else params["pagination_size"],
+                date_from=params["date_from"], date_to=params["date_to"], genres=params["genres"],
+                directors=params["directors"], sort_by=params["sort_by"], sort_type=params["sort_type"],
+                search=params["search"], match_mode=params["match_mode"], cursor=params["cursor"],
+                facets=params["facets"], total=params["total"])
+
+
 @films_api.route("/api/films/")
 class FilmsManipulator(Resource):
     """ Resource class for filtering films.
     :methods: GET, POST, DELETE, PUT
     """
 
-    @films_api.marshal_with(film_model)
+    @films_api.response(200, "Found films", [film_model])
     @films_api.doc(params={"template": "film name partial match",
                            "pagination_size": "size of pagination per 1 page",
                            "page_number": "number of search page",
@@ -42,51 +131,88 @@ class FilmsManipulator(Resource):
                            "directors": "(optional) list of directors for filtering",
                            "genres": "(optional) list of genres for filtering",
                            "sort_by": "(optional) sorting mode 'rate', 'date' or None. None is Default",
-                           "sort_type": "(optional) sorting type 'desc', 'asc'. None is Default"
+                           "sort_type": "(optional) sorting type 'desc', 'asc'. None is Default",
+                           "search": "(optional) full-text search by title and description words. "
+                                     "Films are ordered by relevance if sort_by isn't passed",
+                           "match_mode": "(optional) 'any' (default) or 'all' of passed genres/directors must match",
+                           "cursor": "(optional) keyset pagination cursor. Pass it empty for the first page "
+                                     "and next_cursor from response for the next ones. page_number is ignored",
+                           "facets": "(optional) true adds counts of all found films by genres, directors "
+                                     "and release years to response",
+                           "total": "(optional) 'exact' or 'estimate' adds count of all found films to response, "
+                                    "total_exact tells if it is exact"
                            })
+    @replica_reads()
     def get(self):
         """ Film search with pagination, 10 items by default.
-        :returns Films list which match search parameters or 404
+        :returns Films list which match search parameters or 404.
+                 In cursor mode returns dict with 'films' list and 'next_cursor'.
+                 With facets or total returns dict with 'films' list, 'facets', 'total' and 'total_exact'
+                 (and 'next_cursor' in cursor mode)
+                 304 to If-None-Match with ETag of previous response if catalog wasn't changed since it
         """
-        # parsing the GET params
-        parser = reqparse.RequestParser()
-        parser.add_argument("template")
-        parser.add_argument("page_number", type=int, help="Integer number of viewing page.")
-        parser.add_argument("pagination_size", type=int, help="Count of items on 1 page.")
-        parser.add_argument("date_from", help="Beginning of dates filter range. ")
-        parser.add_argument("date_to", help="End of dates filter range. ")
-        parser.add_argument("genres", help="List of genres for filter. ")
-        parser.add_argument("directors", help="List of genres for filter. ")
-        parser.add_argument("sort_by", help="sorting mode 'rate', 'date' or None. None is Default.")
-        parser.add_argument("sort_type", help="sorting mode 'asc' (ascending) or 'desc' (descending).'asc' is Default")
-        params = parser.parse_args()
-        # fix params if not in GET
-        pagination_size = 10 if params["pagination_size"] is None else params["pagination_size"]
-        page_number = 1 if params["page_number"] is None else int(params["page_number"])
-        template = "" if params["template"] is None else params["template"]
-        date_from = params["date_from"] if params["date_from"] is not None else None
-        date_to = params["date_to"] if params["date_to"] is not None else None
-        genres = params["genres"] if params["genres"] is not None else None
-        directors = params["directors"] if params["directors"] is not None else None
-        sort_by = params["sort_by"] if params["sort_by"] is not None else None
-        sort_type = params["sort_type"] if params["sort_type"] is not None else None
+        params = films_search_params()
+        template, date_from, date_to = params["template"], params["date_from"], params["date_to"]
+        page_number, pagination_size = params["page_number"], params["pagination_size"]
+        genres, directors, match_mode = params["genres"], params["directors"], params["match_mode"]
+        sort_by, sort_type, search = params["sort_by"], params["sort_type"], params["search"]
+        cursor, with_facets, total_mode = params["cursor"], params["facets"], params["total"]
+
+        # the same searches are repeated a lot, so responses are cached until catalog changes
+        generation, dictionary_generation = catalog_state()
+        sync_names_caches(dictionary_generation)
+        key = generation, search_key(**params)
+        # pollers get 304 without reading films at all
+        etag = catalog_etag(*key)
+        response = not_modified(etag)
+        if response is not None:
+            return response
+        response = search_cache.get(key)
+        if response is not None:
+            Log.debug("Films search response taken from cache.")
+            return response + (etag_headers(etag),) if response[1] == 200 else response
 
         # filtering all films by all possible args.
         # partial range (only from/only to some date) also supported
         try:
-            films_data = database.find_films_by_filters(template=template, date_from=date_from, date_to=date_to,
-                                                        page_number=page_number, pagination_size=pagination_size,
-                                                        genres=genres, directors=directors, sort_by=sort_by,
-                                                        sort_type=sort_type)
+            if cursor is None:
+                films_data = database.find_films_by_filters(template=template, date_from=date_from, date_to=date_to,
+                                                            page_number=page_number, pagination_size=pagination_size,
+                                                            genres=genres, directors=directors, sort_by=sort_by,
+                                                            sort_type=sort_type, match_mode=match_mode,
+                                                            search=search)
+            else:
+                films_data, next_cursor = database.find_films_after_cursor(cursor=cursor, template=template,
+                                                                           date_from=date_from, date_to=date_to,
+                                                                           pagination_size=pagination_size,
+                                                                           genres=genres, directors=directors,
+                                                                           sort_by=sort_by, sort_type=sort_type,
+                                                                           match_mode=match_mode, search=search)
         except ValueError as e:
             Log.error(e)
             return str(e), 403
         except NotFoundError as n:
             Log.error(n)
-            return n.message, n.status_code
+            response = n.message, n.status_code
         else:
             Log.info("Found some films by given filters.")
-            return films_data, 200
+            if cursor is None and not with_facets and total_mode is None:
+                response = marshal(films_data, film_model), 200
+            else:
+                response = {"films": marshal(films_data, film_model)}
+                if cursor is not None:
+                    response["next_cursor"] = next_cursor
+                if with_facets:
+                    response["facets"] = database.count_facets(template=template, date_from=date_from,
+                                                               date_to=date_to, genres=genres, directors=directors,
+                                                               match_mode=match_mode, search=search)
+                if total_mode is not None:
+                    response["total"], response["total_exact"] = films_total(
+                        generation, total_mode, template=template, date_from=date_from, date_to=date_to,
+                        genres=genres, directors=directors, match_mode=match_mode, search=search)
+                response = response, 200
+        search_cache.set(key, response)
+        return response + (etag_headers(etag),) if response[1] == 200 else response
 
     @films_api.doc(params={"title": "string title of the film",
                            "description": " string film description",
@@ -133,9 +259,9 @@ class FilmsManipulator(Resource):
                                          directors=directors, rate=rate,
                                          poster_url=poster_url, genres=genres)
             except ValueError:
-                Log.error(f"Film {title} already exists!")
+                Log.error("Film %s already exists!", title)
                 return "Current film already exists!", 403
-            Log.info(f"Film {title} added successfully.")
+            Log.info("Film %s added successfully.", title)
             return film.to_dict(), 201
 
     # @films_api.marshal_with(film_model, code=200, envelope="films")
@@ -152,7 +278,8 @@ class FilmsManipulator(Resource):
         if current_user.is_authenticated:
             film = models.Films.query.filter_by(id=film_id).first()
             if film is not None:
-                Log.error(f"{current_user.nickname}, {current_user.id}, {film_id}, {current_user.id == film.user_id}")
+                Log.error("%s, %s, %s, %s", current_user.nickname, current_user.id, film_id,
+                          current_user.id == film.user_id)
                 if current_user.is_admin or current_user.id == film.user_id:
                     try:
                         film = database.delete_film(film_id)
@@ -166,7 +293,7 @@ class FilmsManipulator(Resource):
                         Log.error(v)
                         return str(v), 404
                     else:
-                        Log.info(f"Film {film.title} deleted successfully.")
+                        Log.info("Film %s deleted successfully.", film.title)
                         return film.to_dict(), 200
                 else:
                     Log.error(UserPermissionError.message)
@@ -221,6 +348,89 @@ class FilmsManipulator(Resource):
             return edition, 200
 
 
+@films_api.route("/api/films/export/")
+class FilmsExport(Resource):
+    """ Full catalog export flask resource.
+
+    :methods: GET
+    """
+    @films_api.doc(params={"updated_since": "(optional) date in %Y.%m.%d or ISO format. "
+                                            "Only films changed since this moment are exported"})
+    @films_api.produces(["application/x-ndjson"])
+    @replica_reads()
+    def get(self):
+        """ Stream every film with its genres and directors as NDJSON, one film per line.
+        Response is gzipped if client accepts it.
+        """
+        parser = reqparse.RequestParser()
+        parser.add_argument("updated_since", location="args", help="Export only films changed since this date.")
+        params = parser.parse_args()
+        try:
+            films = database.export_films(updated_since=params["updated_since"])
+        except ValueError as v:
+            Log.error(v)
+            return str(v), BadRequestError.status_code
+
+        def lines():
+            # genres and directors of every batch are loaded while streaming
+            with replica_reads():
+                for film in films:
+                    yield json.dumps(marshal(film, film_export_model)) + "\n"
+
+        def gzipped(chunks):
+            compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+            for chunk in chunks:
+                data = compressor.compress(chunk.encode("utf-8"))
+                if data:
+                    yield data
+            yield compressor.flush()
+
+        headers = {"Vary": "Accept-Encoding"}
+        body = lines()
+        if request.accept_encodings["gzip"]:
+            headers["Content-Encoding"] = "gzip"
+            body = gzipped(body)
+        Log.info("Exporting films catalog.")
+        return Response(stream_with_context(body), mimetype="application/x-ndjson", headers=headers)
+
+
+@films_api.route("/api/films/import/")
+class FilmsImport(Resource):
+    """ Bulk films import flask resource. Only for admins.
+
+    :methods: POST
+    """
+    @films_api.doc(params={"format": "'csv' or 'ndjson', by default taken from Content-Type",
+                           "batch_size": "(optional) films inserted in one transaction, 1000 by default",
+                           "workers": "(optional) count of parsing processes"
+                           })
+    @login_required
+    def post(self):
+        """ Import films from request body streamed as CSV (columns like tests/films.csv) or NDJSON.
+        :returns import report with imported/duplicates/invalid counts and rows_per_second
+        """
+        if not current_user.is_admin:
+            Log.warning(UserPermissionError.message)
+            return UserPermissionError.message, UserPermissionError.status_code
+        parser = reqparse.RequestParser()
+        parser.add_argument("format", location="args")
+        parser.add_argument("batch_size", type=int, location="args", help="Films inserted in one transaction.")
+        parser.add_argument("workers", type=int, location="args", help="Count of parsing processes.")
+        params = parser.parse_args()
+        data_format = params["format"]
+        if data_format is None:
+            data_format = "ndjson" if "json" in (request.mimetype or "") else "csv"
+        batch_size = 1000 if params["batch_size"] is None else params["batch_size"]
+        workers = films_app.config["IMPORT_WORKERS"] if params["workers"] is None else params["workers"]
+        try:
+            report = bulk_import.import_films(request.stream, data_format, batch_size=batch_size, workers=workers)
+        except ValueError as v:
+            Log.error(v)
+            return str(v), BadRequestError.status_code
+        Log.info("Imported %s films.", report['imported'])
+        return report, 201
+
+
 @films_api.route("/api/directors/")
 class DirectorsManipulator(Resource):
     """ Directors flask resource.
@@ -240,7 +450,7 @@ class DirectorsManipulator(Resource):
             director = database.add_director(name)
             return director, 201
         else:
-            Log.error(f"Director {name} already added")
+            Log.error("Director %s already added", name)
             return f"Director {name} already added", BadRequestError.status_code
 
     @films_api.doc(params={"director_name": "Name of director for deleting"})
@@ -265,19 +475,27 @@ class UserProfile(Resource):
 
      :methods: GET, PUT
      """
-    @films_api.marshal_with(user_model, code=200, envelope="users")
+    @films_api.response(200, "Current user profile under 'users' key", user_model)
     @login_required
+    @replica_reads()
     def get(self):
         """
         Get registered current user profile with GET method.
+        Answers 304 to If-None-Match with ETag of previous response if user and catalog weren't changed.
         """
         if current_user is not None:
             if current_user.is_authenticated:
+                # profile lists user's films, so it changes with catalog too
+                etag = catalog_etag(catalog_generation(), tuple(getattr(current_user, column)
+                                                                   for column in current_user.COLUMNS))
+                response = not_modified(etag)
+                if response is not None:
+                    return response
                 user = current_user.to_dict()
-                return user, 200
+                return marshal(user, user_model, envelope="users"), 200, etag_headers(etag)
             else:
                 Log.warning("You must login for view profile")
-                return "You must login for view profile", 401
+                return marshal("You must login for view profile", user_model, envelope="users"), 401
 
     @films_api.doc(params={"user_id": "User id",
                            "is_admin": "bool admin mode"
@@ -309,7 +527,7 @@ class UserProfile(Resource):
                 Log.error(n.message)
                 return n.message, n.status_code
             else:
-                Log.info(f"Changed admin mode for user with id={user_id}")
+                Log.info("Changed admin mode for user with id=%s", user_id)
                 return "Success!", 200
         else:
             Log.warning(UserPermissionError.message)
@@ -341,14 +559,14 @@ class UserLogin(Resource):
             return "Not all data passed", 403
 
         if current_user.is_authenticated:
-            Log.warning(f"{current_user.nickname} already logged in!")
+            Log.warning("%s already logged in!", current_user.nickname)
             return f"{current_user.nickname} already logged in!", 303
 
         user = models.User.query.filter_by(email=email).first()
         if user is not None and user.check_password(password):
             login_user(user, remember=True)
-            Log.info(f"User {user.nickname} with id {user.id} logged in.")
-            return user.to_dict(), 200
+            Log.info("User %s with id %s logged in.", user.nickname, user.id)
+            return marshal(user.to_dict(), user_model, envelope="users"), 200
         return "Wrong email/password pair", 204
 
 
@@ -364,7 +582,7 @@ class UserLogout(Resource):
         if current_user.is_authenticated:
             name = current_user.nickname
             logout_user()
-            Log.info(f"User {name} logged out.")
+            Log.info("User %s logged out.", name)
             return name, 200
         else:
             Log.warning("Only logged in users can logout!")
@@ -408,7 +626,7 @@ class UserRegister(Resource):
             return "Needs email and password both for register", 403
 
         if current_user.is_authenticated:
-            Log.warning(f"{current_user.nickname} already logged in! Please logout for new registering")
+            Log.warning("%s already logged in! Please logout for new registering", current_user.nickname)
             return f"{current_user.nickname} already logged in! Please logout for new registering", 303
 
         user = models.User.query.filter_by(email=email).first()
@@ -420,8 +638,37 @@ class UserRegister(Resource):
                 Log.error(v)
                 return v, 403
             else:
-                Log.info(f"User {nickname} with email {email} registered")
+                Log.info("User %s with email %s registered", nickname, email)
                 return user.to_dict(), 200
         else:
-            Log.error(f"User already registered!")
+            Log.error("User already registered!")
             return f"User already registered!", 403
+
+
+# service api
+@films_api.route("/api/metrics")
+class Metrics(Resource):
+    """ Prometheus metrics resource.
+
+    :methods: GET
+    """
+
+    def get(self):
+        """ Requests latency and database work metrics of all workers in Prometheus text format. """
+        data, content_type = metrics.latest()
+        return Response(data, content_type=content_type)
+
+
+@films_api.route("/api/health/ready")
+class Readiness(Resource):
+    """ Readiness probe resource for load balancer and orchestrator.
+
+    :methods: GET
+    """
+
+    def get(self):
+        """ Ping databases, 200 if all of them answered, 503 otherwise. Pools statistics of answering worker. """
+        ready, binds = pools.readiness(films_app)
+        if not ready:
+            Log.error("Not ready: %s", binds)
+        return {"ready": ready, "databases": binds}, 200 if ready else 503
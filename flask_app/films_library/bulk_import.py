@@ -0,0 +1,287 @@
+""" Streaming bulk import of films catalog from CSV or NDJSON.
+
+ Notices:
+ - CSV columns are the same as tests/films.csv has:
+   title, description, directors, rate, date, poster_url, user_id, genres
+   where directors and genres are lists divided by ','.
+ - NDJSON lines are objects with the same keys, directors and genres can be lists or strings.
+ - rows are parsed and validated by worker processes, database work is done by calling process:
+   every batch is one transaction, directors/genres/users are resolved by preloaded maps.
+ - films already in database (same title and release date) are skipped as duplicates.
+ """
+import csv
+import json
+import multiprocessing
+import time
+from datetime import datetime
+import click
+from sqlalchemy import select, tuple_
+from . import db, films_app
+from .models import Films, Directors, Genres, User, films_directors, films_genres, users_films
+from .cache import bump_catalog_generation, directors_ids, genres_ids
+from . import search as full_text
+from . import trigram
+from . import facets
+from . import film_search
+from .logger import Log
+
+FORMATS = ("csv", "ndjson")
+CSV_COLUMNS = ("title", "description", "directors", "rate", "date", "poster_url", "user_id", "genres")
+# count of records sent to parsing worker at once
+PARSE_CHUNK_SIZE = 500
+# count of bad rows described in import report
+MAX_REPORTED_ERRORS = 100
+
+
+def _names(value, field: str):
+    """ Directors/genres names from list or string like 'name1,name2'
+
+    :raise ValueError if value isn't string or list of strings
+    """
+    if value is None:
+        return []
+    if isinstance(value, str):
+        value = value.split(",")
+    elif not isinstance(value, list) or not all(isinstance(name, str) for name in value):
+        raise ValueError(f"Field {field} must be string or list of strings")
+    return [name.strip() for name in value if name.strip()]
+
+
+def validate_record(record: dict):
+    """ Check and convert film's record fields.
+
+    :param dict record: raw film data with CSV_COLUMNS keys
+
+    :returns: dict ready for inserting
+
+    :raise ValueError if record is wrong
+    """
+    for field in ("title", "description", "poster_url"):
+        if record.get(field) is not None and not isinstance(record[field], str):
+            raise ValueError(f"Field {field} must be string")
+    title = (record.get("title") or "").strip()
+    if not title:
+        raise ValueError("Film title is empty")
+    try:
+        release_date = datetime.strptime(str(record.get("date")).strip(), "%Y.%m.%d")
+    except ValueError:
+        raise ValueError(f"Wrong date {record.get('date')}, must be like 2010.10.10")
+    try:
+        rate = float(record.get("rate") or 0)
+        user_id = int(record.get("user_id"))
+    except (TypeError, ValueError):
+        raise ValueError("Rate must be a number and user_id must be an integer")
+    if not 0 <= rate <= 10:
+        raise ValueError(f"Rate {rate} isn't between 0 and 10")
+    return dict(title=title, description=record.get("description"), rate=rate, release_date=release_date,
+                poster_url=record.get("poster_url") or "https://", user_id=user_id,
+                directors=_names(record.get("directors"), "directors"), genres=_names(record.get("genres"), "genres"))
+
+
+def _parse_chunk(args):
+    """ Worker process job: parse and validate chunk of raw records.
+
+    :param tuple args: (format, first record number, list of raw records text)
+
+    :returns: tuple (list of valid rows, list of errors descriptions)
+    """
+    data_format, first_number, records = args
+    rows, errors = [], []
+    for number, text in enumerate(records, start=first_number):
+        try:
+            if data_format == "csv":
+                values = next(csv.reader([text]))
+                if len(values) != len(CSV_COLUMNS):
+                    raise ValueError(f"Expected {len(CSV_COLUMNS)} columns, got {len(values)}")
+                record = dict(zip(CSV_COLUMNS, values))
+            else:
+                record = json.loads(text)
+                if not isinstance(record, dict):
+                    raise ValueError("Line must be json object")
+            rows.append(validate_record(record))
+        except (ValueError, csv.Error) as e:
+            errors.append(f"record {number}: {e}")
+    return rows, errors
+
+
+def _records(lines, data_format: str):
+    """ Split text lines stream to raw records text. CSV record can take several lines if it has quoted newlines.
+
+    :returns: generator of strings
+    """
+    record = ""
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        record += line
+        # odd count of quotes means newline is inside quoted csv field
+        if data_format == "csv" and record.count('"') % 2:
+            continue
+        if record.strip():
+            yield record.rstrip("\r\n")
+        record = ""
+    if record.strip():
+        yield record.rstrip("\r\n")
+
+
+def _chunks(records, data_format: str):
+    """ Group raw records to parsing jobs """
+    chunk, first_number = [], 1
+    for number, record in enumerate(records, start=1):
+        chunk.append(record)
+        if len(chunk) == PARSE_CHUNK_SIZE:
+            yield data_format, first_number, chunk
+            chunk, first_number = [], number + 1
+    if chunk:
+        yield data_format, first_number, chunk
+
+
+def _resolve_names(names: set, names_cache, known: dict):
+    """ Find ids of names missing in known map, inserting names which are new for database.
+    Names inserted at the same time by other workers are skipped by insert and read after it.
+
+    :param names_cache: NamesCache of directors or genres
+
+    :param dict known: name -> id map, updated in place
+    """
+    missing = sorted(names - known.keys())
+    if missing:
+        known.update(names_cache.upsert(missing)[0])
+
+
+class CatalogImporter:
+    """ Batched films writer with in-memory maps of directors, genres and users.
+
+    :param int batch_size: count of films inserted in one transaction
+    """
+
+    def __init__(self, batch_size: int = 1000):
+        self.batch_size = batch_size
+        self.directors = {name: director_id for director_id, name in
+                          db.session.execute(select(Directors.id, Directors.full_name))}
+        self.genres = {name: genre_id for genre_id, name in db.session.execute(select(Genres.id, Genres.name))}
+        self.users = set(db.session.execute(select(User.id)).scalars())
+        self.imported = 0
+        self.duplicates = 0
+        self.errors = []
+        self.errors_count = 0
+        self._batch = []
+
+    def add_error(self, error: str):
+        """ Count bad row, keeping first MAX_REPORTED_ERRORS descriptions """
+        self.errors_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(error)
+
+    def add(self, row: dict):
+        """ Queue validated row, writing batch when it's full """
+        if row["user_id"] not in self.users:
+            self.add_error(f"film {row['title']}: user with id={row['user_id']} not found")
+            return
+        self._batch.append(row)
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """ Write queued rows in one transaction """
+        batch, self._batch = self._batch, []
+        if not batch:
+            return
+        # skipping films which are already in database or twice in batch
+        keys = {(row["title"], row["release_date"]) for row in batch}
+        existing = set(db.session.execute(select(Films.title, Films.release_date)
+                                          .where(tuple_(Films.title, Films.release_date).in_(list(keys)))))
+        rows = []
+        for row in batch:
+            key = row["title"], row["release_date"]
+            if key in existing:
+                self.duplicates += 1
+            else:
+                existing.add(key)
+                rows.append(row)
+        if not rows:
+            return
+
+        _resolve_names({name for row in rows for name in row["directors"]}, directors_ids, self.directors)
+        _resolve_names({name for row in rows for name in row["genres"]}, genres_ids, self.genres)
+        films_table = Films.__table__
+        columns = ("title", "description", "rate", "release_date", "poster_url", "user_id")
+        films_ids = db.session.execute(films_table.insert().returning(films_table.c.id, sort_by_parameter_order=True),
+                                       [{column: row[column] for column in columns} for row in rows]).scalars().all()
+        directors_links, genres_links, users_links, indexed = [], [], [], []
+        for film_id, row in zip(films_ids, rows):
+            directors_links += [{"film_id": film_id, "director_id": self.directors[name]}
+                                for name in dict.fromkeys(row["directors"])]
+            genres_links += [{"film_id": film_id, "genres_id": self.genres[name]} for name in dict.fromkeys(row["genres"])]
+            users_links.append({"film_id": film_id, "user_id": row["user_id"]})
+            indexed.append({"id": film_id, "title": row["title"], "description": row["description"]})
+        for table, links in ((films_directors, directors_links), (films_genres, genres_links),
+                             (users_films, users_links)):
+            if links:
+                db.session.execute(table.insert(), links)
+        facets.add_films(films_ids)
+        film_search.refresh_films(films_ids)
+        full_text.index_new_films(indexed)
+        generation = bump_catalog_generation()
+        db.session.commit()
+        trigram.index_films([(film["id"], film["title"]) for film in indexed], generation)
+        self.imported += len(rows)
+
+
+def import_films(lines, data_format: str, batch_size: int = 1000, workers: int = 1):
+    """ Import films from text lines stream.
+
+    :param lines: iterable of str/bytes lines, file object or request stream for example
+
+    :param str data_format: 'csv' or 'ndjson'
+
+    :param int batch_size: count of films inserted in one transaction
+
+    :param int workers: count of parsing processes, 1 parses in calling process
+
+    :returns: dict import report
+
+    :raise ValueError if format is unknown
+    """
+    if data_format not in FORMATS:
+        Log.error("Unknown import format %s", data_format)
+        raise ValueError(f"Import format must be one of {', '.join(FORMATS)}!")
+    started = time.perf_counter()
+    importer = CatalogImporter(batch_size=batch_size)
+    jobs = _chunks(_records(lines, data_format), data_format)
+    pool = multiprocessing.Pool(workers) if workers > 1 else None
+    try:
+        parsed = pool.imap(_parse_chunk, jobs) if pool is not None else map(_parse_chunk, jobs)
+        for rows, errors in parsed:
+            for error in errors:
+                importer.add_error(error)
+            for row in rows:
+                importer.add(row)
+        importer.flush()
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        if pool is not None:
+            pool.terminate()
+    seconds = time.perf_counter() - started
+    report = dict(imported=importer.imported, duplicates=importer.duplicates, invalid=importer.errors_count,
+                  errors=importer.errors, seconds=round(seconds, 3),
+                  rows_per_second=round(importer.imported / seconds, 1) if seconds else 0.0)
+    Log.info("Films import finished: %s", report)
+    return report
+
+
+@films_app.cli.command("import-films")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "data_format", type=click.Choice(FORMATS), default=None,
+              help="Input format, by default taken from file extension.")
+@click.option("--batch-size", default=1000, show_default=True, help="Films inserted in one transaction.")
+@click.option("--workers", default=multiprocessing.cpu_count(), show_default=True, help="Parsing processes.")
+def import_films_command(path, data_format, batch_size, workers):
+    """ Bulk import films catalog from CSV or NDJSON file. """
+    if data_format is None:
+        data_format = "ndjson" if path.endswith((".ndjson", ".jsonl")) else "csv"
+    with open(path, encoding="utf-8", newline="") as file:
+        report = import_films(file, data_format, batch_size=batch_size, workers=workers)
+    click.echo(json.dumps(report, indent=2))
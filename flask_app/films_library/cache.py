@@ -0,0 +1,402 @@
+""" Process-local caches and catalog generation counter they are invalidated by.
+
+ Notices:
+ - every worker has its own caches, so cached values must be keyed by catalog generation.
+   Generation lives in database (catalog_state table) and is increased in the same transaction
+   as catalog change, so other workers see new generation exactly when they can see the change.
+ - directors/genres names caches are dropped when dictionary generation changes. It is increased
+   only by deleting dictionary rows, new rows don't make cached ids wrong.
+ - ids of names inserted by current transaction get to cache only after commit, so rolled back
+   rows are never cached.
+ - users snapshots are dropped by any committed change of users rows. Other workers learn about it
+   by modification time of stamp file, so admin mode changes take effect at once everywhere.
+ - ETags of responses are made of catalog generation and normalized request, so they are the same
+   in every process and change with every catalog change.
+ """
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy import select, event
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session, object_session
+from . import db, films_app, metrics
+from .models import CatalogState, Directors, Genres, User, UserSnapshot
+
+CATALOG_STATE_ID = 1
+# current generations row, read by catalog_state() and by async read service
+CATALOG_STATE_SELECT = select(CatalogState.generation, CatalogState.dictionary_generation)\
+    .where(CatalogState.id == CATALOG_STATE_ID)
+# dialects INSERT constructs supporting ON CONFLICT clause
+DIALECT_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+def insert_or_ignore(table):
+    """ INSERT statement of current database dialect which skips rows breaking unique constraints
+    (INSERT ... ON CONFLICT DO NOTHING). Skipped rows aren't returned by RETURNING clause.
+
+    :param table: Table or model
+
+    :returns: Insert statement
+    """
+    return DIALECT_INSERTS[db.session.get_bind().dialect.name](table).on_conflict_do_nothing()
+
+
+class LRUCache:
+    """ Thread-safe dict-like cache with LRU eviction and TTL expiration.
+
+    :param int max_size: maximum count of stored values
+
+    :param float ttl: seconds before value expiration
+
+    :param str name: (optional) cache label of hits and misses metrics, not exported without it
+    """
+
+    def __init__(self, max_size: int, ttl: float, name: str = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._hits_metric = metrics.CACHE_REQUESTS.labels(name, "hit") if name else None
+        self._misses_metric = metrics.CACHE_REQUESTS.labels(name, "miss") if name else None
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """ Get cached value by key.
+
+        :returns: value or default if value is missing or expired
+        """
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                expires, value = item
+                if expires > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    if self._hits_metric is not None:
+                        self._hits_metric.inc()
+                    return value
+                del self._data[key]
+            self.misses += 1
+            if self._misses_metric is not None:
+                self._misses_metric.inc()
+            return default
+
+    def set(self, key, value):
+        """ Store value by key, evicting least recently used ones above max_size """
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._data[key] = time.monotonic() + self.ttl, value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        """ Drop cached value if it's there """
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """ Drop all cached values. Counters are kept. """
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """ Cache usage info
+
+        :returns: dict
+        """
+        with self._lock:
+            requests = self.hits + self.misses
+            return dict(size=len(self._data), max_size=self.max_size, ttl=self.ttl, hits=self.hits,
+                        misses=self.misses, hit_rate=self.hits / requests if requests else 0.0)
+
+
+class NamesCache:
+    """ Bounded name -> id map of dictionary table (directors or genres).
+    Warmed lazily: ids of names missing in cache are queried by one statement.
+
+    :param name_column: model's unique name column
+
+    :param id_column: model's id column
+
+    :param int max_size: maximum count of cached names
+    """
+
+    def __init__(self, name_column, id_column, max_size: int):
+        self.name_column = name_column
+        self.id_column = id_column
+        self.dictionary_generation = None
+        self._ids = LRUCache(max_size=max_size, ttl=float("inf"), name=name_column.table.name)
+
+    def sync(self, dictionary_generation: int):
+        """ Drop cached ids if dictionary rows were deleted since last sync """
+        if dictionary_generation != self.dictionary_generation:
+            self._ids.clear()
+            self.dictionary_generation = dictionary_generation
+
+    def cached_ids(self, names: list):
+        """ Split given names by cache without querying database.
+
+        :returns: tuple (dict name -> id of cached names, list of missing names)
+        """
+        found, missing = {}, []
+        for name in names:
+            name_id = self._ids.get(name)
+            if name_id is None:
+                missing.append(name)
+            else:
+                found[name] = name_id
+        return found, missing
+
+    def ids_select(self, names: list):
+        """ Select of (id, name) rows of given names """
+        return select(self.id_column, self.name_column).where(self.name_column.in_(names))
+
+    def get_ids(self, names: list):
+        """ Find ids of given names. Database is queried only for names missing in cache.
+
+        :returns: dict name -> id for names which are in database
+        """
+        found, missing = self.cached_ids(names)
+        if missing:
+            for name_id, name in db.session.execute(self.ids_select(missing)):
+                self._ids.set(name, name_id)
+                found[name] = name_id
+        return found
+
+    def upsert(self, names: list):
+        """ Find ids of given names inserting names which are new for database with one statement.
+        Names inserted at the same time by other transactions are read after conflicting insert.
+        Doesn't commit, new ids are cached after commit.
+
+        :returns: tuple (dict name -> id for all names, set of names inserted by this call)
+        """
+        names = list(dict.fromkeys(names))
+        found = self.get_ids(names)
+        missing = [name for name in names if name not in found]
+        if not missing:
+            return found, set()
+        table = self.name_column.table
+        key = self.name_column.key
+        inserted = {name: name_id for name_id, name in db.session.execute(
+            insert_or_ignore(table).values([{key: name} for name in missing])
+            .returning(self.id_column, self.name_column))}
+        found.update(inserted)
+        conflicted = [name for name in missing if name not in inserted]
+        if conflicted:
+            found.update((name, name_id) for name_id, name in db.session.execute(self.ids_select(conflicted)))
+        db.session.info.setdefault("inserted_names", []).extend((self, name, name_id)
+                                                                for name, name_id in inserted.items())
+        return found, set(inserted)
+
+    def remember(self, name: str, name_id: int):
+        """ Put committed name to cache """
+        self._ids.set(name, name_id)
+
+    def clear(self):
+        """ Drop all cached names """
+        self._ids.clear()
+
+    def stats(self):
+        """ Cache usage info with hit rate
+
+        :returns: dict
+        """
+        return self._ids.stats()
+
+
+class UsersCache:
+    """ Per-worker TTL cache of users snapshots behind flask-login user_loader.
+
+    :param int max_size: maximum count of cached users
+
+    :param float ttl: seconds before snapshot is read from database again
+
+    :param str stamp_path: file which modification time is changed by every users change in any worker
+    """
+
+    def __init__(self, max_size: int, ttl: float, stamp_path: str):
+        self.stamp_path = stamp_path
+        self.invalidations = 0
+        self._snapshots = LRUCache(max_size=max_size, ttl=ttl, name="users")
+        self._stamp = self._read_stamp()
+
+    def _read_stamp(self):
+        """ Modification time of stamp file in nanoseconds, None if it doesn't exist """
+        try:
+            return os.stat(self.stamp_path).st_mtime_ns
+        except OSError:
+            return None
+
+    def load(self, user_id: int):
+        """ User snapshot by id, read from database only if it isn't cached.
+
+        :returns: UserSnapshot or None if user doesn't exist
+        """
+        # stamp is read before database, so snapshot read before other worker's commit is dropped next time
+        stamp = self._read_stamp()
+        if stamp != self._stamp:
+            self._snapshots.clear()
+            self._stamp = stamp
+        snapshot = self._snapshots.get(user_id)
+        if snapshot is None:
+            user = db.session.get(User, user_id)
+            if user is None:
+                return None
+            snapshot = UserSnapshot(user)
+            self._snapshots.set(user_id, snapshot)
+        return snapshot
+
+    def invalidate(self, users_ids):
+        """ Drop snapshots of changed users in current worker and mark them stale for other workers """
+        for user_id in users_ids:
+            self._snapshots.delete(user_id)
+        self.invalidations += 1
+        metrics.CACHE_INVALIDATIONS.labels("users").inc()
+        try:
+            with open(self.stamp_path, "a"):
+                pass
+            now = time.time_ns()
+            os.utime(self.stamp_path, ns=(now, now))
+        except OSError:
+            # other workers will see the change after ttl
+            pass
+
+    def stats(self):
+        """ Cache usage info. Hits are database queries saved by cache.
+
+        :returns: dict
+        """
+        stats = self._snapshots.stats()
+        stats["invalidations"] = self.invalidations
+        return stats
+
+
+directors_ids = NamesCache(Directors.full_name, Directors.id, films_app.config["NAMES_CACHE_SIZE"])
+genres_ids = NamesCache(Genres.name, Genres.id, films_app.config["NAMES_CACHE_SIZE"])
+users_cache = UsersCache(films_app.config["USERS_CACHE_SIZE"], films_app.config["USERS_CACHE_TTL"],
+                         films_app.config["USERS_CACHE_STAMP"])
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _remember_changed_user(mapper, connection, user):
+    """ Collect ids of changed users, their snapshots are dropped after commit """
+    object_session(user).info.setdefault("changed_users", set()).add(user.id)
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session):
+    """ Cache ids of names inserted by committed transaction and drop snapshots of changed users """
+    for names_cache, name, name_id in session.info.pop("inserted_names", []):
+        names_cache.remember(name, name_id)
+    changed_users = session.info.pop("changed_users", None)
+    if changed_users:
+        users_cache.invalidate(changed_users)
+
+
+@event.listens_for(Session, "after_rollback")
+def _after_rollback(session):
+    """ Drop ids of names inserted and users changed by rolled back transaction """
+    session.info.pop("inserted_names", None)
+    session.info.pop("changed_users", None)
+
+
+def catalog_state():
+    """ Current catalog generation and dictionary generation numbers, zeros if catalog was never changed.
+
+    :returns: tuple (generation, dictionary_generation)
+    """
+    state = db.session.execute(CATALOG_STATE_SELECT).first()
+    if state is None:
+        return 0, 0
+    return state.generation, state.dictionary_generation
+
+
+def catalog_generation():
+    """ Current catalog generation number, 0 if catalog was never changed.
+
+    :returns: int
+    """
+    return catalog_state()[0]
+
+
+def sync_names_caches(dictionary_generation: int = None):
+    """ Make directors and genres names caches actual.
+
+    :param int dictionary_generation: (optional) already known dictionary generation, read from database if None
+    """
+    if dictionary_generation is None:
+        dictionary_generation = catalog_state()[1]
+    directors_ids.sync(dictionary_generation)
+    genres_ids.sync(dictionary_generation)
+
+
+def bump_dictionary_generation():
+    """ Increase dictionary generation in current transaction after deleting directors or genres.
+    Doesn't commit and doesn't change catalog generation.
+    """
+    table = CatalogState.__table__
+    changed = db.session.execute(table.update().where(table.c.id == CATALOG_STATE_ID)
+                                 .values(dictionary_generation=table.c.dictionary_generation + 1)).rowcount
+    if not changed:
+        db.session.execute(table.insert().values(id=CATALOG_STATE_ID, generation=0, dictionary_generation=1))
+
+
+def bump_catalog_generation():
+    """ Increase catalog generation in current transaction. Doesn't commit.
+    Repeated calls inside one transaction increase it only once.
+
+    :returns: int new generation number
+    """
+    session = db.session()
+    transaction = session.get_transaction()
+    if transaction is not None and session.info.get("generation_transaction") is transaction:
+        return session.info["generation"]
+    table = CatalogState.__table__
+    generation = session.execute(table.update().where(table.c.id == CATALOG_STATE_ID)
+                                    .values(generation=table.c.generation + 1)
+                                    .returning(table.c.generation)).scalar()
+    if generation is None:
+        # catalog_state row is made by migration, but databases made by create_all() don't have it
+        generation = 1
+        session.execute(table.insert().values(id=CATALOG_STATE_ID, generation=generation, dictionary_generation=0))
+    session.info["generation_transaction"] = session.get_transaction()
+    session.info["generation"] = generation
+    return generation
+
+
+def search_key(**params):
+    """ Normalized hashable key of films search parameters.
+    Genres and directors names lists are sorted and deduplicated, like search does with them. Other values
+    are kept as they are, search uses them as they are too. Not passed (None) parameters and empty names
+    lists are dropped.
+
+    :returns: tuple
+    """
+    key = []
+    for name, value in sorted(params.items()):
+        if name in ("genres", "directors") and value is not None:
+            if isinstance(value, str):
+                value = value.split(",")
+            value = ",".join(sorted({str(item).strip() for item in value if str(item).strip()})) or None
+        elif isinstance(value, list):
+            value = tuple(value)
+        if value is None:
+            continue
+        key.append((name, value))
+    return tuple(key)
+
+
+def catalog_etag(generation: int, key: tuple):
+    """ ETag value (unquoted) of response which depends only on catalog generation and normalized request.
+
+    :param tuple key: normalized request, made by search_key() for example
+
+    :returns: str
+    """
+    return f"{generation}-{hashlib.blake2b(repr(key).encode(), digest_size=8).hexdigest()}"
@@ -1,10 +1,23 @@
 """ Module for interacting with database """
+import base64
+import json
 from flask_login import current_user
-from sqlalchemy import func, and_, desc, asc
+from sqlalchemy import func, desc, asc, tuple_, select, exists, false, insert, literal, update
+from sqlalchemy.orm import selectinload
 from .errors import NotAuthenticatedError, NotFoundError, UserPermissionError
 from .models import *
 from datetime import datetime
 from .logger import Log
+from .routing import replica_reads
+from . import search as full_text
+from . import trigram
+from . import facets
+from . import film_search
+from .cache import bump_catalog_generation, bump_dictionary_generation, sync_names_caches, directors_ids, genres_ids, \
+    insert_or_ignore
+
+# maximum count of films ids found by trigram index passed to search query instead of ILIKE
+TRIGRAM_MAX_IDS = 1000
 
 
 def minimal_films_date(to_string=False, decrease=True):
@@ -38,64 +51,180 @@ def maximum_films_date(to_string=False):
     return max_date
 
 
-def find_films_by_filters(template: str = None, date_from: datetime or str = None,
-                          date_to: datetime or str = None, page_number: int = None,
-                          pagination_size: int = None, genres: list = None,
-                          directors: list = None, sort_by: str = None, sort_type: str = None):
-    """ Filtering films by passed parameters.
+def encode_cursor(film: Films, sort_by: str = None, sort_type: str = None):
+    """ Make opaque keyset pagination cursor pointing right after given film.
 
-    :param str template: (optional) film name partial match
+    :param film: last Films instance of the current page
 
-    :param int pagination_size: (optional) size of pagination per 1 page
+    :param str sort_by: sorting mode of the current search, 'rate', 'date' or None
 
-    :param int page_number: (optional) number of search page
+    :param str sort_type: sorting type of the current search, 'asc', 'desc' or None
 
-    :param str genres: (optional) list of genres for filtering
+    :returns: url-safe string
+    """
+    if sort_by == "rate":
+        value = film.rate
+    elif sort_by == "date":
+        value = film.release_date.isoformat()
+    else:
+        value = film.id
+    data = json.dumps([sort_by, sort_type, value, film.id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(data.encode("utf-8")).decode("ascii")
 
-    :param str directors: (optional) list of directors for filtering
 
-    :param str date_from: (optional) data in "%Y.%m.%d" format.
-                          Discarding films before given date's year
+def decode_cursor(cursor: str, sort_by: str = None, sort_type: str = None):
+    """ Unpack cursor made by encode_cursor.
 
-    :param str date_to: (optional) data in "%Y.%m.%d" format.
-                        Discarding films after given date's year
+    :param str cursor: cursor string from previous page response
 
-    :param str sort_by: (optional) sorting mode 'rate', 'date' or None.
-                        None is Default
+    :param str sort_by: sorting mode of the current search. Must be the same as cursor's one
 
-    :param str sort_type: (optional) sorting mode 'asc' (ascending) or 'desc' (descending).
-                          None is Default
+    :param str sort_type: sorting type of the current search. Must be the same as cursor's one
 
-    :returns: list of found films json data and status 200 if found, else error with status 404
+    :returns: tuple (sort column value, film id)
 
+    :raise ValueError if cursor is broken or made for another sorting
+    """
+    try:
+        cursor_sort_by, cursor_sort_type, value, film_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (ValueError, TypeError, UnicodeError):
+        Log.error("Broken cursor %s", cursor)
+        raise ValueError("Broken cursor!")
+    if cursor_sort_by != sort_by or cursor_sort_type != sort_type:
+        Log.error("Cursor made for sort_by=%s, sort_type=%s", cursor_sort_by, cursor_sort_type)
+        raise ValueError("Cursor was made for another sort_by/sort_type pair!")
+    try:
+        if sort_by == "date":
+            value = datetime.fromisoformat(value)
+        elif not isinstance(value, int if sort_by is None else (int, float)) or isinstance(value, bool):
+            raise TypeError("Cursor value must be number")
+        if not isinstance(film_id, int) or isinstance(film_id, bool):
+            raise TypeError("Cursor film id must be integer")
+    except (ValueError, TypeError):
+        Log.error("Broken cursor %s", cursor)
+        raise ValueError("Broken cursor!")
+    return value, film_id
+
+
+def _names_list(names: list or str):
+    """ Normalize 'name1,name2' string or list of names to list without empty values """
+    if isinstance(names, str):
+        names = names.split(",")
+    return [name.strip() for name in names if name.strip()]
+
+
+def _search_date(value: datetime or str):
+    """ Parse search date boundary passed as datetime or string in "%Y.%m.%d" format """
+    if isinstance(value, datetime):
+        return value
+    try:
+        return datetime.strptime(value, "%Y.%m.%d")
+    except ValueError:
+        Log.error("Wrong date %s", value)
+        raise ValueError("Dates must be passed in %Y.%m.%d format!")
+
+
+def filters_names(genres: list or str = None, directors: list or str = None):
+    """ Names of genres and directors filters, for reading their ids before building search statements.
+
+    :returns: dict with 'genres' and 'directors' lists of names
+    """
+    return dict(genres=_names_list(genres) if genres is not None else [],
+                directors=_names_list(directors) if directors is not None else [])
+
+
+def _names_ids(names: list, names_cache, resolved: dict = None):
+    """ Ids of names from process cache or from already resolved name -> id dict """
+    if resolved is None:
+        return names_cache.get_ids(names)
+    return {name: resolved[name] for name in names if name in resolved}
+
+
+def _names_filter(names: list, match_mode: str, ids: dict, ids_column):
+    """ Conditions for filtering films by linked directors/genres names over film_search ids lists.
+    Every film appears in results once whatever number of names it matches.
+    Names are resolved to ids before, so neither dictionary nor links tables are joined.
+
+    :param dict ids: name -> id of names which are in database
+
+    :returns: list of conditions
+    """
+    if match_mode == "all":
+        # film can't have director/genre which isn't in database
+        if len(ids) < len(set(names)):
+            return [false()]
+        return [film_search.linked_all(ids_column, sorted(ids.values()))]
+    if not ids:
+        return [false()]
+    return [film_search.linked_any(ids_column, sorted(ids.values()))]
+
+
+def _films_search_query(template: str = None, date_from: datetime or str = None,
+                        date_to: datetime or str = None, genres: list = None,
+                        directors: list = None, match_mode: str = None, sort_by: str = None,
+                        sort_type: str = None, search: str = None, columns: tuple = None, names_ids: dict = None,
+                        trigram_index: bool = True):
+    """ Build films search statement without pagination. Parameters are the same as find_films_by_filters has.
+    Only passed filters make their conditions. Full-text search without sort_by is ordered by relevance,
+    so returned statement is already ordered by it and id column must only break ties.
+    Films are filtered and sorted by film_search table, films table is joined for page rows and full-text search.
+
+    :param tuple columns: (optional) FilmSearch columns selected instead of films with loaded relations,
+                          statement isn't ordered then
+
+    :param dict names_ids: (optional) {'genres': {name: id}, 'directors': {name: id}} ids read by caller,
+                           names caches aren't used then
+
+    :param bool trigram_index: (optional) False matches templates by database even if process has trigram index
+
+    :returns: tuple (select statement, sorting column, sorting function)
     """
-    # finding min/max dates in out database for searching by all films by default
     if sort_by not in ["rate", "date", None]:
         Log.error("Argument sort_by can has only 'rate', 'date' or None values!")
         raise ValueError("Argument sort_by can has only 'rate', 'date' or None values!")
     if sort_type not in ["asc", "desc", None]:
         Log.error("Argument sort_by can has only 'asc', 'desc' or None values!")
         raise ValueError("Argument sort_by can has only 'asc', 'desc' or None values!")
-    if date_from is None:
-        date_from = minimal_films_date(to_string=True, decrease=True)
-    if date_to is None:
-        date_to = maximum_films_date(to_string=True)
-    if genres is None:
-        genres = [genre.name for genre in Genres.query.all()]
-    elif isinstance(genres, str):
-        genres = genres.split(",")
-    if directors is None:
-        directors = [director.full_name for director in Directors.query.all()]
-    elif isinstance(directors, str):
-        directors = directors.split(",")
-
-    page_offset = 0 if page_number == 1 else pagination_size * (page_number - 1)
-    # making search
-    films_data = db.session.query(Films).filter(Films.title.ilike("%" + template + "%")).filter(
-        and_(Films.release_date >= date_from)).filter(and_(Films.release_date <= date_to))\
-        .join(films_directors).filter(Films.id == films_directors.c.film_id).join(Directors)\
-        .filter(Directors.full_name.in_(directors)).join(films_genres)\
-        .filter(Films.id == films_genres.c.film_id).join(Genres).filter(Genres.name.in_(genres))
+    if match_mode not in ["any", "all", None]:
+        Log.error("Argument match_mode can has only 'any', 'all' or None values!")
+        raise ValueError("Argument match_mode can has only 'any', 'all' or None values!")
+
+    conditions = []
+    if template:
+        index = trigram.films_index() if trigram_index else None
+        found_ids = index.search(template) if index is not None else None
+        # too wide templates are cheaper for database than thousands of ids in query
+        if found_ids is not None and len(found_ids) <= TRIGRAM_MAX_IDS:
+            conditions.append(FilmSearch.film_id.in_(sorted(found_ids)))
+        else:
+            # lowered by database like stored titles are
+            conditions.append(FilmSearch.title_lower.like(func.lower("%" + template + "%")))
+    if date_from is not None:
+        conditions.append(FilmSearch.release_date >= _search_date(date_from))
+    if date_to is not None:
+        conditions.append(FilmSearch.release_date <= _search_date(date_to))
+    if genres is not None:
+        genres = _names_list(genres)
+        if genres:
+            ids = _names_ids(genres, genres_ids, None if names_ids is None else names_ids["genres"])
+            conditions += _names_filter(genres, match_mode, ids, FilmSearch.genre_ids)
+    if directors is not None:
+        directors = _names_list(directors)
+        if directors:
+            ids = _names_ids(directors, directors_ids, None if names_ids is None else names_ids["directors"])
+            conditions += _names_filter(directors, match_mode, ids, FilmSearch.director_ids)
+    if columns is not None:
+        films_data = select(*columns).select_from(FilmSearch).where(*conditions)
+        if search:
+            films_data = films_data.join(Films, Films.id == FilmSearch.film_id)
+    else:
+        # genres and directors of found films are loaded by one query for each relation instead of per film
+        films_data = select(Films).join(FilmSearch, FilmSearch.film_id == Films.id).where(*conditions)\
+            .options(selectinload(Films.genres), selectinload(Films._directors))
+    if search:
+        films_data, relevance = full_text.apply_full_text(films_data, search)
+        if sort_by is None and columns is None:
+            films_data = films_data.order_by(relevance)
 
     # defining sorting type
     if sort_type is not None:
@@ -108,32 +237,311 @@ def find_films_by_filters(template: str = None, date_from: datetime or str = Non
 
     if sort_by is not None:
         if sort_by == "rate":
-            column = Films.rate
+            column = FilmSearch.rate
         elif sort_by == "date":
-            column = Films.release_date
+            column = FilmSearch.release_date
+    else:
+        column = FilmSearch.film_id
+    return films_data, column, sorting
+
+
+def films_page_statement(page_number: int = None, pagination_size: int = None, **filters):
+    """ Ordered films search statement of one page. Filters are the same as find_films_by_filters has,
+    names_ids and trigram_index may be passed like for _films_search_query.
+
+    :returns: select of films with loaded genres and directors
+    """
+    films_data, column, sorting = _films_search_query(**filters)
+    page_offset = 0 if page_number == 1 else pagination_size * (page_number - 1)
+    if column is FilmSearch.film_id:
+        films_data = films_data.order_by(sorting(FilmSearch.film_id))
     else:
-        column = Films.id
+        # id makes order of films with equal sorting values stable between pages
+        films_data = films_data.order_by(sorting(column), sorting(FilmSearch.film_id))
+    return films_data.limit(pagination_size).offset(page_offset)
+
+
+def films_cursor_statement(cursor: str = None, pagination_size: int = None, **filters):
+    """ Ordered films search statement of the page after cursor with one extra film telling if the next page exists.
+    Filters are the same as find_films_after_cursor has, names_ids and trigram_index may be passed
+    like for _films_search_query.
+
+    :returns: select of films with loaded genres and directors, raises ValueError for broken cursor
+    """
+    films_data, column, sorting = _films_search_query(**filters)
+    if filters.get("search") and filters.get("sort_by") is None:
+        Log.error("Cursor pagination of full-text search without sort_by")
+        raise ValueError("Cursor pagination of full-text search needs sort_by 'rate' or 'date'!")
+    if cursor:
+        value, film_id = decode_cursor(cursor, sort_by=filters.get("sort_by"), sort_type=filters.get("sort_type"))
+        if column is FilmSearch.film_id:
+            seek = FilmSearch.film_id > film_id if sorting is asc else FilmSearch.film_id < film_id
+        elif sorting is asc:
+            seek = tuple_(column, FilmSearch.film_id) > tuple_(value, film_id)
+        else:
+            seek = tuple_(column, FilmSearch.film_id) < tuple_(value, film_id)
+        films_data = films_data.where(seek)
+    if column is FilmSearch.film_id:
+        films_data = films_data.order_by(sorting(FilmSearch.film_id))
+    else:
+        films_data = films_data.order_by(sorting(column), sorting(FilmSearch.film_id))
+    # one extra row tells if the next page exists
+    return films_data.limit(pagination_size + 1)
+
+
+def cursor_page(films: list, pagination_size: int, sort_by: str = None, sort_type: str = None):
+    """ Cut the extra film of films_cursor_statement result.
+
+    :returns: tuple (list of page films, next_cursor or None if it was the last page)
+    """
+    next_cursor = None
+    if len(films) > pagination_size:
+        films = films[:pagination_size]
+        next_cursor = encode_cursor(films[-1], sort_by=sort_by, sort_type=sort_type)
+    return films, next_cursor
+
+
+@replica_reads()
+def find_films_by_filters(template: str = None, date_from: datetime or str = None,
+                          date_to: datetime or str = None, page_number: int = None,
+                          pagination_size: int = None, genres: list = None,
+                          directors: list = None, sort_by: str = None, sort_type: str = None,
+                          match_mode: str = None, search: str = None):
+    """ Filtering films by passed parameters. Makes exactly one database query.
+
+    :param str template: (optional) film name partial match
+
+    :param int pagination_size: (optional) size of pagination per 1 page
+
+    :param int page_number: (optional) number of search page
+
+    :param str genres: (optional) list of genres for filtering
+
+    :param str directors: (optional) list of directors for filtering
+
+    :param str date_from: (optional) data in "%Y.%m.%d" format.
+                          Discarding films before given date's year
+
+    :param str date_to: (optional) data in "%Y.%m.%d" format.
+                        Discarding films after given date's year
+
+    :param str sort_by: (optional) sorting mode 'rate', 'date' or None.
+                        None is Default
+
+    :param str sort_type: (optional) sorting mode 'asc' (ascending) or 'desc' (descending).
+                          None is Default
+
+    :param str match_mode: (optional) 'any' (default) keeps films with at least one of passed
+                           genres/directors, 'all' keeps films having every passed one
 
-    films_data = films_data.order_by(sorting(column))
-    # adding limits
-    films_data = films_data.limit(pagination_size).offset(page_offset)
+    :param str search: (optional) full-text search by title and description words.
+                       Found films are ordered by relevance if sort_by isn't passed
+
+    :returns: list of found films json data and status 200 if found, else error with status 404
+
+    """
+    films_data = films_page_statement(template=template, date_from=date_from, date_to=date_to,
+                                      page_number=page_number, pagination_size=pagination_size, genres=genres,
+                                      directors=directors, match_mode=match_mode, sort_by=sort_by,
+                                      sort_type=sort_type, search=search)
+    films = db.session.execute(films_data).scalars().all()
 
     # if films wasn't found
-    if len(films_data.all()) == 0:
-        Log.debug(f"""Films with giver params not found
-        Params:
-        - template:{template}, 
-        - date_from:{date_from},
-        - date_to:{date_to},
-        - page_number:{page_number}, 
-        - pagination_size:{pagination_size}, 
-        - genres:{genres},
-        - directors:{directors}, 
-        - sort_by:{sort_by}, 
-        - sort_type:{sort_type}.
-        """)
+    if len(films) == 0:
+        Log.debug("Films with given params not found. Params: template=%r, date_from=%s, date_to=%s, "
+                  "page_number=%s, pagination_size=%s, genres=%s, directors=%s, sort_by=%s, sort_type=%s, "
+                  "match_mode=%s, search=%r", template, date_from, date_to, page_number, pagination_size, genres,
+                  directors, sort_by, sort_type, match_mode, search)
+        raise NotFoundError()
+    return films
+
+
+@replica_reads()
+def find_films_after_cursor(cursor: str = None, template: str = None, date_from: datetime or str = None,
+                            date_to: datetime or str = None, pagination_size: int = None,
+                            genres: list = None, directors: list = None,
+                            sort_by: str = None, sort_type: str = None, match_mode: str = None,
+                            search: str = None):
+    """ Keyset (cursor) variant of find_films_by_filters.
+    Instead of skipping page_number * pagination_size rows it seeks right after the last
+    (sort column, id) pair of the previous page, so every page costs the same.
+    Films with empty sort column value (release_date is NULL) are not reachable in this mode.
+    Relevance ordering of full-text search has no stable key, so search needs sort_by here.
+
+    :param str cursor: (optional) next_cursor value from previous page. Empty for the first page
+
+    Other parameters are the same as find_films_by_filters has.
+
+    :returns: tuple (list of found films, next_cursor or None if it was the last page),
+              raises NotFoundError if nothing found
+    """
+    films_data = films_cursor_statement(cursor=cursor, template=template, date_from=date_from, date_to=date_to,
+                                        pagination_size=pagination_size, genres=genres, directors=directors,
+                                        match_mode=match_mode, sort_by=sort_by, sort_type=sort_type, search=search)
+    films = db.session.execute(films_data).scalars().all()
+    if len(films) == 0:
+        Log.debug("Films with given params not found after cursor %s", cursor)
         raise NotFoundError()
-    return films_data.all()
+    return cursor_page(films, pagination_size, sort_by=sort_by, sort_type=sort_type)
+
+
+def _year_share(year: int, date_from: datetime = None, date_to: datetime = None):
+    """ Part of the year between date boundaries, films are supposed to be spread over year evenly """
+    first, last = datetime(year, 1, 1), datetime(year + 1, 1, 1)
+    begin = max(first, date_from) if date_from is not None else first
+    end = min(last, date_to) if date_to is not None else last
+    return max((end - begin).total_seconds(), 0) / (last - first).total_seconds()
+
+
+def _names_share(counts: list, total: int, match_mode: str):
+    """ Part of films linked to any (or all) of names with given counts, links are supposed independent """
+    shares = [min(count / total, 1.0) for count in counts]
+    result = 1.0
+    if match_mode == "all":
+        for share in shares:
+            result *= share
+        return result
+    for share in shares:
+        result *= 1.0 - share
+    return 1.0 - result
+
+
+def _estimate_films_count(template: str = None, date_from: datetime or str = None, date_to: datetime or str = None,
+                          genres: list = None, directors: list = None, match_mode: str = None, search: str = None):
+    """ Films count estimated by stored facets counts with one statement.
+    Counts of every filter are supposed independent, so filters combination is estimated as product of their shares.
+
+    :returns: tuple (count, True if count is exact) or None if filters have no statistics
+    """
+    if search:
+        return None
+    template_ids = None
+    if template:
+        index = trigram.films_index()
+        template_ids = index.search(template) if index is not None else None
+        if template_ids is None:
+            return None
+    genres_names = list(dict.fromkeys(_names_list(genres))) if genres is not None else []
+    directors_names = list(dict.fromkeys(_names_list(directors))) if directors is not None else []
+    found_genres, found_directors = genres_ids.get_ids(genres_names), directors_ids.get_ids(directors_names)
+    for names, found in ((genres_names, found_genres), (directors_names, found_directors)):
+        if names and (not found or match_mode == "all" and len(found) < len(names)):
+            return 0, True
+    scope = facets.CATALOG_SCOPE
+    if len(found_genres) == 1 and len(genres_names) == 1:
+        # one genre filter is exact scope of stored counts
+        scope, found_genres = next(iter(found_genres.values())), {}
+    date_from = _search_date(date_from) if date_from is not None else None
+    date_to = _search_date(date_to) if date_to is not None else None
+    years = None
+    if date_from is not None or date_to is not None:
+        years = (date_from.year if date_from is not None else 0, date_to.year if date_to is not None else 9999)
+    stats = facets.statistics(scope, genres=found_genres.values(), directors=found_directors.values(), years=years)
+    total = stats["total"]
+    if not total:
+        return 0, True
+    shares = []
+    if found_genres:
+        shares.append(_names_share([stats["genres"].get(genre_id, 0) for genre_id in found_genres.values()],
+                                   total, match_mode))
+    if found_directors:
+        if len(found_directors) == 1 and not (found_genres or years or template_ids is not None):
+            # films of one director in scope are counted exactly
+            return sum(stats["directors"].values()), True
+        shares.append(_names_share([stats["directors"].get(director_id, 0) for director_id in found_directors.values()],
+                                   total, match_mode))
+    if years is not None:
+        shares.append(min(sum(films * _year_share(year, date_from, date_to)
+                              for year, films in stats["years"].items()) / total, 1.0))
+    if template_ids is not None:
+        shares.append(min(len(template_ids) / max(stats["catalog_total"], 1), 1.0))
+    estimate = total
+    for share in shares:
+        estimate *= share
+    return int(round(estimate)), not shares
+
+
+@replica_reads()
+def count_films(template: str = None, date_from: datetime or str = None, date_to: datetime or str = None,
+                genres: list = None, directors: list = None, match_mode: str = None, search: str = None,
+                estimate: bool = False):
+    """ Count of films matching filters. Filters are the same as find_films_by_filters has.
+
+    :param bool estimate: (optional) take count from stored statistics when filters allow it,
+                          without scanning matched films. Full-text search and templates which trigram index
+                          can't serve are counted exactly anyway
+
+    :returns: tuple (count, True if count is exact)
+    """
+    if match_mode not in ["any", "all", None]:
+        Log.error("Argument match_mode can has only 'any', 'all' or None values!")
+        raise ValueError("Argument match_mode can has only 'any', 'all' or None values!")
+    if estimate:
+        estimated = _estimate_films_count(template=template, date_from=date_from, date_to=date_to, genres=genres,
+                                          directors=directors, match_mode=match_mode, search=search)
+        if estimated is not None:
+            return estimated
+    matched, _, _ = _films_search_query(template=template, date_from=date_from, date_to=date_to, genres=genres,
+                                        directors=directors, match_mode=match_mode, search=search,
+                                        columns=(FilmSearch.film_id,))
+    # films are filtered by semi-joins, so every matched film is counted once
+    return db.session.execute(select(func.count()).select_from(matched.subquery("matched"))).scalar(), True
+
+
+@replica_reads()
+def count_facets(template: str = None, date_from: datetime or str = None, date_to: datetime or str = None,
+                 genres: list = None, directors: list = None, match_mode: str = None, search: str = None):
+    """ Counts of films matching filters by genres, directors and release years.
+    Unfiltered search and search by one genre only are answered by stored counts,
+    others by one statement grouping matched films. Filters are the same as find_films_by_filters has.
+
+    :returns: dict with 'genres', 'directors' and 'years' lists of {"value": ..., "films": count},
+              genres and directors are the most frequent FACETS_LIMIT ones
+    """
+    genres_names = _names_list(genres) if genres is not None else []
+    directors_names = _names_list(directors) if directors is not None else []
+    if match_mode not in ["any", "all", None]:
+        Log.error("Argument match_mode can has only 'any', 'all' or None values!")
+        raise ValueError("Argument match_mode can has only 'any', 'all' or None values!")
+    if not (template or date_from or date_to or directors_names or search) and len(set(genres_names)) <= 1:
+        if not genres_names:
+            return facets.stored_counts()
+        genre_id = genres_ids.get_ids(genres_names).get(genres_names[0])
+        if genre_id is None:
+            return {facet: [] for facet in facets.FACETS}
+        return facets.stored_counts(genre_id)
+    matched, _, _ = _films_search_query(template=template, date_from=date_from, date_to=date_to, genres=genres,
+                                        directors=directors, match_mode=match_mode, search=search,
+                                        columns=(FilmSearch.film_id, FilmSearch.release_date))
+    return facets.matched_counts(matched)
+
+
+@replica_reads()
+def export_films(updated_since: datetime or str = None, batch_size: int = 1000):
+    """ Iterate over all films ordered by id with their genres and directors.
+    Films are fetched by batches through server-side cursor, so memory usage doesn't depend on catalog size.
+
+    :param updated_since: (optional) datetime or string in "%Y.%m.%d" or ISO format.
+                          Only films changed at this moment or later are exported
+
+    :param int batch_size: count of films fetched at once
+
+    :returns: generator of Films
+    """
+    statement = select(Films).options(selectinload(Films.genres), selectinload(Films._directors))\
+        .order_by(Films.id).execution_options(yield_per=batch_size)
+    if updated_since is not None:
+        if not isinstance(updated_since, datetime):
+            try:
+                updated_since = datetime.strptime(updated_since, "%Y.%m.%d")
+            except ValueError:
+                try:
+                    updated_since = datetime.fromisoformat(updated_since)
+                except ValueError:
+                    Log.error("Wrong updated_since %s", updated_since)
+                    raise ValueError("updated_since must be passed in %Y.%m.%d or ISO format!")
+        statement = statement.where(Films.updated_at >= updated_since)
+    return db.session.execute(statement).scalars()
 
 
 def validate_film(film: Films):
@@ -150,9 +558,9 @@ def validate_film(film: Films):
                                    release_date=new_date
                                    ).first()
     if search is not None:
-        Log.debug(f"Film {new_title} in database.")
+        Log.debug("Film %s in database.", new_title)
         return True
-    Log.debug(f"Film {new_title} not found.")
+    Log.debug("Film %s not found.", new_title)
     return False
 
 
@@ -174,22 +582,23 @@ def add_user(nickname: str, email: str, password: str, country: str = "",
 
         :param is_admin bool admin mode for authorized users.
 
-        :returns None
+        :returns User instance
+
+        :raise ValueError if user with same email is already registered
     """
     # creating registered or guest user
     user = User(nickname=nickname, email=email, password=password,
                 country=country, city=city, street=street, is_admin=is_admin)
-    # Add genre only if not in table already cause of unique column property
-    # trying to add user to base
-    all_emails = [i.email for i in User.query.all()]
-    if email not in all_emails:
-        db.session.add(user)
-        db.session.commit()
-        Log.debug(f"Added user {email} to database.")
-        return user
-    else:
-        Log.error(f"User with email {email} already registered.")
+    # one statement checks email uniqueness and inserts user, concurrent registrations can't both pass
+    values = {column.key: getattr(user, column.key) for column in User.__table__.columns if column.key != "id"}
+    user_id = db.session.execute(insert_or_ignore(User).values(**values).returning(User.id)).scalar()
+    if user_id is None:
+        db.session.rollback()
+        Log.error("User with email %s already registered.", email)
         raise ValueError("User with same email already registered")
+    db.session.commit()
+    Log.debug("Added user %s to database.", email)
+    return db.session.get(User, user_id)
 
 
 def add_director(full_name: str):
@@ -197,68 +606,86 @@ def add_director(full_name: str):
 
     :param full_name: string name
 
-    :returns Director instance if found, else None
+    :returns Director instance if it was added, None if director already in database
     """
-    director = Directors(full_name=full_name)
-    all_directors = [i.full_name for i in Directors.query.all()]
-    # trying to add director to base
-    if full_name not in all_directors:
-        db.session.add(director)
-        db.session.commit()
-        Log.debug(f"Director {director.full_name} added.")
-        return director
-    else:
-        Log.debug(f"Director {director.full_name} already in database.")
+    found, added = add_directors([full_name])
+    if full_name in added:
+        Log.debug("Director %s added.", full_name)
+        return db.session.get(Directors, found[full_name])
+    Log.debug("Director %s already in database.", full_name)
+
+
+def add_directors(names: list):
+    """ Add directors rows which aren't in database yet with one statement.
 
+    :param list names: directors names
 
-def delete_director(director: str or Directors):
-    """ Function for deleting film's director.
-    Also changes film's deleted director to "unknown" value if given director is only one in film's
-    directors list.
+    :returns tuple (dict name -> director id for all names, set of names which were added)
+    """
+    sync_names_caches()
+    found = directors_ids.upsert(names)
+    db.session.commit()
+    return found
+
+
+def delete_director(director: str or Directors or list):
+    """ Function for deleting film's director or several directors at once.
+    Also changes film's deleted director to "unknown" value if deleted directors are the only ones in film's
+    directors list. Takes the same count of statements for any count of linked films.
 
     :param str director: name of director you need to delete.
-                        Also can be Director instance in case of internal using
+                        Also can be Director instance in case of internal using or list of names/instances
+
+    :raise NotFoundError if some of directors wasn't found
     """
-    if isinstance(director, Directors):
-        director_id = director.id
-    elif isinstance(director, str):
-        director_db = Directors.query.filter_by(full_name=director).first()
-        if director_db is not None:
-            Log.debug(f"Director {director_db.full_name} added.")
-            director_id = director_db.id
+    deleting = director if isinstance(director, list) else [director]
+    directors_ids_list, names = [], []
+    for item in deleting:
+        if isinstance(item, Directors):
+            directors_ids_list.append(item.id)
+        elif isinstance(item, str):
+            names.append(item)
         else:
-            Log.error(f"Director not found.")
+            Log.error("Argument director must be string name or Director instance!")
+            raise TypeError("Argument director must be string name or Director instance!")
+    if "unknown" in names:
+        Log.error("Deleting director 'unknown'")
+        raise ValueError("Director 'unknown' can't be deleted!")
+    if names:
+        found = dict(db.session.execute(select(Directors.full_name, Directors.id)
+                                        .where(Directors.full_name.in_(names))).all())
+        missing = [name for name in names if name not in found]
+        if missing:
+            Log.error("Directors %s not found.", missing)
             raise NotFoundError("Director with given name wasn't found!")
-    else:
-        Log.error("Argument director must be string name or Director instance!")
-        raise TypeError("Argument director must be string name or Director instance!")
-
-    # find all records in films_directors relation table with director we wanna delete
-    # get the list of tuples with 2 elements, 1st is film_id, 2nd is director id
-    all_deleting = db.session.query(films_directors).filter(films_directors.c.director_id == director_id)
-    # if films are linked to current director:
-    deleting_list = all_deleting.all()
-    count_rows = len(deleting_list)
-    if count_rows > 0:
-        # find out if deleting director is the last one
-        films_list = [row[0] for row in all_deleting]
-        for i, film_id in enumerate(films_list):
-            directors = Films.query.filter_by(id=film_id).first().directors
-            # if deleting director is not only one director in film's directors list
-            # simply delete the row from directors relation table
-            if len(directors) > 1:
-                cond1 = (films_directors.c.film_id == deleting_list[i][0])
-                cond2 = (films_directors.c.director_id == deleting_list[i][1])
-                all_deleting.filter(cond1 & cond2).delete()
-            # if it the last one, just change the row director link to id 1 ("unknown")"
-            elif len(directors) == 1:
-                cond1 = (films_directors.c.film_id == deleting_list[i][0])
-                cond2 = (films_directors.c.director_id == deleting_list[i][1])
-                all_deleting.filter(cond1 & cond2).update({"director_id": 1})
-    # finally delete director from directors table
-    Directors.query.filter_by(id=director_id).delete()
+        directors_ids_list += found.values()
+
+    sync_names_caches()
+    unknown_id = directors_ids.upsert(["unknown"])[0]["unknown"]
+    linked = films_directors.c.director_id.in_(directors_ids_list)
+    other_links = films_directors.alias("other_links")
+    same_film = other_links.c.film_id == films_directors.c.film_id
+    # films having only deleted directors keep one link, changed to "unknown"
+    only_deleted = ~exists().where(same_film, other_links.c.director_id.not_in(directors_ids_list))
+    facets.replace_directors(directors_ids_list, unknown_id,
+                             select(films_directors.c.film_id).where(linked, only_deleted).distinct())
+    # changing time of all films which lose directors
+    db.session.execute(update(Films).where(exists().where(films_directors.c.film_id == Films.id, linked))
+                       .values(updated_at=datetime.utcnow()).execution_options(synchronize_session=False))
+    first_link = select(func.min(other_links.c.director_id)).where(same_film).scalar_subquery()
+    db.session.execute(update(films_directors)
+                       .where(linked, only_deleted, films_directors.c.director_id == first_link)
+                       .values(director_id=unknown_id))
+    # other links of deleted directors are simply dropped
+    db.session.execute(films_directors.delete().where(linked))
+    film_search.refresh_directors(directors_ids_list)
+    # finally delete directors from directors table
+    db.session.execute(Directors.__table__.delete().where(Directors.id.in_(directors_ids_list)))
+    bump_catalog_generation()
+    bump_dictionary_generation()
     db.session.commit()
-    Log.debug(f"Director {director} deleted successfully.")
+    directors_ids.clear()
+    Log.debug("Director %s deleted successfully.", director)
     return f"Director {director} deleted successfully.", 200
 
 
@@ -267,23 +694,51 @@ def add_genre(genre_name: str):
 
     :param genre_name: string name
 
-    :returns None if commit is True else Genre
+    :returns None
+
+    :raise ValueError if genre already exists
     """
-    genre = Genres(name=genre_name.strip())
-    all_genres = [i.name.strip() for i in Genres.query.all()]
-    # Add genre only if not in table already cause of unique column property
-    if genre_name.strip() not in all_genres:
-        # trying to add genre to table
-        db.session.add(genre)
-        db.session.commit()
-        Log.debug(f"Genre {genre_name.strip()} added successfully.")
-    else:
-        Log.error(f"Genre {genre_name}  already exists!")
+    genre_name = genre_name.strip()
+    if genre_name not in add_genres([genre_name])[1]:
+        Log.error("Genre %s  already exists!", genre_name)
         raise ValueError(f"Genre {genre_name}  already exists!")
+    Log.debug("Genre %s added successfully.", genre_name)
+
+
+def add_genres(names: list):
+    """ Add genres rows which aren't in database yet with one statement.
+
+    :param list names: genres names
+
+    :returns tuple (dict name -> genre id for all names, set of names which were added)
+    """
+    sync_names_caches()
+    found = genres_ids.upsert(names)
+    db.session.commit()
+    return found
+
+
+def _link_names(film_id: int, names: list, names_cache, link_table, link_column: str, linked: set = frozenset()):
+    """ Link film to directors or genres with one statement, inserting names which are new for database.
+    Doesn't commit.
+
+    :param names_cache: NamesCache of directors or genres
+
+    :param link_table: relation table
+
+    :param str link_column: relation table column with name id
+
+    :param set linked: ids already linked to film, they are skipped
+    """
+    found_ids = names_cache.upsert(names)[0]
+    links = [{"film_id": film_id, link_column: found_ids[name]} for name in dict.fromkeys(names)
+             if found_ids[name] not in linked]
+    if links:
+        db.session.execute(link_table.insert(), links)
 
 
 def add_films_directors(film: Films, directors: list or str):
-    """ Linking directors to films.
+    """ Linking directors to films. Doesn't commit.
 
      :param list or str directors: list of directors names or string like 'director1,director2'
                                     who needs to be added to current film.
@@ -296,42 +751,30 @@ def add_films_directors(film: Films, directors: list or str):
     if isinstance(directors, str):
         directors = [i.strip() for i in directors.strip().split(",")]
     elif directors is None:
-        Log.debug(f"Skipping directors {directors} cause not passed")
+        Log.debug("Skipping directors %s cause not passed", directors)
         return
     else:
         if not isinstance(directors, list):
             Log.error("Wrong directors type!")
             raise TypeError("Wrong directors type!")
 
-    # get list of all directors linked to film before (rows film_id, director_id)
-    added_directors = db.session.query(films_directors).filter_by(film_id=film.id).all()
-    # if Directors table has data
-    if added_directors:
-        # get the same list but as Director instances
-        added_directors2 = [i.full_name for i in film.directors]
-        # deleting "unknown" value from relation table for current film
-        if "unknown" in added_directors2:
-            index = added_directors2.index("unknown")
-            cond1 = (films_directors.c.film_id == added_directors[index][0])
-            cond2 = (films_directors.c.director_id == added_directors[index][1])
-            db.session.query(films_directors).filter(cond1 & cond2).delete()
-
-    Log.debug(f"For film {film.title} adding directors:")
-    # adding every passed director
-    for director_name in directors:
-        add_director(full_name=director_name)
-        # record to relation directors-films
-        director = Directors.query.filter_by(full_name=director_name).first()
-        # query.filter_by.all() from films_directors table makes dicts (film_key, director_key)
-        # creating the same for detecting duplicates
-        current_pair = film.id, director.id
-        if current_pair not in added_directors:
-            director.films.append(film)
-            Log.debug(f"- {director_name}")
+    sync_names_caches()
+    # ids of all directors linked to film before
+    added_directors = set(db.session.execute(select(films_directors.c.director_id)
+                                              .where(films_directors.c.film_id == film.id)).scalars())
+    # deleting "unknown" value from relation table for current film
+    unknown_id = directors_ids.get_ids(["unknown"]).get("unknown")
+    if unknown_id in added_directors:
+        cond1 = (films_directors.c.film_id == film.id)
+        cond2 = (films_directors.c.director_id == unknown_id)
+        db.session.query(films_directors).filter(cond1 & cond2).delete()
+
+    Log.debug("For film %s adding directors: %s", film.title, directors)
+    _link_names(film.id, directors, directors_ids, films_directors, "director_id", added_directors)
 
 
 def add_films_genres(film: Films, genres: list or str):
-    """ Linking genres to film.
+    """ Linking genres to film. Doesn't commit.
 
      :param list or str genres: list of directors names or string like 'director1,director2'
                                     who needs to be added to current film. Every time needs
@@ -345,41 +788,28 @@ def add_films_genres(film: Films, genres: list or str):
     if isinstance(genres, str):
         genres = genres.strip().split(",")
     elif genres is None:
-        Log.debug(f"Skipping directors {genres} cause not passed")
+        Log.debug("Skipping directors %s cause not passed", genres)
         return
     else:
         if not isinstance(genres, list):
             Log.error("Wrong directors type!")
             raise TypeError("Wrong directors type!")
 
-    added_genres = db.session.query(films_genres).filter_by(film_id=film.id).all()
+    sync_names_caches()
     # deleting old added genres
     db.session.query(films_genres).filter_by(film_id=film.id).delete()
-    db.session.commit()
-
-    Log.debug(f"For film {film.title} adding genres:")
 
-    for genre in genres:
-        # looking for genres instances in genres table
-        # for adding relations with films
-        genre_instance = Genres.query.filter_by(name=genre.rstrip()).first()
-        # if genres table doesn't have current genre, add it
-        if genre_instance is None:
-            genre_instance = Genres(name=genre.strip())
-            db.session.add(genre_instance)
-            db.session.commit()
-            genre_instance = Genres.query.filter_by(name=genre.rstrip()).first()
-        # avoid adding duplicates
-        current_pair = film.id, genre_instance.id
-        if current_pair not in added_genres:
-            genre_instance.films.append(film)
-            Log.debug(f"- {genre}")
+    genres = [genre.strip() for genre in genres]
+    Log.debug("For film %s adding genres: %s", film.title, genres)
+    _link_names(film.id, genres, genres_ids, films_genres, "genres_id")
+    bump_catalog_generation()
 
 
 def add_film(title: str, release_date: datetime, user: int or User,
              directors: str or list, genres: str or list, description: str = None,
              rate: int = 0, poster_url: str = "https://"):
     """ Create film row in database and add row to Films table in db.
+    Film, its directors, genres and owner links are written in one transaction.
 
     :param title: string film name
 
@@ -397,46 +827,56 @@ def add_film(title: str, release_date: datetime, user: int or User,
 
     :param genres: string with genres names decided by space. Goes to the relation table
 
-    :returns None
+    :returns Films instance
+
+    :raise ValueError if film with same title and release date is already in database.
+           Not guaranteed for the same film added concurrently, see comment below.
     """
     if isinstance(user, User):
-        user_id = User.id
-    elif isinstance(user, str):
+        user_id = user.id
+    elif isinstance(user, (str, int)):
         user_id = int(user)
-        user = User.query.all()[user_id - 1]
-    elif isinstance(user, int):
-        user_id = user
-        user = User.query.all()[user_id - 1]
     else:
         Log.error("User id must be an integer, or numeric string or User instance!")
         raise TypeError("User id must be an integer, or numeric string or User instance!")
+    for names in (directors, genres):
+        if names is not None and not isinstance(names, (str, list)):
+            Log.error("Wrong directors or genres type!")
+            raise TypeError("Directors and genres must be list or string like 'name1,name2'!")
+
+    values = dict(title=title, description=description, rate=float(rate), release_date=release_date,
+                  poster_url=poster_url, user_id=user_id, updated_at=datetime.utcnow())
+    # duplicate check and insert are one statement, so committed films are always found. Films table has no
+    # unique (title, release_date) constraint though: two concurrent adds of the same film still can both insert
+    duplicate = exists().where(Films.title == title, Films.release_date == release_date)
+    film_row = select(*[literal(value, type_=Films.__table__.c[column].type) for column, value in values.items()])
+    film = db.session.execute(insert(Films).from_select(list(values), film_row.where(~duplicate))
+                              .returning(Films)).scalar()
+    if film is None:
+        db.session.rollback()
+        Log.error("Films %s already in database", title)
+        raise ValueError(f"Film {title} already added.")
+    # record to relation users-films table, only if user exists
+    owner_row = select(literal(film.id), User.id).where(User.id == user_id)
+    if not db.session.execute(users_films.insert().from_select(["film_id", "user_id"], owner_row)).rowcount:
+        db.session.rollback()
+        Log.error("User with id=%s not found", user_id)
+        raise NotFoundError(f"User with id={user_id} not found!")
 
-    film = Films(title=title, description=description, user_id=int(user_id),
-                 rate=float(rate), release_date=release_date, poster_url=poster_url)
-
-    if validate_film(film) is not True:
-
-        # trying to add new film to db table
-        db.session.add(film)
-        db.session.commit()
-        # find added film again from db for getting id
-        film = Films.query.filter_by(title=title, description=description, user_id=int(user_id),
-                                     rate=float(rate), release_date=release_date, poster_url=poster_url).first()
-
-        # if films inserted successfully, inserting everything else
-        # making record to directors table
-        add_films_directors(film, directors)
-        # record to relation users-films table
-        user.films.append(film)
-        # recording to genres relations table
-        add_films_genres(film, genres)
-        db.session.commit()
-        # confirm changes
-        Log.info(f"Films {film.title} successfully added")
-        return film
-    else:
-        Log.error(f"Films {film.title} already in database")
-        raise ValueError(f"Film {film.title} already added.")
+    sync_names_caches()
+    if directors is not None:
+        _link_names(film.id, _names_list(directors), directors_ids, films_directors, "director_id")
+    if genres is not None:
+        _link_names(film.id, _names_list(genres), genres_ids, films_genres, "genres_id")
+    film_id = film.id
+    facets.add_films([film_id])
+    film_search.refresh_films([film_id])
+    full_text.index_new_films([{"id": film_id, "title": title, "description": description}])
+    generation = bump_catalog_generation()
+    db.session.commit()
+    trigram.index_film(film_id, title, generation)
+    Log.info("Films %s successfully added", title)
+    return film
 
 
 def edit_film(film_id: int, title: str = None, release_data: datetime = None,
@@ -472,6 +912,8 @@ def edit_film(film_id: int, title: str = None, release_data: datetime = None,
         if film:
             # if user has rights to edit films
             if user.is_admin or film.user_id == user.id:
+                # film is counted again with its new links and release date
+                facets.remove_films([film.id])
                 film.set_title(title)
                 film.set_description(description)
                 # making record to directors table
@@ -480,14 +922,21 @@ def edit_film(film_id: int, title: str = None, release_data: datetime = None,
                 film.set_release_date(release_data)
                 film.set_poster_url(poster_url)
                 add_films_genres(film, genres)
+                film.updated_at = datetime.utcnow()
+                facets.add_films([film.id])
+                film_search.refresh_films([film.id])
+                full_text.index_film(film)
+                generation = bump_catalog_generation()
                 db.session.commit()
+                trigram.index_film(film.id, film.title, generation)
                 Log.info("Film edited successfully")
                 return film.to_dict(), 200
             else:
-                Log.error(f"Editing film {film.title} as user {user.nickname}. Have rights: {film.user_id == user.id}")
+                Log.error("Editing film %s as user %s. Have rights: %s", film.title, user.nickname,
+                          film.user_id == user.id)
                 raise UserPermissionError("Only admins and owners can edit film!")
         else:
-            Log.warning(f"Film {film.title} not found")
+            Log.warning("Film %s not found", film.title)
             raise NotFoundError(f"Film {title} not found!")
     else:
         Log.warning("Not authenticated")
@@ -497,19 +946,24 @@ def edit_film(film_id: int, title: str = None, release_data: datetime = None,
 def delete_film(film_id: int):
     """ Function for deleting the film from all films table """
     if not isinstance(film_id, int):
-        Log.error(f"Film {response.title} id {id} is not int!")
+        Log.error("Film %s id %s is not int!", response.title, id)
         raise TypeError("ID must be int!")
 
-    Log.debug(f"film id: {film_id}")
+    Log.debug("film id: %s", film_id)
     film = Films.query.filter_by(id=film_id)
     response = film.first()
     if response is not None:
+            facets.remove_films([response.id])
+            film_search.forget_films([response.id])
             film.delete()
+            full_text.unindex_film(response.id)
+            generation = bump_catalog_generation()
             db.session.commit()
-            Log.debug(f"Film {response.title} deleted")
+            trigram.unindex_film(response.id, generation)
+            Log.debug("Film %s deleted", response.title)
             return response
     else:
-        Log.warning(f"Film with id {id} not found.")
+        Log.warning("Film with id %s not found.", id)
         raise NotFoundError("Film with given id doesn't exist in films database")
 
 
@@ -518,10 +972,10 @@ def set_admin(user_id: int, admin_mode: bool):
     Changing is_admin value in database for given user
     """
     if not isinstance(user_id, int):
-        Log.error(f"User id must be int, got {user_id}")
+        Log.error("User id must be int, got %s", user_id)
         raise TypeError("User id must be integer!")
     if not isinstance(admin_mode, bool):
-        Log.error(f"User id must be bool, got {admin_mode}")
+        Log.error("User id must be bool, got %s", admin_mode)
         raise TypeError("Admin mode must be True or False!")
 
     user = User.query.filter_by(id=user_id).first()
@@ -530,4 +984,4 @@ def set_admin(user_id: int, admin_mode: bool):
         raise NotFoundError(f"User with id={user_id} not found!")
     user.set_admin(admin_mode)
     db.session.commit()
-    Log.info(f"User {user.nickname} is admin now: {admin_mode}")
+    Log.info("User %s is admin now: %s", user.nickname, admin_mode)
@@ -0,0 +1,224 @@
+""" Films counts by genre, director and release year for search results (facets).
+
+ Notices:
+ - catalog_facets table keeps counts of the whole catalog (scope 0) and of every genre's films
+   (scope is genre id), so unfiltered and one genre searches read ready counts.
+   Other filters are counted by one statement grouping matched films by every facet.
+ - counts are changed by add_films/remove_films in the same transaction as films and their links,
+   with one statement for any count of films. Callers must remove film's counts before changing
+   its links or release date and add them after.
+ - counts of deleted films stay as 0 rows until rebuild (flask rebuild-facets), readers skip them.
+ - besides facets every scope has 'total' row with count of its films, statistics() gives them
+   for estimating search results count.
+ - on PostgreSQL writers adding films of the same genre wait for each other's commit on its counts rows.
+   Counts rows are always changed in (scope, facet, value) order, so concurrent writers lock them in the
+   same order and don't deadlock.
+ """
+import click
+from sqlalchemy import select, func, literal, union_all, cast, extract, and_, or_, Integer, true
+from . import db, films_app
+from .cache import DIALECT_INSERTS
+from .models import CatalogFacet, Films, Directors, Genres, films_directors, films_genres
+
+FACETS = ("genres", "directors", "years")
+# facet of scope's films count, its only value is 0
+TOTAL = "total"
+# scope of the whole catalog counts
+CATALOG_SCOPE = 0
+
+
+def _year(column):
+    return cast(extract("year", column), Integer)
+
+
+def _in(column, films_ids):
+    """ Condition of films ids, None means all films """
+    return true() if films_ids is None else column.in_(films_ids)
+
+
+def _changes(films_ids, sign: int):
+    """ Select of (scope, facet, value, films) counts given films add to catalog_facets, negative if sign is -1.
+    Every film is counted in the catalog scope and in scope of each its genre. Rows are ordered by key.
+    """
+    scopes = union_all(
+        select(Films.id.label("film_id"), literal(CATALOG_SCOPE).label("scope")).where(_in(Films.id, films_ids)),
+        select(films_genres.c.film_id, films_genres.c.genres_id).where(_in(films_genres.c.film_id, films_ids)),
+    ).subquery("scopes")
+    values = union_all(
+        select(films_genres.c.film_id.label("film_id"), literal("genres").label("facet"),
+               films_genres.c.genres_id.label("value")).where(_in(films_genres.c.film_id, films_ids)),
+        select(films_directors.c.film_id, literal("directors"), films_directors.c.director_id)
+        .where(_in(films_directors.c.film_id, films_ids)),
+        select(Films.id, literal("years"), _year(Films.release_date))
+        .where(_in(Films.id, films_ids), Films.release_date.is_not(None)),
+        select(Films.id, literal(TOTAL), literal(0)).where(_in(Films.id, films_ids)),
+    ).subquery("facet_values")
+    # WHERE clause keeps sqlite from taking ON CONFLICT for join's ON
+    return select(scopes.c.scope, values.c.facet, values.c.value, func.count() * sign)\
+        .join_from(scopes, values, scopes.c.film_id == values.c.film_id).where(true())\
+        .group_by(scopes.c.scope, values.c.facet, values.c.value)\
+        .order_by(scopes.c.scope, values.c.facet, values.c.value)
+
+
+def _apply(changes):
+    """ Add counts of (scope, facet, value, films) select to catalog_facets rows.
+    Select must be ordered by (scope, facet, value): rows are inserted and locked in its order.
+    """
+    statement = DIALECT_INSERTS[db.session.get_bind().dialect.name](CatalogFacet)\
+        .from_select(["scope", "facet", "value", "films"], changes)
+    db.session.execute(statement.on_conflict_do_update(
+        index_elements=["scope", "facet", "value"], set_={"films": CatalogFacet.films + statement.excluded.films}))
+
+
+def add_films(films_ids):
+    """ Count films with their current links and release dates. Doesn't commit.
+
+    :param list films_ids: films ids
+    """
+    if films_ids:
+        # changed films attributes must be in database before counting
+        db.session.flush()
+        _apply(_changes(films_ids, 1))
+
+
+def remove_films(films_ids):
+    """ Uncount films with their current links and release dates. Doesn't commit.
+
+    :param list films_ids: films ids
+    """
+    if films_ids:
+        db.session.flush()
+        _apply(_changes(films_ids, -1))
+
+
+def replace_directors(directors_ids: list, unknown_id: int, unknown_films):
+    """ Drop counts of deleted directors and count films they leave without directors for 'unknown' one.
+    Must be called before links of deleted directors are changed. Doesn't commit.
+
+    :param unknown_films: select of ids of films which will be linked to 'unknown' director
+    """
+    unknown_films = unknown_films.subquery("unknown_films")
+    scopes = union_all(
+        select(unknown_films.c.film_id, literal(CATALOG_SCOPE).label("scope")),
+        select(films_genres.c.film_id, films_genres.c.genres_id)
+        .join(unknown_films, unknown_films.c.film_id == films_genres.c.film_id),
+    ).subquery("scopes")
+    _apply(select(scopes.c.scope, literal("directors"), literal(unknown_id), func.count())
+           .where(true()).group_by(scopes.c.scope).order_by(scopes.c.scope))
+    db.session.execute(CatalogFacet.__table__.delete().where(CatalogFacet.facet == "directors",
+                                                              CatalogFacet.value.in_(directors_ids)))
+
+
+def rebuild():
+    """ Recount catalog_facets from films and their links """
+    db.session.execute(CatalogFacet.__table__.delete())
+    _apply(_changes(None, 1))
+    db.session.commit()
+
+
+def statistics(scope: int = CATALOG_SCOPE, genres: list = (), directors: list = (), years: tuple = None):
+    """ Stored counts of given values in scope with one statement.
+
+    :param list genres: genres ids
+
+    :param list directors: directors ids
+
+    :param tuple years: (optional) (first year, last year) range
+
+    :returns: dict with 'total' of scope, 'catalog_total', and 'genres', 'directors', 'years' dicts value -> count
+    """
+    wanted = [CatalogFacet.facet == TOTAL]
+    if genres:
+        wanted.append(and_(CatalogFacet.facet == "genres", CatalogFacet.value.in_(list(genres))))
+    if directors:
+        wanted.append(and_(CatalogFacet.facet == "directors", CatalogFacet.value.in_(list(directors))))
+    if years is not None:
+        wanted.append(and_(CatalogFacet.facet == "years", CatalogFacet.value.between(*years)))
+    rows = db.session.execute(select(CatalogFacet.scope, CatalogFacet.facet, CatalogFacet.value, CatalogFacet.films)
+                              .where(CatalogFacet.scope.in_({CATALOG_SCOPE, scope}), or_(*wanted)))
+    result = dict(total=0, catalog_total=0, genres={}, directors={}, years={})
+    for row_scope, facet, value, films in rows:
+        if facet == TOTAL:
+            if row_scope == CATALOG_SCOPE:
+                result["catalog_total"] = films
+            if row_scope == scope:
+                result["total"] = films
+        elif row_scope == scope:
+            result[facet][value] = films
+    return result
+
+
+def _top_counts(grouped: dict, limit: int):
+    """ One statement returning top limit values of every facet with names of genres and directors.
+
+    :param dict grouped: facet -> select of (value, films) columns
+
+    :returns: dict facet -> list of {"value": name or year, "films": count}, the most frequent first,
+              years ordered by year
+    """
+    parts = []
+    for facet, counts in grouped.items():
+        counts = counts.subquery()
+        value, films = counts.c[0], counts.c[1]
+        top = select(literal(facet).label("facet"), value.label("value"), films.label("films"))\
+            .order_by(films.desc(), value)
+        if facet != "years":
+            top = top.limit(limit)
+        parts.append(select(top.subquery()))
+    rows = union_all(*parts).subquery("facets_rows")
+    statement = select(rows.c.facet, rows.c.value, rows.c.films, func.coalesce(Genres.name, Directors.full_name))\
+        .outerjoin(Genres, and_(rows.c.facet == "genres", Genres.id == rows.c.value))\
+        .outerjoin(Directors, and_(rows.c.facet == "directors", Directors.id == rows.c.value))
+    result = {facet: [] for facet in grouped}
+    for facet, value, films, name in db.session.execute(statement):
+        if facet != "years" and name is None:
+            # links left by deleted films or directors without dictionary rows
+            continue
+        result[facet].append({"value": value if facet == "years" else name, "films": films})
+    for facet in result:
+        result[facet].sort(key=lambda item: (item["value"],) if facet == "years" else (-item["films"], item["value"]))
+    return result
+
+
+def stored_counts(scope: int = CATALOG_SCOPE, limit: int = None):
+    """ Facets counts from catalog_facets table.
+
+    :param int scope: CATALOG_SCOPE or genre id
+
+    :param int limit: (optional) count of genres/directors values, FACETS_LIMIT by default
+
+    :returns: dict like _top_counts one
+    """
+    limit = limit or films_app.config["FACETS_LIMIT"]
+    return _top_counts({facet: select(CatalogFacet.value, CatalogFacet.films)
+                        .where(CatalogFacet.scope == scope, CatalogFacet.facet == facet, CatalogFacet.films > 0)
+                        for facet in FACETS}, limit)
+
+
+def matched_counts(matched, limit: int = None):
+    """ Facets counts of matched films, grouped by one statement.
+
+    :param matched: select of film id and release_date columns of matched films
+
+    :param int limit: (optional) count of genres/directors values, FACETS_LIMIT by default
+
+    :returns: dict like _top_counts one
+    """
+    limit = limit or films_app.config["FACETS_LIMIT"]
+    # links are filtered by IN (matched ids), database builds set of ids once instead of rescanning matched films
+    ids = matched.with_only_columns(matched.selected_columns[0])
+    genres = select(films_genres.c.genres_id, func.count())\
+        .where(films_genres.c.film_id.in_(ids)).group_by(films_genres.c.genres_id)
+    directors = select(films_directors.c.director_id, func.count())\
+        .where(films_directors.c.film_id.in_(ids)).group_by(films_directors.c.director_id)
+    matched = matched.subquery("matched")
+    year = _year(matched.c.release_date)
+    years = select(year, func.count()).where(matched.c.release_date.is_not(None)).group_by(year)
+    return _top_counts({"genres": genres, "directors": directors, "years": years}, limit)
+
+
+@films_app.cli.command("rebuild-facets")
+def rebuild_facets_command():
+    """ Recount films by genres, directors and release years. """
+    rebuild()
+    click.echo("Facets counts rebuilt.")
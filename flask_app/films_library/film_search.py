@@ -0,0 +1,89 @@
+""" Denormalized read model of films search: film_search table.
+
+ Notices:
+ - every film has one film_search row with lower-cased title, sort columns and lists of genres and
+   directors ids, so films are filtered and sorted by one table. Lists are integer arrays with GIN
+   indexes on PostgreSQL and JSON arrays on SQLite.
+ - rows are refreshed from films and links tables by refresh_films/refresh_directors/forget_films
+   in the same transaction as films changes, one statement for any count of films.
+ - full-text search still reads films table, its index lives there.
+ - flask rebuild-film-search makes the table from scratch.
+ """
+import click
+from sqlalchemy import select, func, exists, and_, true, literal_column, type_coerce, Integer
+from sqlalchemy.dialects import postgresql
+from . import db, films_app
+from .cache import DIALECT_INSERTS
+from .models import FilmSearch, Films, films_directors, films_genres
+
+COLUMNS = ("film_id", "title_lower", "rate", "release_date", "genre_ids", "director_ids")
+
+
+def _dialect():
+    return db.session.get_bind().dialect.name
+
+
+def _linked_ids(link_column):
+    """ Scalar subquery of ids list linked to film by relation table column """
+    link_table = link_column.table
+    if _dialect() == "postgresql":
+        ids = func.coalesce(func.array_agg(link_column), literal_column("'{}'::integer[]"))
+    else:
+        ids = func.json_group_array(link_column)
+    return select(ids).where(link_table.c.film_id == Films.id).scalar_subquery()
+
+
+def _refresh(condition):
+    """ Insert or update film_search rows of films matching condition """
+    rows = select(Films.id, func.lower(Films.title), Films.rate, Films.release_date,
+                  _linked_ids(films_genres.c.genres_id), _linked_ids(films_directors.c.director_id)).where(condition)
+    statement = DIALECT_INSERTS[_dialect()](FilmSearch).from_select(list(COLUMNS), rows)
+    db.session.execute(statement.on_conflict_do_update(
+        index_elements=["film_id"], set_={column: statement.excluded[column] for column in COLUMNS[1:]}))
+
+
+def linked_any(column, ids: list):
+    """ Condition of film_search ids list column having any of ids """
+    if _dialect() == "postgresql":
+        return type_coerce(column, postgresql.ARRAY(Integer)).overlap(ids)
+    values = func.json_each(column).table_valued("value")
+    return exists(select(values.c.value).where(values.c.value.in_(ids)))
+
+
+def linked_all(column, ids: list):
+    """ Condition of film_search ids list column having every id """
+    if _dialect() == "postgresql":
+        return type_coerce(column, postgresql.ARRAY(Integer)).contains(ids)
+    return and_(*[linked_any(column, [item]) for item in ids])
+
+
+def refresh_films(films_ids: list):
+    """ Make film_search rows of given films actual. Doesn't commit. """
+    if films_ids:
+        # changed films attributes must be in database before copying
+        db.session.flush()
+        _refresh(Films.id.in_(films_ids))
+
+
+def refresh_directors(directors_ids: list):
+    """ Refresh rows of films linked to given directors before, after their links were changed. Doesn't commit. """
+    _refresh(Films.id.in_(select(FilmSearch.film_id).where(linked_any(FilmSearch.director_ids, directors_ids))))
+
+
+def forget_films(films_ids: list):
+    """ Delete film_search rows of deleted films. Doesn't commit. """
+    db.session.execute(FilmSearch.__table__.delete().where(FilmSearch.film_id.in_(films_ids)))
+
+
+def rebuild():
+    """ Make film_search rows of all films from scratch """
+    db.session.execute(FilmSearch.__table__.delete())
+    _refresh(true())
+    db.session.commit()
+
+
+@films_app.cli.command("rebuild-film-search")
+def rebuild_film_search_command():
+    """ Rebuild denormalized films search table. """
+    rebuild()
+    click.echo("Film search table rebuilt.")
@@ -1,6 +1,27 @@
-import datetime
+""" Application logger.
+
+ Notices:
+ - Log methods take %-style arguments: Log.debug("Film %s added", title). Message is formatted
+   only if its level is enabled, disabled calls cost one level check.
+ - records are put to in-memory queue, formatted and written to file and console by background
+   thread, so request threads never wait for disk. Arguments must not be changed after logging call.
+ - log file is rotated by size: $LOG_MAX_BYTES (10 MB by default) with $LOG_BACKUP_COUNT old files.
+ - every process writes its own file with pid in name: gunicorn workers, read service and forked
+   processes never rotate file other process is writing to. Log file path films_app.log gives
+   films_app.<pid>.log with rotated films_app.<pid>.log.1 .. films_app.<pid>.log.<$LOG_BACKUP_COUNT>.
+ - restarted workers get new pids, so files of finished processes are pruned when logger starts:
+   ones of not running pids which weren't written for $LOG_RETENTION_DAYS (7 by default).
+ """
+import atexit
 import logging
+import logging.handlers
 import os
+import queue
+import re
+import time
+
+LOG_FORMAT = "[%(asctime)s] -  %(message)s"
+LOG_DATE_FORMAT = "%Y.%m.%d-%H:%M"
 
 
 def get_logging_mode(mode: str = None):
@@ -25,20 +46,110 @@ def get_logging_mode(mode: str = None):
     return mode
 
 
+def _running(pid: int):
+    """ Check if process with given pid exists """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # process of other user
+        return True
+    return True
+
+
+def prune_log_files(file_path: str, max_age_seconds: float):
+    """ Remove per-process files of log file path, rotated ones too, which belong to not running processes
+    and weren't written for max_age_seconds.
+
+    :returns: list of removed files paths
+    """
+    root, extension = os.path.splitext(os.path.abspath(file_path))
+    directory, name = os.path.split(root)
+    pattern = re.compile(rf"{re.escape(name)}\.(\d+){re.escape(extension)}(\.\d+)?$")
+    removed = []
+    if not os.path.isdir(directory):
+        return removed
+    now = time.time()
+    for file_name in os.listdir(directory):
+        match = pattern.match(file_name)
+        if match is None or _running(int(match.group(1))):
+            continue
+        path = os.path.join(directory, file_name)
+        try:
+            if now - os.path.getmtime(path) > max_age_seconds:
+                os.remove(path)
+                removed.append(path)
+        except OSError:
+            # removed by other starting process
+            continue
+    return removed
+
+
+class ThreadQueueHandler(logging.handlers.QueueHandler):
+    """ Queue handler for listener thread of the same process. Records are passed as is,
+    message formatting and record copying are left to listener thread.
+    """
+
+    def prepare(self, record):
+        """ Put record to queue unchanged """
+        return record
+
+
 class Logger:
     LOG_FILE_DEFAULT = "films_app.log"
 
-    def __init__(self, file_path: str = None):
+    def __init__(self, file_path: str = None, name: str = "Films_app"):
         if file_path is not None:
             self.file = file_path
         else:
             self.file = self.LOG_FILE_DEFAULT
-        self.logger = logging.getLogger("Films_app")
-        self.log_handler = logging.FileHandler(f"{self.file}", encoding='utf-8')
+        self.logger = logging.getLogger(name)
         self.logging_mode = get_logging_mode()
         print("logging mode:", self.logging_mode)
-        self.log_handler.setLevel(self.logging_mode)
-        self.logger.addHandler(self.log_handler)
+        self.logger.setLevel(self.logging_mode)
+        # records are written by listener's handlers, not by root logger ones
+        self.logger.propagate = False
+        self.formatter = logging.Formatter(LOG_FORMAT, LOG_DATE_FORMAT)
+        prune_log_files(self.file, float(os.environ.get("LOG_RETENTION_DAYS", 7)) * 24 * 3600)
+        self.log_handler = self.file_handler()
+        self.console_handler = logging.StreamHandler()
+        self.console_handler.setFormatter(self.formatter)
+        self.queue_handler = ThreadQueueHandler(queue.SimpleQueue())
+        self.logger.addHandler(self.queue_handler)
+        self.listener = None
+        self.start()
+        atexit.register(self.stop)
+        # listener thread doesn't survive fork, forked worker needs its own one
+        os.register_at_fork(after_in_child=self.restart)
+
+    def file_handler(self):
+        """ Size rotated handler of current process own log file """
+        root, extension = os.path.splitext(self.file)
+        handler = logging.handlers.RotatingFileHandler(
+            f"{root}.{os.getpid()}{extension}", maxBytes=int(os.environ.get("LOG_MAX_BYTES", 10 * 1024 * 1024)),
+            backupCount=int(os.environ.get("LOG_BACKUP_COUNT", 5)), encoding='utf-8', delay=True)
+        handler.setFormatter(self.formatter)
+        return handler
+
+    def start(self):
+        """ Start background thread writing queued records to log file and console """
+        self.listener = logging.handlers.QueueListener(self.queue_handler.queue, self.log_handler,
+                                                       self.console_handler, respect_handler_level=True)
+        self.listener.start()
+
+    def stop(self):
+        """ Write all queued records and stop background thread """
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+    def restart(self):
+        """ Start new background thread with new queue and own log file in forked process """
+        self.queue_handler.queue = queue.SimpleQueue()
+        self.log_handler.close()
+        self.log_handler = self.file_handler()
+        self.start()
 
     def change_level(self, mode: str):
         """ Changing logger mode.
@@ -51,58 +162,77 @@ class Logger:
         """
         if mode not in ('ERROR', 'INFO', 'WARNING', 'DEBUG', 'FATAL'):
             raise ValueError("Wring logger mode name. Must be 'ERROR', 'INFO', 'WARNING', 'DEBUG' or 'FATAL'.")
-        logging.basicConfig(level=get_logging_mode(mode))
+        self.logging_mode = get_logging_mode(mode)
+        self.logger.setLevel(self.logging_mode)
+
+    def is_enabled(self, level: int):
+        """ Check if messages of given level are written, for skipping expensive preparing of message
 
-    @property
-    def event_time(self):
-        """ Property method, returns time then called as YYYY.MM.DD
+        :param int level: logging level, logging.DEBUG for example
 
-        :returns: str
+        :returns: bool
         """
-        time = datetime.datetime.now()
-        return datetime.datetime.strftime(time, "%Y.%m.%d-%H:%M")
+        return self.logger.isEnabledFor(level)
 
-    def debug(self, message: str):
+    def debug(self, message: str, *args):
         """ Debug implementation for custom logger
 
-        :param str message: log text
+        :param str message: log text, can have %-style placeholders
+
+        :param args: placeholders values, formatted only if level is enabled
 
         :returns: None
         """
-        self.logger.debug(f"[{self.event_time}] -  {message}")
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(message, *args)
 
-    def error(self, message: str):
+    def error(self, message: str, *args):
         """ Error implementation for custom logger
 
-        :param str message: log text
+        :param str message: log text, can have %-style placeholders
+
+        :param args: placeholders values, formatted only if level is enabled
 
         :returns: None
         """
-        self.logger.error(f"[{self.event_time}] -  {message}")
+        if self.logger.isEnabledFor(logging.ERROR):
+            self.logger.error(message, *args)
 
-    def info(self, message: str):
+    def info(self, message: str, *args):
         """ Info implementation for custom logger
-        :param str message: log text
+
+        :param str message: log text, can have %-style placeholders
+
+        :param args: placeholders values, formatted only if level is enabled
 
         :returns: None
         """
-        self.logger.info(f"[{self.event_time}] -  {message}")
+        if self.logger.isEnabledFor(logging.INFO):
+            self.logger.info(message, *args)
 
-    def warning(self, message: str):
-        """ Info implementation for custom logger
-        :param str message: log text
+    def warning(self, message: str, *args):
+        """ Warning implementation for custom logger
+
+        :param str message: log text, can have %-style placeholders
+
+        :param args: placeholders values, formatted only if level is enabled
 
         :returns: None
         """
-        self.logger.warning(f"[{self.event_time}] -  {message}")
+        if self.logger.isEnabledFor(logging.WARNING):
+            self.logger.warning(message, *args)
 
-    def fatal(self, message: str):
-        """ Info implementation for custom logger
-        :param str message: log text
+    def fatal(self, message: str, *args):
+        """ Fatal implementation for custom logger
+
+        :param str message: log text, can have %-style placeholders
+
+        :param args: placeholders values, formatted only if level is enabled
 
         :returns: None
         """
-        self.logger.fatal(f"[{self.event_time}] -  {message}")
+        if self.logger.isEnabledFor(logging.FATAL):
+            self.logger.fatal(message, *args)
 
 
 logging.basicConfig(level=get_logging_mode())
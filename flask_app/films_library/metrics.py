@@ -0,0 +1,109 @@
+""" Prometheus metrics of films_app: requests latency and database work per request.
+
+ Notices:
+ - with several gunicorn workers $PROMETHEUS_MULTIPROC_DIR must point to empty writable directory,
+   every worker keeps its values there and /api/metrics aggregates them (see gunicorn.conf.py).
+   Without it metrics of the answering process only are exposed, fine for local launches.
+ - route label is url rule, like /api/films/, not the real path, so labels count stays small.
+ - latency of streamed responses is measured till the response object is ready, not till the last byte.
+ - caches of cache.py count their hits and misses here by cache name, like 'search' or 'users'.
+ - trigram index gauges are per process, every worker has its own index.
+ """
+import os
+import time
+from flask import g, request, has_request_context
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess, \
+    CONTENT_TYPE_LATEST
+from sqlalchemy import event
+from . import db, films_app
+
+# gunicorn empties it on start (see gunicorn.conf.py), other servers, like uvicorn of read service, only need it
+if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+    os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+
+LABELS = ("route", "method")
+REQUEST_LATENCY = Histogram("films_http_request_duration_seconds", "Requests latency by route and method",
+                            LABELS + ("status",))
+DB_STATEMENTS = Histogram("films_db_statements_per_request", "SQL statements executed by one request", LABELS,
+                          buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100, 250))
+DB_TIME = Histogram("films_db_seconds_per_request", "Time spent in database by one request", LABELS)
+CACHE_REQUESTS = Counter("films_cache_requests", "Lookups of process caches by cache and result, hit or miss",
+                         ("cache", "result"))
+CACHE_INVALIDATIONS = Counter("films_cache_invalidations", "Drops of cached values made stale by writes", ("cache",))
+DB_STATEMENTS_TOTAL = Counter("films_db_statements", "SQL statements executed in and out of requests by database",
+                              ("bind",))
+TRIGRAM_INDEX_FILMS = Gauge("films_trigram_index_films", "Films titles in trigram index of process",
+                            multiprocess_mode="liveall")
+TRIGRAM_INDEX_TRIGRAMS = Gauge("films_trigram_index_trigrams", "Distinct trigrams in trigram index of process",
+                               multiprocess_mode="liveall")
+TRIGRAM_INDEX_MEMORY = Gauge("films_trigram_index_memory_bytes", "Approximate memory of trigram index of process",
+                             multiprocess_mode="liveall")
+TRIGRAM_INDEX_REBUILDS = Counter("films_trigram_index_rebuilds", "Full rebuilds of trigram indexes")
+
+
+def _route():
+    """ Url rule of current request or 'unmatched' for 404 """
+    return request.url_rule.rule if request.url_rule is not None else "unmatched"
+
+
+@films_app.before_request
+def start_request_timer():
+    """ Reset request's counters. flask.g is shared by requests, so they are set every time. """
+    g.metrics_started = time.perf_counter()
+    g.db_statements = 0
+    g.db_seconds = 0.0
+
+
+@films_app.after_request
+def observe_request(response):
+    """ Record latency and database work of finished request """
+    started = g.pop("metrics_started", None)
+    if started is not None:
+        route, method = _route(), request.method
+        REQUEST_LATENCY.labels(route, method, response.status_code).observe(time.perf_counter() - started)
+        DB_STATEMENTS.labels(route, method).observe(g.pop("db_statements", 0))
+        DB_TIME.labels(route, method).observe(g.pop("db_seconds", 0.0))
+    return response
+
+
+def watch_engine(engine, bind: str):
+    """ Count statements of engine and their time for current request.
+
+    :param str bind: 'primary' or replica bind key, label of statements counter
+    """
+    statements_total = DB_STATEMENTS_TOTAL.labels(bind)
+
+    def start_statement_timer(conn, cursor, statement, parameters, context, executemany):
+        # start time is kept on statement's execution context, so failed statement leaves nothing behind.
+        # Statements without context (defaults generators) overwrite the only value on connection.
+        if context is not None:
+            context.metrics_started = time.perf_counter()
+        else:
+            conn.info["metrics_started"] = time.perf_counter()
+
+    def observe_statement(conn, cursor, statement, parameters, context, executemany):
+        started = context.metrics_started if context is not None else conn.info.pop("metrics_started")
+        statements_total.inc()
+        if has_request_context() and "metrics_started" in g:
+            g.db_statements += 1
+            g.db_seconds += time.perf_counter() - started
+
+    event.listen(engine, "before_cursor_execute", start_statement_timer)
+    event.listen(engine, "after_cursor_execute", observe_statement)
+
+
+# primary and replicas, reads of replica_reads() blocks go to replicas
+for _key, _engine in db.engines.items():
+    watch_engine(_engine, "primary" if _key is None else _key)
+
+
+def latest():
+    """ Metrics in Prometheus text format, aggregated over all workers in multiprocess mode.
+
+    :returns: tuple (bytes, content type)
+    """
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -2,16 +2,27 @@
  Notices:
  - no need to make column autoincrement=True if it is 1st integer column with no foreign key.
  """
+from flask import g
 from flask_login import UserMixin
 from datetime import datetime
 from werkzeug.security import check_password_hash, generate_password_hash
-from films_library import db, login_manager
+from sqlalchemy.dialects import postgresql
+from films_library import db, login_manager, films_app
 
 
 @login_manager.user_loader
 def load_user(user_id):
-    """ For keeping user in session """
-    return User.query.get(int(user_id))
+    """ For keeping user in session. Users are served by per-worker cache of UserSnapshot. """
+    from .cache import users_cache
+    return users_cache.load(int(user_id))
+
+
+@films_app.before_request
+def forget_loaded_user():
+    """ App context (and flask.g with it) is pushed once and shared by all requests,
+    so user loaded by previous request must be dropped before the next one.
+    """
+    g.pop("_login_user", None)
 
 
 # Many To Many relationship between users and uploaded films
@@ -24,12 +35,16 @@ users_films = db.Table('usersfilms',
 films_directors = db.Table('filmsdirectors',
                            db.Column('film_id', db.Integer, db.ForeignKey('films.id', ondelete="CASCADE")),
                            db.Column('director_id', db.Integer, db.ForeignKey('directors.id', ondelete="CASCADE")),
+                           db.Index('ix_filmsdirectors_film_id', 'film_id'),
+                           db.Index('ix_filmsdirectors_director_id', 'director_id'),
                            )
 
 # Many To Many relationship between films and genres
 films_genres = db.Table('filmsgenres',
                         db.Column('film_id', db.ForeignKey('films.id', ondelete="CASCADE")),
-                        db.Column('genres_id', db.ForeignKey('genres.id', ondelete="CASCADE"))
+                        db.Column('genres_id', db.ForeignKey('genres.id', ondelete="CASCADE")),
+                        db.Index('ix_filmsgenres_film_id', 'film_id'),
+                        db.Index('ix_filmsgenres_genres_id', 'genres_id'),
                         )
 
 
@@ -117,6 +132,35 @@ class User(UserMixin, db.Model):
         return self._films.all()
 
 
+class UserSnapshot(UserMixin):
+    """ Detached read-only copy of user's row for flask-login, kept by users cache between requests.
+    Isn't bound to session, so it is safe to share it by requests of one worker.
+
+    :param user: User instance
+    """
+    COLUMNS = ("id", "nickname", "email", "country", "city", "street", "is_admin")
+
+    def __init__(self, user: User):
+        for column in self.COLUMNS:
+            setattr(self, column, getattr(user, column))
+
+    def __repr__(self):
+        """ Magic method for useful printing info about instance """
+        return f"User snapshot with id: {self.id}. Full: {self.__dict__}"
+
+    def to_dict(self):
+        """ Create dict from attributes to adopt it for json. """
+        data = {column: getattr(self, column) for column in self.COLUMNS}
+        data["films"] = self.films
+        return data
+
+    @property
+    def films(self):
+        """ Returns all films linked with user """
+        return Films.query.join(users_films, users_films.c.film_id == Films.id)\
+            .filter(users_films.c.user_id == self.id).all()
+
+
 class Films(db.Model):
     """ Model for films table.
 
@@ -132,6 +176,9 @@ class Films(db.Model):
 
     """
     __tablename__ = 'films'
+    # (sort column, id) pairs for keyset pagination
+    __table_args__ = (db.Index("ix_films_rate_id", "rate", "id"),
+                      db.Index("ix_films_release_date_id", "release_date", "id"))
     id = db.Column(db.Integer, primary_key=True, nullable=False)
     title = db.Column(db.String, nullable=False)
     description = db.Column(db.String)
@@ -139,6 +186,8 @@ class Films(db.Model):
     release_date = db.Column(db.TIMESTAMP)
     poster_url = db.Column(db.String)
     user_id = db.Column(db.Integer)
+    # changing time of film's row or its genres/directors links, for incremental exports
+    updated_at = db.Column(db.TIMESTAMP, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
 
     # Many-to-many relation with table users_films
     # 'films' in backrefs is the name of "column" id User class.
@@ -209,11 +258,11 @@ class Films(db.Model):
     @property
     def directors(self):
         """ Property method for with minmal logic.
-        Returns directors list, linked to current film. Or "Unknown" if list is empty
+        Returns directors list, linked to current film. Or ["unknown"] if list is empty
         """
         if len(self._directors) != 0:
             return self._directors
-        return "unknown"
+        return ["unknown"]
 
 
 class Directors(db.Model):
@@ -244,3 +293,72 @@ class Genres(db.Model):
     def __repr__(self):
         """ Magic method for useful printing info about instance """
         return self.name
+
+
+class CatalogState(db.Model):
+    """ Model for catalog_state table. The only row with id=1 keeps catalog generation number,
+    increased by every films catalog change for invalidating caches in all workers.
+
+    :param generation: integer catalog changes counter
+
+    :param dictionary_generation: integer counter of directors/genres deletions
+    """
+    __tablename__ = 'catalog_state'
+    id = db.Column(db.Integer, nullable=False, primary_key=True)
+    generation = db.Column(db.BigInteger, nullable=False, default=0)
+    dictionary_generation = db.Column(db.BigInteger, nullable=False, default=0)
+
+
+class CatalogFacet(db.Model):
+    """ Model for catalog_facets table: films counts by genre, director and release year,
+    kept actual by films changes in the same transaction.
+
+    :param scope: 0 for the whole catalog or genre id for films of this genre only
+
+    :param facet: 'genres', 'directors' or 'years'
+
+    :param value: genre id, director id or release year
+
+    :param films: integer count of films, can be 0 after deletions
+    """
+    __tablename__ = 'catalog_facets'
+    scope = db.Column(db.Integer, nullable=False, primary_key=True)
+    facet = db.Column(db.String(10), nullable=False, primary_key=True)
+    value = db.Column(db.Integer, nullable=False, primary_key=True)
+    films = db.Column(db.Integer, nullable=False, default=0)
+
+
+# ids lists: integer arrays with GIN indexes on PostgreSQL, JSON arrays elsewhere
+IDS_LIST = db.JSON().with_variant(postgresql.ARRAY(db.Integer), "postgresql")
+
+
+class FilmSearch(db.Model):
+    """ Model for film_search table: denormalized copy of films searched fields, one row per film,
+    kept actual by films changes in the same transaction.
+
+    :param film_id: films.id
+
+    :param title_lower: lower-cased film's title for template search
+
+    :param rate: film's rate for sorting
+
+    :param release_date: film's release date for filtering and sorting
+
+    :param genre_ids: list of film's genres ids
+
+    :param director_ids: list of film's directors ids
+    """
+    __tablename__ = 'film_search'
+    # (sort column, id) pairs for keyset pagination, GIN indexes for ids lists overlapping/containing
+    __table_args__ = (db.Index("ix_film_search_rate_id", "rate", "film_id"),
+                      db.Index("ix_film_search_release_date_id", "release_date", "film_id"),
+                      db.Index("ix_film_search_genre_ids", "genre_ids", postgresql_using="gin")
+                      .ddl_if(dialect="postgresql"),
+                      db.Index("ix_film_search_director_ids", "director_ids", postgresql_using="gin")
+                      .ddl_if(dialect="postgresql"))
+    film_id = db.Column(db.Integer, db.ForeignKey('films.id', ondelete="CASCADE"), primary_key=True)
+    title_lower = db.Column(db.String, nullable=False)
+    rate = db.Column(db.Float)
+    release_date = db.Column(db.TIMESTAMP)
+    genre_ids = db.Column(IDS_LIST, nullable=False)
+    director_ids = db.Column(IDS_LIST, nullable=False)
@@ -0,0 +1,152 @@
+""" Database connection pools: settings from environment, live statistics, statement timeout and fork safety.
+
+ Notices:
+ - pools of primary, replicas and async read service are made by engine_options() from $DB_POOL_SIZE,
+   $DB_MAX_OVERFLOW, $DB_POOL_TIMEOUT, $DB_POOL_RECYCLE and $DB_POOL_PRE_PING. Sizes are skipped for
+   in-memory sqlite, it has no queue pool. TimedQueuePool counts checkout time: waiting for free
+   connection or opening a new one.
+ - $DB_STATEMENT_TIMEOUT_MS limits statements: statement_timeout on PostgreSQL, progress handler on sqlite,
+   where time till the first row is limited.
+ - forked process (preloaded gunicorn worker, import parsing worker) gets new empty pools. Session and
+   connections inherited from parent are left untouched, closing them would close parent's sockets.
+ - readiness() pings every bind and collects pools statistics for /api/health/ready.
+"""
+import os
+import time
+from sqlalchemy import event, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+
+# sessions of parent process, kept referenced in forked child so they are never closed there
+_inherited_sessions = []
+
+
+class TimedQueuePool(QueuePool):
+    """ QueuePool counting checkouts and time they took """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.checkout_seconds = 0.0
+        self.max_checkout_seconds = 0.0
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            seconds = time.perf_counter() - started
+            self.checkouts += 1
+            self.checkout_seconds += seconds
+            self.max_checkout_seconds = max(self.max_checkout_seconds, seconds)
+
+
+def _in_memory(url):
+    """ Check if url is sqlite in-memory database, its engines use StaticPool or SingletonThreadPool """
+    return url.get_backend_name() == "sqlite" and (not url.database or ":memory:" in url.database or
+                                                    url.query.get("mode") == "memory")
+
+
+def engine_options(uri: str = None, poolclass=TimedQueuePool):
+    """ Engine options of database from environment, SQLAlchemy defaults except pre-ping and recycle.
+    Queue pool class and its sizes are set only for databases using queue pools, not for in-memory sqlite.
+
+    :param uri: database url, string or URL
+
+    :param poolclass: queue pool class, None keeps dialect's one (async engines)
+
+    :returns: dict
+    """
+    # recycle is in seconds, connections older than it are reopened before servers or proxies drop them
+    options = dict(pool_recycle=int(os.environ.get("DB_POOL_RECYCLE", default=1800)),
+                   pool_pre_ping=os.environ.get("DB_POOL_PRE_PING", default="1") == "1")
+    if uri is None or _in_memory(make_url(uri)):
+        return options
+    if poolclass is not None:
+        options["poolclass"] = poolclass
+    options.update(pool_size=int(os.environ.get("DB_POOL_SIZE", default=5)),
+                   max_overflow=int(os.environ.get("DB_MAX_OVERFLOW", default=10)),
+                   pool_timeout=float(os.environ.get("DB_POOL_TIMEOUT", default=30)))
+    return options
+
+
+def _set_statement_timeout(app, engine):
+    """ Limit statements of engine's new connections by DB_STATEMENT_TIMEOUT_MS """
+    if engine.dialect.name == "postgresql":
+        @event.listens_for(engine, "connect")
+        def set_timeout(dbapi_connection, connection_record):
+            timeout = int(app.config["DB_STATEMENT_TIMEOUT_MS"])
+            if timeout > 0:
+                cursor = dbapi_connection.cursor()
+                cursor.execute(f"SET statement_timeout = {timeout}")
+                cursor.close()
+                # SET of rolled back transaction is undone
+                dbapi_connection.commit()
+    elif engine.dialect.name == "sqlite":
+        @event.listens_for(engine, "connect")
+        def set_progress_handler(dbapi_connection, connection_record):
+            info = connection_record.info
+            # non zero result interrupts running statement
+            dbapi_connection.set_progress_handler(lambda: time.monotonic() > info.get("deadline", float("inf")),
+                                                  10000)
+
+        @event.listens_for(engine, "before_cursor_execute")
+        def start_deadline(conn, cursor, statement, parameters, context, executemany):
+            timeout = app.config["DB_STATEMENT_TIMEOUT_MS"]
+            if timeout > 0:
+                conn.info["deadline"] = time.monotonic() + timeout / 1000
+
+        @event.listens_for(engine, "after_cursor_execute")
+        def stop_deadline(conn, cursor, statement, parameters, context, executemany):
+            conn.info.pop("deadline", None)
+
+
+def setup(app):
+    """ Statement timeouts of app's engines and new pools in forked processes. Called in app context. """
+    sqlalchemy = app.extensions["sqlalchemy"]
+    # the same dict later, replicas included
+    engines = sqlalchemy.engines
+    for engine in engines.values():
+        _set_statement_timeout(app, engine)
+
+    def forget_parent_connections():
+        _inherited_sessions.append(dict(sqlalchemy.session.registry.registry))
+        sqlalchemy.session.registry.registry.clear()
+        for engine in engines.values():
+            engine.dispose(close=False)
+    os.register_at_fork(after_in_child=forget_parent_connections)
+
+
+def pool_stats(pool):
+    """ Live statistics of engine's pool
+
+    :returns: dict
+    """
+    stats = {}
+    if isinstance(pool, QueuePool):
+        stats.update(size=pool.size(), checked_out=pool.checkedout(), checked_in=pool.checkedin(),
+                     overflow=max(pool.overflow(), 0), timeout_seconds=pool.timeout())
+    if isinstance(pool, TimedQueuePool):
+        mean = pool.checkout_seconds / pool.checkouts if pool.checkouts else 0.0
+        stats.update(checkouts=pool.checkouts, checkout_ms_mean=round(mean * 1000, 3),
+                     checkout_ms_max=round(pool.max_checkout_seconds * 1000, 3))
+    return stats
+
+
+def readiness(app):
+    """ Ping primary and replicas by their pools.
+
+    :returns: tuple (True if every database answered, dict bind name -> pool stats with ping_ms or error)
+    """
+    ready, binds = True, {}
+    for key, engine in app.extensions["sqlalchemy"].engines.items():
+        started = time.perf_counter()
+        try:
+            with engine.connect() as connection:
+                connection.execute(text("SELECT 1"))
+            result = {"ping_ms": round((time.perf_counter() - started) * 1000, 3)}
+        except Exception as e:
+            ready = False
+            result = {"error": str(e).splitlines()[0]}
+        binds["primary" if key is None else key] = dict(pool_stats(engine.pool), **result)
+    return ready, binds
@@ -0,0 +1,199 @@
+""" Async read-only films search service: GET /api/films/ on async SQLAlchemy under ASGI server.
+
+Run from flask_app directory:
+    uvicorn films_library.read_service:app --workers 2 --port 5002
+
+ Notices:
+ - database is $ASYNC_DATABASE_URI, by default $SQLALCHEMY_DATABASE_URI with async driver:
+   asyncpg for PostgreSQL and aiosqlite for sqlite.
+ - with replicas ($REPLICA_DATABASE_URIS with async driver) every search reads one random replica,
+   except searches of clients which committed writes in read-your-writes window, like films_app does
+   (see routing.py). Client's write time is taken from films_app session cookie, so $SECRET_KEY
+   must be the same as films_app's one.
+ - parameters are parsed by the same parser, statements are built by the same code and films are
+   marshalled by the same film_model as films_app does, so responses are byte-identical.
+   Responses are cached by catalog generation like films_app ones, ETags and 304 answers are the same too.
+ - searches with facets or total are answered by films_app only, here they get 400.
+   nginx sends GET /api/films/ without them here.
+ - trigram index isn't used in this process, its building is a blocking query. Templates are matched by database,
+   statements are built with TRIGRAM_INDEX of this module, films_app config is left untouched.
+"""
+import random
+from flask_restx import marshal
+from flask_restx.representations import output_json
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from werkzeug.exceptions import HTTPException
+from . import database, films_app, pools
+from .api import film_model, films_search_params, search_cache, etag_headers, not_modified
+from .cache import CATALOG_STATE_SELECT, directors_ids, genres_ids, search_key, catalog_etag
+from .errors import NotFoundError
+from .logger import Log
+from .routing import REPLICA_PREFIX, wrote_recently
+
+FILMS_PATH = "/api/films/"
+ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+FILTERS = ("template", "date_from", "date_to", "genres", "directors", "match_mode", "sort_by", "sort_type", "search")
+# statements of this service never use trigram index of process
+TRIGRAM_INDEX = False
+
+# bind key (None for primary) -> async engine and its sessions factory
+_engines = {}
+_sessions = {}
+
+
+def async_database_uri(uri: str):
+    """ Uri of the same database with async driver """
+    url = make_url(uri)
+    return url.set(drivername=ASYNC_DRIVERS[url.get_backend_name()])
+
+
+def sessions(bind: str = None):
+    """ Async sessions factory of current process, engine is made with the first call (after workers fork)
+
+    :param str bind: replica bind key, None for primary database
+    """
+    if bind not in _sessions:
+        if bind is None:
+            uri = films_app.config["ASYNC_DATABASE_URI"] or \
+                async_database_uri(films_app.config["SQLALCHEMY_DATABASE_URI"])
+        else:
+            uri = async_database_uri(films_app.config["SQLALCHEMY_BINDS"][bind]["url"])
+        # pool settings of films_app, async engine keeps its own pool class
+        _engines[bind] = create_async_engine(uri, **pools.engine_options(uri, poolclass=None))
+        _sessions[bind] = async_sessionmaker(_engines[bind], expire_on_commit=False)
+    return _sessions[bind]
+
+
+async def dispose():
+    """ Close database connections of current process """
+    for engine in _engines.values():
+        await engine.dispose()
+    _engines.clear()
+    _sessions.clear()
+
+
+def read_bind(request):
+    """ Database of request's search: random replica or primary if there are no replicas or client wrote recently
+
+    :returns: replica bind key or None for primary
+    """
+    keys = sorted(key for key in films_app.config["SQLALCHEMY_BINDS"] if key.startswith(REPLICA_PREFIX))
+    if not keys:
+        return None
+    client_session = films_app.session_interface.open_session(films_app, request)
+    if client_session is not None and wrote_recently(client_session):
+        return None
+    return random.choice(keys)
+
+
+async def _names_ids(session, names_cache, names: list):
+    """ Ids of names from process cache, names missing in cache are read by one statement.
+
+    :returns: dict name -> id for names which are in database
+    """
+    found, missing = names_cache.cached_ids(names)
+    if missing:
+        for name_id, name in await session.execute(names_cache.ids_select(missing)):
+            names_cache.remember(name, name_id)
+            found[name] = name_id
+    return found
+
+
+async def films_search(query_string: bytes, headers: dict = None):
+    """ Answer films search like GET /api/films/ of films_app does.
+
+    :param bytes query_string: raw query string of request
+
+    :param dict headers: request headers, lowercase names -> values, both bytes
+
+    :returns: tuple (response data, status code) or Response 304
+    """
+    headers = headers or {}
+    request = films_app.request_class({"REQUEST_METHOD": "GET", "QUERY_STRING": query_string.decode("latin-1"),
+                                       "HTTP_IF_NONE_MATCH": headers.get(b"if-none-match", b"").decode("latin-1"),
+                                       "HTTP_COOKIE": headers.get(b"cookie", b"").decode("latin-1")})
+    try:
+        params = films_search_params(request)
+    except HTTPException as e:
+        return getattr(e, "data", {"message": e.description}), e.code
+    if params["facets"] or params["total"] is not None:
+        return "Searches with facets or total are answered by main application!", 400
+    async with sessions(read_bind(request))() as session:
+        state = (await session.execute(CATALOG_STATE_SELECT)).first()
+        generation, dictionary_generation = state if state is not None else (0, 0)
+        directors_ids.sync(dictionary_generation)
+        genres_ids.sync(dictionary_generation)
+        key = generation, search_key(**params)
+        etag = catalog_etag(*key)
+        response = not_modified(etag, request)
+        if response is not None:
+            return response
+        response = search_cache.get(key)
+        if response is not None:
+            return response + (etag_headers(etag),) if response[1] == 200 else response
+
+        names = database.filters_names(params["genres"], params["directors"])
+        names_ids = dict(genres=await _names_ids(session, genres_ids, names["genres"]),
+                         directors=await _names_ids(session, directors_ids, names["directors"]))
+        filters = {name: params[name] for name in FILTERS}
+        filters.update(names_ids=names_ids, trigram_index=TRIGRAM_INDEX)
+        try:
+            if params["cursor"] is None:
+                statement = database.films_page_statement(page_number=params["page_number"],
+                                                          pagination_size=params["pagination_size"], **filters)
+            else:
+                statement = database.films_cursor_statement(cursor=params["cursor"],
+                                                            pagination_size=params["pagination_size"], **filters)
+        except ValueError as e:
+            Log.error(e)
+            return str(e), 403
+        # relations are loaded by selectinload statements inside execute, marshal doesn't touch database
+        films = (await session.execute(statement)).scalars().all()
+    if not films:
+        error = NotFoundError()
+        response = error.message, error.status_code
+    elif params["cursor"] is None:
+        response = marshal(films, film_model), 200
+    else:
+        films, next_cursor = database.cursor_page(films, params["pagination_size"], sort_by=params["sort_by"],
+                                                  sort_type=params["sort_type"])
+        response = {"films": marshal(films, film_model), "next_cursor": next_cursor}, 200
+    search_cache.set(key, response)
+    return response + (etag_headers(etag),) if response[1] == 200 else response
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await dispose()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    """ ASGI application """
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+    if scope["path"] != FILMS_PATH:
+        result = {"message": "Not found"}, 404
+    elif scope["method"] not in ("GET", "HEAD"):
+        result = {"message": "The method is not allowed for the requested URL."}, 405
+    else:
+        result = await films_search(scope["query_string"], dict(scope["headers"]))
+    if isinstance(result, films_app.response_class):
+        response = result
+    else:
+        # serialized by the same restx representation as films_app responses
+        response = output_json(*result)
+        response.headers["Content-Type"] = "application/json"
+    await send({"type": "http.response.start", "status": response.status_code,
+                "headers": [(name.lower().encode("latin-1"), value.encode("latin-1"))
+                            for name, value in response.headers.to_wsgi_list()]})
+    await send({"type": "http.response.body", "body": b"" if scope["method"] == "HEAD" else response.get_data()})
@@ -0,0 +1,92 @@
+""" Read replicas routing of database session.
+
+ Notices:
+ - replicas are SQLALCHEMY_BINDS with 'replica' keys, made from $REPLICA_DATABASE_URIS.
+   Without them everything goes to the primary database as before.
+ - only SELECT statements inside replica_reads() go to replica, one replica is picked for the whole block.
+   Everything else, writes and login included, goes to primary.
+ - read-your-writes: commit with writes made by request stamps client's flask session, so client's own
+   reads go to primary for READ_YOUR_WRITES_SECONDS after it. Other clients may see replica lag meanwhile.
+"""
+import random
+import time
+from contextlib import contextmanager
+from flask import current_app, has_request_context, session as client_session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+
+REPLICA_PREFIX = "replica"
+# flask session key of client's last write time
+WROTE_AT = "_wrote_at"
+
+
+class RoutingSession(Session):
+    """ Session sending reads of replica_reads() blocks to replica bind """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        replica = self.info.get("replica")
+        if bind is None and replica is not None and not self._flushing and clause is not None and clause.is_select:
+            return self._db.engines[replica]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def replica_keys():
+    """ Bind keys of configured replicas """
+    return sorted(key for key in current_app.extensions["sqlalchemy"].engines
+                  if key is not None and key.startswith(REPLICA_PREFIX))
+
+
+def wrote_recently(session) -> bool:
+    """ Check if client committed writes in read-your-writes window
+
+    :param session: client's flask session
+    """
+    return time.time() - session.get(WROTE_AT, 0) < current_app.config["READ_YOUR_WRITES_SECONDS"]
+
+
+def _wrote_recently():
+    """ Check if current request's client committed writes in read-your-writes window """
+    return has_request_context() and wrote_recently(client_session)
+
+
+@contextmanager
+def replica_reads():
+    """ Send SELECT statements of the block to a replica. Works as decorator too.
+    Nested blocks use the replica of outer one.
+    """
+    session = current_app.extensions["sqlalchemy"].session
+    if session.info.get("replica") is not None:
+        yield
+        return
+    keys = replica_keys()
+    if not keys or _wrote_recently():
+        yield
+        return
+    session.info["replica"] = random.choice(keys)
+    try:
+        yield
+    finally:
+        session.info.pop("replica", None)
+
+
+@event.listens_for(RoutingSession, "do_orm_execute")
+def _remember_statement_write(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.session.info["wrote"] = True
+
+
+@event.listens_for(RoutingSession, "after_flush")
+def _remember_flush_write(session, flush_context):
+    session.info["wrote"] = True
+
+
+@event.listens_for(RoutingSession, "after_commit")
+def _stamp_client_write(session):
+    """ Start read-your-writes window of client which request committed writes """
+    if session.info.pop("wrote", False) and has_request_context():
+        client_session[WROTE_AT] = time.time()
+
+
+@event.listens_for(RoutingSession, "after_rollback")
+def _forget_write(session):
+    session.info.pop("wrote", None)
@@ -0,0 +1,113 @@
+""" Full-text search over films title and description.
+
+ Notices:
+ - on PostgreSQL films table has generated tsvector column search_vector with GIN index,
+   so database keeps it actual by itself.
+ - on SQLite (local launches and tests) FTS5 table films_fts shadows films rows by their ids
+   and must be updated with index_film/unindex_film in the same transaction as films changes.
+ """
+import re
+from sqlalchemy import func, text, literal_column, Integer, Float, desc, asc
+from . import db
+from .models import Films
+
+FTS_TABLE = "films_fts"
+# text search configuration of films.search_vector column, must be the same as in migration
+PG_TS_CONFIG = "english"
+
+
+def _dialect():
+    """ Name of current database dialect, 'postgresql' or 'sqlite' """
+    return db.session.get_bind().dialect.name
+
+
+def _fts5_query(query: str):
+    """ Make safe FTS5 query from user's text: every word must be in film's title or description.
+    Words are quoted, so FTS5 operators in user's text are searched as plain words.
+
+    :returns: str or None if text has no words
+    """
+    words = re.findall(r"\w+", query)
+    if not words:
+        return None
+    return " ".join(f'"{word}"' for word in words)
+
+
+def create_index():
+    """ Create full-text index if it doesn't exist: SQLite FTS5 table or PostgreSQL generated search_vector
+    column with GIN index, the same as migration makes. Needed after schema is made by create_all().
+    """
+    if _dialect() == "sqlite":
+        db.session.execute(text(f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(title, description)"))
+    elif _dialect() == "postgresql":
+        db.session.execute(text(f"ALTER TABLE films ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS "
+                                f"AS (to_tsvector('{PG_TS_CONFIG}', coalesce(title, '') || ' ' || "
+                                f"coalesce(description, ''))) STORED"))
+        db.session.execute(text("CREATE INDEX IF NOT EXISTS ix_films_search_vector ON films USING GIN (search_vector)"))
+    db.session.commit()
+
+
+def rebuild_index():
+    """ Refill SQLite FTS5 table from films table """
+    if _dialect() == "sqlite":
+        create_index()
+        db.session.execute(text(f"DELETE FROM {FTS_TABLE}"))
+        db.session.execute(text(f"INSERT INTO {FTS_TABLE}(rowid, title, description) "
+                                f"SELECT id, title, coalesce(description, '') FROM films"))
+        db.session.commit()
+
+
+def index_film(film: Films):
+    """ Add film to full-text index or refresh its indexed title and description.
+    Film must have id already (be flushed). Doesn't commit.
+    """
+    if _dialect() == "sqlite":
+        unindex_film(film.id)
+        db.session.execute(text(f"INSERT INTO {FTS_TABLE}(rowid, title, description) "
+                                f"VALUES (:id, :title, :description)"),
+                           {"id": film.id, "title": film.title, "description": film.description or ""})
+
+
+def index_new_films(films: list):
+    """ Add just inserted films to full-text index with one statement. Doesn't commit.
+
+    :param list films: dicts with id, title and description keys
+    """
+    if _dialect() == "sqlite" and films:
+        db.session.execute(text(f"INSERT INTO {FTS_TABLE}(rowid, title, description) "
+                                f"VALUES (:id, :title, :description)"),
+                           [{"id": film["id"], "title": film["title"], "description": film["description"] or ""}
+                            for film in films])
+
+
+def unindex_film(film_id: int):
+    """ Remove film from full-text index. Doesn't commit. """
+    if _dialect() == "sqlite":
+        db.session.execute(text(f"DELETE FROM {FTS_TABLE} WHERE rowid = :id"), {"id": film_id})
+
+
+def apply_full_text(statement, query: str):
+    """ Add full-text condition to films select statement.
+
+    :param statement: select statement over Films
+
+    :param str query: user's search text
+
+    :returns: tuple (statement, relevance ordering clause), most relevant films first
+    """
+    if _dialect() == "postgresql":
+        ts_query = func.websearch_to_tsquery(PG_TS_CONFIG, query)
+        search_vector = literal_column("films.search_vector")
+        statement = statement.where(search_vector.op("@@")(ts_query))
+        return statement, desc(func.ts_rank(search_vector, ts_query))
+
+    fts_query = _fts5_query(query)
+    if fts_query is None:
+        # nothing to search for, so nothing matches
+        return statement.where(Films.id.is_(None)), asc(Films.id)
+    # bm25 gives negative numbers, the less the better
+    matches = text(f"SELECT rowid AS film_id, bm25({FTS_TABLE}) AS rank FROM {FTS_TABLE} "
+                   f"WHERE {FTS_TABLE} MATCH :fts_query")\
+        .bindparams(fts_query=fts_query).columns(film_id=Integer, rank=Float).subquery("fts_matches")
+    statement = statement.join(matches, matches.c.film_id == Films.id)
+    return statement, asc(matches.c.rank)
@@ -0,0 +1,186 @@
+""" Opt-in slow queries log with EXPLAIN plans.
+
+ Notices:
+ - enabled by $SLOW_QUERY_MS > 0: statements running longer are logged with their parameters,
+   calling films_library.database function and database plan.
+ - values of credential columns (CREDENTIAL_COLUMNS) are replaced by placeholder in logged parameters
+   and plans. If parameters can't be matched to columns, all parameters of such statement are hidden.
+ - only $SLOW_QUERY_SAMPLE_RATE part of slow statements (1.0 by default) is explained and logged,
+   others are only counted. Fast statements cost two timer calls.
+ - plan is taken by EXPLAIN (EXPLAIN QUERY PLAN on SQLite) on the same connection through raw DBAPI
+   cursor, so it sees the same transaction and doesn't trigger engine events again. EXPLAIN doesn't
+   run the statement. On PostgreSQL it is wrapped to savepoint, failed EXPLAIN doesn't break transaction.
+ """
+import random
+import re
+import sys
+import time
+from collections import deque
+from sqlalchemy import event
+from . import db, films_app
+from .logger import Log
+
+EXPLAINED_STATEMENTS = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH")
+# module which functions are reported as callers
+CALLER_MODULE = __name__.rsplit(".", 1)[0] + ".database"
+SAVEPOINT = "slow_query_explain"
+# columns which values never get to log, bind names are column names with optional _<number> suffix
+CREDENTIAL_COLUMNS = ("password", "email")
+HIDDEN = "<hidden>"
+
+
+def _caller():
+    """ Name of films_library.database function which runs current statement, like 'database.delete_director'
+
+    :returns: str or None if statement isn't run by database module
+    """
+    frame = sys._getframe(2)
+    while frame is not None:
+        if frame.f_globals.get("__name__") == CALLER_MODULE:
+            return f"database.{frame.f_code.co_name}"
+        frame = frame.f_back
+    return None
+
+
+def _is_credential(bind_name: str):
+    """ Check if bind parameter holds value of credential column """
+    return re.sub(r"_\d+$", "", bind_name) in CREDENTIAL_COLUMNS
+
+
+def _hide_credentials(context, parameters):
+    """ Copy of statement's parameters with values of credential columns replaced by HIDDEN
+
+    :returns: tuple (parameters for log, list of hidden values or None if all values are hidden)
+    """
+    compiled = getattr(context, "compiled", None)
+    if compiled is None or not any(_is_credential(name) for name in compiled.binds):
+        return parameters, []
+    if isinstance(parameters, list):
+        rows, hidden_values = [], []
+        for row in parameters:
+            row, values = _hide_credentials(context, row)
+            if values is None:
+                return HIDDEN, None
+            rows.append(row)
+            hidden_values += values
+        return rows, hidden_values
+    if isinstance(parameters, dict):
+        names, values = list(parameters), list(parameters.values())
+    else:
+        names, values = compiled.positiontup or [], list(parameters)
+    if len(names) != len(values):
+        # expanded IN lists don't match compiled names
+        return HIDDEN, None
+    hidden_values = [value for name, value in zip(names, values) if _is_credential(name)]
+    logged = [HIDDEN if _is_credential(name) else value for name, value in zip(names, values)]
+    return (dict(zip(names, logged)) if isinstance(parameters, dict) else tuple(logged)), hidden_values
+
+
+class SlowQueryLog:
+    """ Engine events listener logging statements slower than threshold.
+
+    :param float threshold_ms: minimal logged statement duration in milliseconds
+
+    :param float sample_rate: part of slow statements which are explained and logged, from 0 to 1
+
+    :param int keep: count of last logged records kept in memory
+    """
+
+    def __init__(self, threshold_ms: float, sample_rate: float = 1.0, keep: int = 100):
+        self.threshold = threshold_ms / 1000
+        self.sample_rate = sample_rate
+        self.slow = 0
+        self.logged = 0
+        self.records = deque(maxlen=keep)
+        self._engines = []
+
+    def install(self, engine):
+        """ Start listening engine's statements, several engines may be listened """
+        self._engines.append(engine)
+        event.listen(engine, "before_cursor_execute", self._before)
+        event.listen(engine, "after_cursor_execute", self._after)
+
+    def uninstall(self):
+        """ Stop listening all engines """
+        for engine in self._engines:
+            event.remove(engine, "before_cursor_execute", self._before)
+            event.remove(engine, "after_cursor_execute", self._after)
+        self._engines = []
+
+    def _before(self, conn, cursor, statement, parameters, context, executemany):
+        # kept on execution context, failed statement leaves nothing behind, see metrics.watch_engine
+        if context is not None:
+            context.slow_query_started = time.perf_counter()
+        else:
+            conn.info["slow_query_started"] = time.perf_counter()
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany):
+        started = context.slow_query_started if context is not None else conn.info.pop("slow_query_started")
+        duration = time.perf_counter() - started
+        if duration < self.threshold:
+            return
+        self.slow += 1
+        if random.random() >= self.sample_rate:
+            return
+        plan = None if executemany else self.explain(conn, statement, parameters)
+        logged_parameters, hidden_values = _hide_credentials(context, parameters)
+        if plan is not None and conn.dialect.name == "postgresql":
+            # PostgreSQL plans show parameters values, sqlite ones don't
+            if hidden_values is None:
+                plan = [HIDDEN]
+            for value in hidden_values or []:
+                if value:
+                    plan = [line.replace(str(value), HIDDEN) for line in plan]
+        record = dict(ms=round(duration * 1000, 3), caller=_caller(), statement=statement,
+                      parameters=logged_parameters, plan=plan)
+        self.records.append(record)
+        self.logged += 1
+        Log.warning("Slow query %.1f ms in %s: %s; parameters: %r; plan: %s", record["ms"], record["caller"],
+                    statement, logged_parameters, plan)
+
+    @staticmethod
+    def explain(conn, statement: str, parameters):
+        """ Database plan of statement.
+
+        :param conn: sqlalchemy Connection statement was run by
+
+        :returns: list of plan lines or None if statement can't be explained
+        """
+        if not statement.lstrip().upper().startswith(EXPLAINED_STATEMENTS):
+            return None
+        dialect = conn.dialect.name
+        prefix = "EXPLAIN QUERY PLAN " if dialect == "sqlite" else "EXPLAIN "
+        cursor = conn.connection.dbapi_connection.cursor()
+        try:
+            if dialect == "postgresql":
+                cursor.execute(f"SAVEPOINT {SAVEPOINT}")
+            try:
+                cursor.execute(prefix + statement, parameters)
+                rows = cursor.fetchall()
+            except Exception as e:
+                if dialect == "postgresql":
+                    cursor.execute(f"ROLLBACK TO SAVEPOINT {SAVEPOINT}")
+                Log.debug("Statement wasn't explained: %s", e)
+                return None
+            if dialect == "postgresql":
+                cursor.execute(f"RELEASE SAVEPOINT {SAVEPOINT}")
+        finally:
+            cursor.close()
+        # sqlite rows are (id, parent, notused, detail), postgresql rows have one text column
+        return [str(row[-1]) for row in rows]
+
+    def stats(self):
+        """ Count of slow statements and count of logged ones
+
+        :returns: dict
+        """
+        return dict(slow=self.slow, logged=self.logged, threshold_ms=self.threshold * 1000,
+                    sample_rate=self.sample_rate)
+
+
+slow_query_log = None
+if films_app.config["SLOW_QUERY_MS"] > 0:
+    slow_query_log = SlowQueryLog(films_app.config["SLOW_QUERY_MS"], films_app.config["SLOW_QUERY_SAMPLE_RATE"])
+    # primary and replicas
+    for _engine in db.engines.values():
+        slow_query_log.install(_engine)
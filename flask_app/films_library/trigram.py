@@ -0,0 +1,269 @@
+""" In-process trigram index over films titles for substring (template) search.
+
+ Notices:
+ - index is optional, enabled by $TRIGRAM_INDEX=1. Every worker process has its own copy,
+   built at worker start (see gunicorn.conf.py) or in background thread after the first search.
+   Till it's built templates are matched by database.
+ - index size is bounded by $TRIGRAM_INDEX_MAX_FILMS titles. Bigger catalogs disable the index
+   and search falls back to database ILIKE.
+ - templates shorter than 3 chars or with LIKE wildcards are not served by index.
+ - index remembers catalog generation it reflects. Own writes are applied incrementally. Changes made
+   by other workers move generation further than the next one, searches notice it at most once per
+   $TRIGRAM_INDEX_CHECK_SECONDS and index is rebuilt in background thread, old one serves searches meanwhile.
+ - index size and rebuilds are exported to /api/metrics by every worker.
+ """
+import logging
+import sys
+import threading
+import time
+from flask import current_app
+from sqlalchemy import select
+from . import db
+from .models import Films
+from .logger import Log
+from .cache import catalog_generation
+from .metrics import TRIGRAM_INDEX_FILMS, TRIGRAM_INDEX_TRIGRAMS, TRIGRAM_INDEX_MEMORY, TRIGRAM_INDEX_REBUILDS
+
+TRIGRAM_SIZE = 3
+# index of current process, made by films_index()
+_index = None
+# background rebuild of current process, one at a time
+_rebuild_thread = None
+_rebuild_lock = threading.Lock()
+
+
+def _trigrams(text: str):
+    """ Set of lower-cased trigrams of given text """
+    text = text.lower()
+    return {text[i:i + TRIGRAM_SIZE] for i in range(len(text) - TRIGRAM_SIZE + 1)}
+
+
+class TrigramIndex:
+    """ Inverted index trigram -> set of films ids with exact substring check over stored titles.
+
+    :param int max_films: maximum count of indexed titles. Index disables itself above it.
+    """
+
+    def __init__(self, max_films: int):
+        self.max_films = max_films
+        self.enabled = False
+        self.built = False
+        self.generation = None
+        # monotonic time of the last catalog generation check, see films_index()
+        self.checked_at = float("-inf")
+        self._titles = {}
+        self._postings = {}
+        self._lock = threading.RLock()
+
+    def build(self, films: list, generation: int = None):
+        """ (Re)build index from scratch. New data is collected aside and replaces the old one at once,
+        so searches are served by the old data till then.
+
+        :param list films: iterable of (film_id, title) pairs
+
+        :param int generation: catalog generation films were read at
+
+        :returns None
+        """
+        titles, postings = {}, {}
+        for film_id, title in films:
+            if len(titles) >= self.max_films:
+                break
+            title = title.lower()
+            titles[film_id] = title
+            for trigram in _trigrams(title):
+                postings.setdefault(trigram, set()).add(film_id)
+        else:
+            with self._lock:
+                self._titles, self._postings = titles, postings
+                self.generation = generation
+                self.enabled = self.built = True
+            # stats walk the whole index, so they are counted only if they are written
+            if Log.is_enabled(logging.INFO):
+                Log.info("Trigram index built: %s", self.stats())
+            return
+        Log.warning("Trigram index exceeded %s films and was disabled", self.max_films)
+        with self._lock:
+            self.disable()
+            self.generation = generation
+            self.built = True
+
+    def add(self, film_id: int, title: str):
+        """ Add film's title to index or refresh it if film is already indexed """
+        with self._lock:
+            if not self.enabled:
+                return
+            self.remove(film_id)
+            if len(self._titles) >= self.max_films:
+                Log.warning("Trigram index exceeded %s films and was disabled", self.max_films)
+                self.disable()
+                return
+            title = title.lower()
+            self._titles[film_id] = title
+            for trigram in _trigrams(title):
+                self._postings.setdefault(trigram, set()).add(film_id)
+
+    def remove(self, film_id: int):
+        """ Remove film from index if it's there """
+        with self._lock:
+            title = self._titles.pop(film_id, None)
+            if title is None:
+                return
+            for trigram in _trigrams(title):
+                postings = self._postings.get(trigram)
+                if postings is not None:
+                    postings.discard(film_id)
+                    if not postings:
+                        del self._postings[trigram]
+
+    def disable(self):
+        """ Drop indexed data and stop serving searches """
+        with self._lock:
+            self.enabled = False
+            self._titles = {}
+            self._postings = {}
+
+    def search(self, template: str):
+        """ Find ids of films which titles contain template, case insensitive.
+
+        :returns: set of films ids or None if index can't serve this template
+        """
+        if not self.enabled or len(template) < TRIGRAM_SIZE or "%" in template or "_" in template:
+            return None
+        template = template.lower()
+        with self._lock:
+            postings = sorted((self._postings.get(trigram, set()) for trigram in _trigrams(template)), key=len)
+            candidates = set(postings[0])
+            for ids in postings[1:]:
+                candidates &= ids
+                if not candidates:
+                    break
+            return {film_id for film_id in candidates if template in self._titles[film_id]}
+
+    def stats(self):
+        """ Index size info. Memory is approximate: containers plus stored titles and ids.
+
+        :returns: dict
+        """
+        with self._lock:
+            memory = sys.getsizeof(self._titles) + sys.getsizeof(self._postings)
+            memory += sum(sys.getsizeof(title) for title in self._titles.values())
+            memory += sum(sys.getsizeof(trigram) + sys.getsizeof(ids) for trigram, ids in self._postings.items())
+            return dict(enabled=self.enabled, films=len(self._titles), trigrams=len(self._postings),
+                        max_films=self.max_films, memory_bytes=memory)
+
+
+def _process_index():
+    """ Index of current process, made empty with the first call """
+    global _index
+    if _index is None:
+        _index = TrigramIndex(current_app.config["TRIGRAM_INDEX_MAX_FILMS"])
+    return _index
+
+
+def _export_stats(index: TrigramIndex, memory: bool = False):
+    """ Set index size gauges of /api/metrics. Memory walks the whole index, so it's counted after builds only. """
+    TRIGRAM_INDEX_FILMS.set(len(index._titles))
+    TRIGRAM_INDEX_TRIGRAMS.set(len(index._postings))
+    if memory:
+        TRIGRAM_INDEX_MEMORY.set(index.stats()["memory_bytes"])
+
+
+def _build(index: TrigramIndex):
+    """ Read films titles and build index from them. Needs app context. """
+    # generation is read first, so changes committed during reading only cause one more rebuild
+    generation = catalog_generation()
+    index.build(db.session.execute(select(Films.id, Films.title)), generation)
+    TRIGRAM_INDEX_REBUILDS.inc()
+    _export_stats(index, memory=True)
+
+
+def _build_in_background(index: TrigramIndex):
+    """ Start building index in background thread unless it's being built already """
+    global _rebuild_thread
+    app = current_app._get_current_object()
+
+    def build():
+        try:
+            with app.app_context():
+                _build(index)
+        except Exception as e:
+            Log.error("Trigram index build failed: %s", e)
+
+    with _rebuild_lock:
+        if _rebuild_thread is not None and _rebuild_thread.is_alive():
+            return
+        _rebuild_thread = threading.Thread(target=build, name="trigram-index-build", daemon=True)
+        _rebuild_thread.start()
+
+
+def build_index():
+    """ Build index of current process right now, like at worker start before it gets requests.
+
+    :returns: TrigramIndex or None if it's disabled by $TRIGRAM_INDEX
+    """
+    if not current_app.config["TRIGRAM_INDEX"]:
+        return None
+    index = _process_index()
+    index.checked_at = time.monotonic()
+    _build(index)
+    return index
+
+
+def films_index():
+    """ Trigram index of films titles for current process. Catalog generation is checked at most once
+    per $TRIGRAM_INDEX_CHECK_SECONDS, missing or stale index is built in background thread.
+
+    :returns: TrigramIndex or None if it's disabled by $TRIGRAM_INDEX or isn't built yet
+    """
+    if not current_app.config["TRIGRAM_INDEX"]:
+        return None
+    index = _process_index()
+    now = time.monotonic()
+    if now - index.checked_at >= current_app.config["TRIGRAM_INDEX_CHECK_SECONDS"]:
+        index.checked_at = now
+        if not index.built or (index.enabled and index.generation != catalog_generation()):
+            _build_in_background(index)
+    return index if index.built else None
+
+
+def _follows(generation: int):
+    """ Check if committed change with given generation is the next one after indexed generation """
+    return _index is not None and _index.built and _index.generation is not None \
+        and _index.generation + 1 == generation
+
+
+def index_film(film_id: int, title: str, generation: int):
+    """ Add committed film to index of current process if index is built and up to date.
+    Otherwise index will be rebuilt with the next search.
+
+    :param int generation: catalog generation of committed change
+    """
+    index_films([(film_id, title)], generation)
+
+
+def index_films(films: list, generation: int):
+    """ Add committed films to index of current process if index is built and up to date.
+    Otherwise index will be rebuilt with the next search.
+
+    :param list films: (film_id, title) pairs
+
+    :param int generation: catalog generation of committed change
+    """
+    if _follows(generation):
+        for film_id, title in films:
+            _index.add(film_id, title)
+        _index.generation = generation
+        _export_stats(_index)
+
+
+def unindex_film(film_id: int, generation: int):
+    """ Remove film from index of current process if index is built and up to date.
+    Otherwise index will be rebuilt with the next search.
+
+    :param int generation: catalog generation of committed change
+    """
+    if _follows(generation):
+        _index.remove(film_id)
+        _index.generation = generation
+        _export_stats(_index)
@@ -0,0 +1,24 @@
+""" Gunicorn settings and worker hooks. Gunicorn reads ./gunicorn.conf.py automatically. """
+import os
+import shutil
+
+
+def on_starting(server):
+    """ Start with empty prometheus multiprocess directory, values of previous run are stale """
+    metrics_dir = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if metrics_dir:
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+        os.makedirs(metrics_dir, exist_ok=True)
+
+
+def post_worker_init(worker):
+    """ Warm up per-process caches before worker gets requests """
+    from films_library import trigram
+    trigram.build_index()
+
+
+def child_exit(server, worker):
+    """ Drop live gauges of exited worker from prometheus multiprocess directory """
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
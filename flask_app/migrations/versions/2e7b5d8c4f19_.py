@@ -0,0 +1,30 @@
+"""films totals of facets scopes
+
+Revision ID: 2e7b5d8c4f19
+Revises: 9c4e2b6f1a57
+Create Date: 2026-10-17 23:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2e7b5d8c4f19'
+down_revision = '9c4e2b6f1a57'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # count of films of the whole catalog (scope 0) and of every genre, like films_library.facets.rebuild() makes
+    op.execute("""
+        INSERT INTO catalog_facets (scope, facet, value, films)
+        SELECT scopes.scope, 'total', 0, count(*)
+        FROM (SELECT id AS film_id, 0 AS scope FROM films
+              UNION ALL SELECT film_id, genres_id FROM filmsgenres) AS scopes
+        GROUP BY scopes.scope""")
+
+
+def downgrade():
+    op.execute("DELETE FROM catalog_facets WHERE facet = 'total'")
@@ -0,0 +1,26 @@
+"""films sorting indexes for keyset pagination
+
+Revision ID: 3f1c2a7d9e41
+Revises: b4cf3b11353f
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2a7d9e41'
+down_revision = 'b4cf3b11353f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_films_rate_id', 'films', ['rate', 'id'], unique=False)
+    op.create_index('ix_films_release_date_id', 'films', ['release_date', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_films_release_date_id', table_name='films')
+    op.drop_index('ix_films_rate_id', table_name='films')
@@ -0,0 +1,29 @@
+"""catalog generation counter
+
+Revision ID: 5b9f13c8e6a0
+Revises: c7d2e9f04a13
+Create Date: 2026-10-17 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b9f13c8e6a0'
+down_revision = 'c7d2e9f04a13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    catalog_state = op.create_table('catalog_state',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('generation', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.bulk_insert(catalog_state, [{'id': 1, 'generation': 0}])
+
+
+def downgrade():
+    op.drop_table('catalog_state')
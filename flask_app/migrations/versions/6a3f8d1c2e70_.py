@@ -0,0 +1,53 @@
+"""denormalized films search table
+
+Revision ID: 6a3f8d1c2e70
+Revises: 2e7b5d8c4f19
+Create Date: 2026-10-17 23:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '6a3f8d1c2e70'
+down_revision = '2e7b5d8c4f19'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        ids_type = postgresql.ARRAY(sa.Integer())
+        ids_list = "(SELECT coalesce(array_agg({column}), '{{}}'::integer[]) FROM {table} WHERE film_id = films.id)"
+    else:
+        ids_type = sa.JSON()
+        ids_list = "(SELECT json_group_array({column}) FROM {table} WHERE film_id = films.id)"
+    op.create_table('film_search',
+                    sa.Column('film_id', sa.Integer(), nullable=False),
+                    sa.Column('title_lower', sa.String(), nullable=False),
+                    sa.Column('rate', sa.Float(), nullable=True),
+                    sa.Column('release_date', sa.TIMESTAMP(), nullable=True),
+                    sa.Column('genre_ids', ids_type, nullable=False),
+                    sa.Column('director_ids', ids_type, nullable=False),
+                    sa.ForeignKeyConstraint(['film_id'], ['films.id'], ondelete='CASCADE'),
+                    sa.PrimaryKeyConstraint('film_id'))
+    op.create_index('ix_film_search_rate_id', 'film_search', ['rate', 'film_id'], unique=False)
+    op.create_index('ix_film_search_release_date_id', 'film_search', ['release_date', 'film_id'], unique=False)
+    if op.get_bind().dialect.name == 'postgresql':
+        op.create_index('ix_film_search_genre_ids', 'film_search', ['genre_ids'], unique=False,
+                        postgresql_using='gin')
+        op.create_index('ix_film_search_director_ids', 'film_search', ['director_ids'], unique=False,
+                        postgresql_using='gin')
+    # the same rows as films_library.film_search.rebuild() makes
+    op.execute(f"""
+        INSERT INTO film_search (film_id, title_lower, rate, release_date, genre_ids, director_ids)
+        SELECT id, lower(title), rate, release_date,
+               {ids_list.format(column="genres_id", table="filmsgenres")},
+               {ids_list.format(column="director_id", table="filmsdirectors")}
+        FROM films""")
+
+
+def downgrade():
+    op.drop_table('film_search')
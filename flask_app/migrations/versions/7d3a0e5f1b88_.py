@@ -0,0 +1,25 @@
+"""catalog dictionary generation counter
+
+Revision ID: 7d3a0e5f1b88
+Revises: e1a4b7c3d920
+Create Date: 2026-10-17 17:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d3a0e5f1b88'
+down_revision = 'e1a4b7c3d920'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('catalog_state', sa.Column('dictionary_generation', sa.BigInteger(), nullable=False,
+                                             server_default='0'))
+
+
+def downgrade():
+    op.drop_column('catalog_state', 'dictionary_generation')
@@ -0,0 +1,30 @@
+"""films relation tables indexes for semi-join search filters
+
+Revision ID: 8a6e0c54b2d7
+Revises: 3f1c2a7d9e41
+Create Date: 2026-10-17 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8a6e0c54b2d7'
+down_revision = '3f1c2a7d9e41'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_filmsdirectors_film_id', 'filmsdirectors', ['film_id'], unique=False)
+    op.create_index('ix_filmsdirectors_director_id', 'filmsdirectors', ['director_id'], unique=False)
+    op.create_index('ix_filmsgenres_film_id', 'filmsgenres', ['film_id'], unique=False)
+    op.create_index('ix_filmsgenres_genres_id', 'filmsgenres', ['genres_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_filmsgenres_genres_id', table_name='filmsgenres')
+    op.drop_index('ix_filmsgenres_film_id', table_name='filmsgenres')
+    op.drop_index('ix_filmsdirectors_director_id', table_name='filmsdirectors')
+    op.drop_index('ix_filmsdirectors_film_id', table_name='filmsdirectors')
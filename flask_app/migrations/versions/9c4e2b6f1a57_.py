@@ -0,0 +1,44 @@
+"""films counts by genres, directors and release years
+
+Revision ID: 9c4e2b6f1a57
+Revises: 7d3a0e5f1b88
+Create Date: 2026-10-17 22:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9c4e2b6f1a57'
+down_revision = '7d3a0e5f1b88'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('catalog_facets',
+                    sa.Column('scope', sa.Integer(), nullable=False),
+                    sa.Column('facet', sa.String(length=10), nullable=False),
+                    sa.Column('value', sa.Integer(), nullable=False),
+                    sa.Column('films', sa.Integer(), nullable=False),
+                    sa.PrimaryKeyConstraint('scope', 'facet', 'value'))
+    if op.get_bind().dialect.name == 'postgresql':
+        year = "CAST(EXTRACT(YEAR FROM release_date) AS INTEGER)"
+    else:
+        year = "CAST(STRFTIME('%Y', release_date) AS INTEGER)"
+    # the same counts as films_library.facets.rebuild() makes: whole catalog is scope 0, genre's films are genre's scope
+    op.execute(f"""
+        INSERT INTO catalog_facets (scope, facet, value, films)
+        SELECT scopes.scope, facet_values.facet, facet_values.value, count(*)
+        FROM (SELECT id AS film_id, 0 AS scope FROM films
+              UNION ALL SELECT film_id, genres_id FROM filmsgenres) AS scopes
+        JOIN (SELECT film_id, 'genres' AS facet, genres_id AS value FROM filmsgenres
+              UNION ALL SELECT film_id, 'directors', director_id FROM filmsdirectors
+              UNION ALL SELECT id, 'years', {year} FROM films WHERE release_date IS NOT NULL) AS facet_values
+        ON scopes.film_id = facet_values.film_id
+        GROUP BY scopes.scope, facet_values.facet, facet_values.value""")
+
+
+def downgrade():
+    op.drop_table('catalog_facets')
@@ -0,0 +1,38 @@
+"""films full-text search index
+
+Revision ID: c7d2e9f04a13
+Revises: 8a6e0c54b2d7
+Create Date: 2026-10-17 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7d2e9f04a13'
+down_revision = '8a6e0c54b2d7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        # text search configuration must be the same as films_library.search.PG_TS_CONFIG
+        op.execute("ALTER TABLE films ADD COLUMN search_vector tsvector GENERATED ALWAYS AS "
+                   "(to_tsvector('english', coalesce(title, '') || ' ' || coalesce(description, ''))) STORED")
+        op.execute("CREATE INDEX ix_films_search_vector ON films USING GIN (search_vector)")
+    elif dialect == 'sqlite':
+        op.execute("CREATE VIRTUAL TABLE films_fts USING fts5(title, description)")
+        op.execute("INSERT INTO films_fts(rowid, title, description) "
+                   "SELECT id, title, coalesce(description, '') FROM films")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute("DROP INDEX ix_films_search_vector")
+        op.execute("ALTER TABLE films DROP COLUMN search_vector")
+    elif dialect == 'sqlite':
+        op.execute("DROP TABLE films_fts")
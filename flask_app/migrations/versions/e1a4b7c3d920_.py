@@ -0,0 +1,27 @@
+"""films updated_at column for incremental exports
+
+Revision ID: e1a4b7c3d920
+Revises: 5b9f13c8e6a0
+Create Date: 2026-10-17 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e1a4b7c3d920'
+down_revision = '5b9f13c8e6a0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('films', sa.Column('updated_at', sa.TIMESTAMP(), nullable=True))
+    op.execute("UPDATE films SET updated_at = CURRENT_TIMESTAMP")
+    op.create_index(op.f('ix_films_updated_at'), 'films', ['updated_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_films_updated_at'), table_name='films')
+    op.drop_column('films', 'updated_at')
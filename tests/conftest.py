@@ -1,7 +1,19 @@
+import os
+import shutil
+import sys
+import tempfile
+from datetime import datetime
 import pytest
+from sqlalchemy import create_engine, event
+# films_library package is imported as top level one inside flask_app directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "flask_app"))
+os.environ.setdefault("SQLALCHEMY_DATABASE_URI", "sqlite:///" + os.path.join(tempfile.gettempdir(), "films_test.db"))
 # importing modules completely for making films_library see his api routes
-from flask_app.library_app import films_app
-from flask_app.models import User, Films, Directors
+from films_library import films_app, db
+from films_library.api import films_api, search_cache
+from films_library import database, search, metrics
+from films_library.cache import directors_ids, genres_ids
+from films_library.models import User, Films, Directors
 
 # Urls
 BASE_URL = "/api/"
@@ -17,6 +29,7 @@ FILM_DATA = {"title": "Film1", "description": "desc1", "directors": "director1,d
              "rate": 5, "date": "2010.02.01", "poster_url": "https:/img.png", "genres": "Action,Noir"}
 DIRECTOR_NAME = "Sten Lee"
 DIRECTOR_NAME_UNEXISTS = "sfsdf dskf ksdh fskfsdk fsk fasklds"
+CATALOG_SIZE = 25
 
 
 @pytest.fixture
@@ -32,6 +45,55 @@ def login_user(client):
     return user
 
 
+@pytest.fixture
+def catalog():
+    """ fixture with fresh sqlite database filled by CATALOG_SIZE films of USER1 """
+    if not films_app.config["SQLALCHEMY_DATABASE_URI"].startswith("sqlite"):
+        pytest.skip("Needs throwaway sqlite database, got another one")
+    db.session.remove()
+    db.drop_all()
+    db.create_all()
+    search.rebuild_index()
+    search_cache.clear()
+    directors_ids.clear()
+    genres_ids.clear()
+    database.add_director("unknown")
+    database.add_user(nickname="User 1", is_admin=True, **USER1_DATA)
+    for i in range(CATALOG_SIZE):
+        database.add_film(title=f"Film {i:02}", release_date=datetime(2000 + i % 7, 1, 1), user=1,
+                          directors=[f"director{i % 3}"], genres=["Action", "Noir", "Drama"][i % 3],
+                          description=f"desc{i}", rate=i % 5, poster_url="https:/img.png")
+    yield
+    db.session.remove()
+
+
+@pytest.fixture
+def replica(catalog):
+    """ fixture registering copy of catalog sqlite file as replica, it isn't changed by writes """
+    path = os.path.join(tempfile.gettempdir(), "films_replica_test.db")
+    db.session.remove()
+    shutil.copyfile(db.engine.url.database, path)
+    engine = create_engine("sqlite:///" + path)
+    # like replicas of $REPLICA_DATABASE_URIS
+    metrics.watch_engine(engine, "replica0")
+    db.engines["replica0"] = engine
+    yield engine
+    db.session.remove()
+    db.engines.pop("replica0").dispose()
+
+
+@pytest.fixture
+def statements():
+    """ fixture collecting every SQL statement sent to database while test runs """
+    executed = []
+
+    def collect(conn, cursor, statement, parameters, context, executemany):
+        executed.append(statement)
+    event.listen(db.engine, "before_cursor_execute", collect)
+    yield executed
+    event.remove(db.engine, "before_cursor_execute", collect)
+
+
 def test_index(client):
     """ Test if films_library can get main page """
     response = client.get(BASE_URL)
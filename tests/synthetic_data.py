@@ -0,0 +1,286 @@
+""" High-volume synthetic films catalog generator.
+
+Run from repository root:
+    python -m tests.synthetic_data --films 1000000 [--users 10000] [--directors 50000] [--reset]
+
+ Notices:
+ - needs numpy (see tests/requirements.txt), every batch of films is sampled by vectorized calls:
+   director popularity is Zipfian, film owners too; genres come in correlated groups
+   (Action goes with Adventure much more often than with Romance); rates are skewed to 6-8
+   and release years to recent decades.
+ - database is taken from $SQLALCHEMY_DATABASE_URI or --database-uri. With --reset schema is
+   recreated (ALL DATA IS LOST) and secondary indexes are built after loading, otherwise rows are
+   appended after current max ids.
+ - rows are written by executemany batches, on PostgreSQL with psycopg2 by COPY. Every batch is
+   one transaction.
+ - synthetic users share password SYNTHETIC_PASSWORD, emails are like synthetic1@mail.ua.
+ """
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import time
+from datetime import datetime
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# films_library package is imported as top level one inside flask_app directory
+sys.path.insert(0, os.path.join(ROOT, "flask_app"))
+
+SYNTHETIC_PASSWORD = "synthetic"
+# genre name -> (popularity, group); genres of one group are often met together
+GENRES = {"Drama": (30, 0), "Romance": (10, 0), "Biography": (3, 0), "History": (3, 0), "War": (2, 0),
+          "Comedy": (22, 1), "Family": (6, 1), "Animation": (4, 1), "Musical": (2, 1),
+          "Action": (16, 2), "Adventure": (10, 2), "Sci-Fi": (7, 2), "Fantasy": (6, 2), "Western": (1, 2),
+          "Thriller": (12, 3), "Crime": (10, 3), "Horror": (8, 3), "Mystery": (6, 3), "Noir": (1, 3),
+          "Documentary": (5, 4)}
+# how much more often genre of the same group is chosen as film's additional genre
+GROUP_AFFINITY = 8.0
+# probabilities of 1, 2 and 3 genres/directors per film
+GENRES_PER_FILM = (0.45, 0.4, 0.15)
+DIRECTORS_PER_FILM = (0.85, 0.12, 0.03)
+DIRECTORS_EXPONENT = 1.1
+OWNERS_EXPONENT = 1.2
+# DBAPI paramstyle -> positional placeholder
+PLACEHOLDERS = {"qmark": "?", "format": "%s", "pyformat": "%s"}
+LAST_YEAR = 2022
+FIRST_YEAR = 1920
+
+FIRST_NAMES = np.array(["James", "Mary", "John", "Anna", "Robert", "Olga", "Michael", "Sofia", "David", "Emma",
+                        "Taras", "Iryna", "Akira", "Mei", "Pedro", "Lucia", "Ingmar", "Agnes", "Federico", "Chloe"])
+LAST_NAMES = np.array(["Smith", "Kovalenko", "Nolan", "Garcia", "Bergman", "Kurosawa", "Varda", "Fellini", "Lee",
+                       "Shevchenko", "Tanaka", "Dubois", "Rossi", "Novak", "Brown", "Schmidt", "Silva", "Kim"])
+TITLE_WORDS = np.array(["Dark", "Last", "Silent", "Red", "Lost", "Golden", "Broken", "Hidden", "Wild", "Cold",
+                        "Night", "River", "City", "Dream", "Storm", "Shadow", "Garden", "Road", "Star", "Memory"])
+
+
+def zipf_weights(count: int, exponent: float):
+    """ Probabilities of ranks 1..count falling as rank ** -exponent """
+    weights = 1.0 / np.arange(1, count + 1) ** exponent
+    return weights / weights.sum()
+
+
+def genres_affinity(popularity: np.ndarray, groups: np.ndarray):
+    """ Probabilities of additional genre given the main one, rows are main genres.
+    Genre never follows itself.
+
+    :returns: numpy matrix genres x genres with rows summing to 1
+    """
+    affinity = popularity[None, :] * np.where(groups[:, None] == groups[None, :], GROUP_AFFINITY, 1.0)
+    np.fill_diagonal(affinity, 0)
+    return affinity / affinity.sum(axis=1, keepdims=True)
+
+
+def sample_links(rng, films_ids: np.ndarray, per_film: tuple, pick):
+    """ Sample 1-3 linked ids for every film.
+
+    :param per_film: probabilities of 1, 2 and 3 links
+    :param pick: callable(slot, films positions) returning linked ids for given films,
+                 slot 0 is the main link
+    :returns: numpy array of unique (film_id, linked_id) pairs
+    """
+    counts = rng.choice(len(per_film), size=len(films_ids), p=per_film) + 1
+    pairs = []
+    for slot in range(len(per_film)):
+        positions = np.flatnonzero(counts > slot)
+        pairs.append(np.column_stack((films_ids[positions], pick(slot, positions))))
+    return np.unique(np.concatenate(pairs), axis=0)
+
+
+class CatalogSampler:
+    """ Vectorized sampling of films batches.
+
+    :param int users: count of films owners, their ids are first_user_id..first_user_id + users - 1
+    :param int directors: count of directors, ids are first_director_id..
+    :param dict genres_ids: genre name -> id for GENRES names
+    """
+
+    def __init__(self, rng, users: int, directors: int, first_user_id: int, first_director_id: int,
+                 genres_ids: dict):
+        self.rng = rng
+        self.users_ids = first_user_id + rng.permutation(users)
+        self.users_weights = zipf_weights(users, OWNERS_EXPONENT)
+        # popular directors are spread over ids instead of being the first ones
+        self.directors_ids = first_director_id + rng.permutation(directors)
+        self.directors_weights = zipf_weights(directors, DIRECTORS_EXPONENT)
+        self.genres_ids = np.array([genres_ids[name] for name in GENRES])
+        popularity = np.array([weight for weight, _ in GENRES.values()], dtype=float)
+        self.genres_weights = popularity / popularity.sum()
+        self.genres_cumulative = genres_affinity(popularity, np.array([group for _, group in GENRES.values()])
+                                                 ).cumsum(axis=1)
+
+    def films(self, first_id: int, count: int):
+        """ Sample count films with ids from first_id.
+
+        :returns: tuple (films rows, directors links, genres links, users links) of lists of tuples
+        """
+        rng = self.rng
+        ids = np.arange(first_id, first_id + count)
+        owners = self.users_ids[rng.choice(len(self.users_ids), size=count, p=self.users_weights)]
+        rates = np.round(rng.beta(6, 2.5, size=count) * 10, 1)
+        years = np.clip(LAST_YEAR - np.floor(rng.gamma(2.0, 9.0, size=count)), FIRST_YEAR, LAST_YEAR).astype(int)
+        dates = ((years - 1970).astype("datetime64[Y]").astype("datetime64[D]")
+                 + rng.integers(0, 365, size=count)).astype("datetime64[s]").tolist()
+        words = TITLE_WORDS[rng.integers(0, len(TITLE_WORDS), size=(count, 2))].tolist()
+        main_genres = rng.choice(len(self.genres_ids), size=count, p=self.genres_weights)
+        genre_names = np.array(list(GENRES))[main_genres].tolist()
+        updated_at = datetime.utcnow()
+        films = [(film_id, f"{first} {second} {film_id}", f"{genre} story about {second.lower()}", rate, date,
+                  "https://", owner, updated_at)
+                 for film_id, (first, second), genre, rate, date, owner in
+                 zip(ids.tolist(), words, genre_names, rates.tolist(), dates, owners.tolist())]
+
+        def pick_genres(slot, positions):
+            if slot == 0:
+                return self.genres_ids[main_genres[positions]]
+            chance = rng.random(len(positions))
+            chosen = (chance[:, None] > self.genres_cumulative[main_genres[positions]]).sum(axis=1)
+            # cumulative sums can end a bit lower than 1
+            return self.genres_ids[np.minimum(chosen, len(self.genres_ids) - 1)]
+
+        def pick_directors(slot, positions):
+            return self.directors_ids[rng.choice(len(self.directors_ids), size=len(positions),
+                                                 p=self.directors_weights)]
+
+        genres = sample_links(rng, ids, GENRES_PER_FILM, pick_genres)
+        directors = sample_links(rng, ids, DIRECTORS_PER_FILM, pick_directors)
+        return (films, list(map(tuple, directors.tolist())), list(map(tuple, genres.tolist())),
+                list(zip(ids.tolist(), owners.tolist())))
+
+
+def copy_rows(table, columns: tuple, rows: list):
+    """ Bulk insert of tuples in current transaction: COPY on PostgreSQL with psycopg2, executemany otherwise """
+    from films_library import db
+    if not rows:
+        return
+    connection = db.session.connection()
+    cursor = connection.connection.dbapi_connection.cursor()
+    if hasattr(cursor, "copy_expert"):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+        cursor.copy_expert(f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+        cursor.close()
+        return
+    # raw executemany skips sqlalchemy's per row parameters handling, values are converted by
+    # columns bind processors, so they are stored the same way as ORM stores them
+    dialect = connection.dialect
+    processors = [(position, processor) for position, processor in
+                  enumerate(table.c[column].type.dialect_impl(dialect).bind_processor(dialect)
+                            for column in columns) if processor]
+    if processors:
+        rows = [list(row) for row in rows]
+        for row in rows:
+            for position, processor in processors:
+                row[position] = processor(row[position])
+    placeholder = PLACEHOLDERS[dialect.paramstyle]
+    cursor.executemany(f"INSERT INTO {table.name} ({', '.join(columns)}) "
+                       f"VALUES ({', '.join([placeholder] * len(columns))})", rows)
+    cursor.close()
+
+
+def _max_id(model):
+    from sqlalchemy import func, select
+    from films_library import db
+    return db.session.execute(select(func.coalesce(func.max(model.id), 0))).scalar()
+
+
+def generate_catalog(films: int, users: int = 1000, directors: int = 10000, seed: int = 2022,
+                     batch_size: int = 50000, reset: bool = False):
+    """ Generate and bulk load synthetic catalog.
+
+    :param bool reset: recreate schema before loading, all data is lost
+
+    :returns: dict loading report
+    """
+    from sqlalchemy import text
+    from werkzeug.security import generate_password_hash
+    from films_library import db, facets, film_search, search
+    from films_library.cache import bump_catalog_generation, bump_dictionary_generation, genres_ids
+    from films_library.models import Films, Directors, User, films_directors, films_genres, users_films
+    started = time.perf_counter()
+    delayed_indexes = []
+    if reset:
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+        # create_all() doesn't know PostgreSQL search_vector column of migration
+        search.create_index()
+        # building indexes once after loading is much faster than updating them on every batch
+        for table in (Films.__table__, films_directors, films_genres):
+            for index in table.indexes:
+                index.drop(db.engine)
+                delayed_indexes.append(index)
+    rng = np.random.default_rng(seed)
+    first_user, first_director, first_film = _max_id(User) + 1, _max_id(Directors) + 1, _max_id(Films) + 1
+
+    password = generate_password_hash(SYNTHETIC_PASSWORD)
+    copy_rows(User.__table__, ("id", "nickname", "email", "password", "is_admin"),
+              [(i, f"synthetic{i}", f"synthetic{i}@mail.ua", password, False)
+               for i in range(first_user, first_user + users)])
+    names = np.char.add(np.char.add(FIRST_NAMES[rng.integers(0, len(FIRST_NAMES), size=directors)], " "),
+                        LAST_NAMES[rng.integers(0, len(LAST_NAMES), size=directors)]).tolist()
+    directors_ids = range(first_director, first_director + directors)
+    # id keeps synthetic names unique
+    copy_rows(Directors.__table__, ("id", "full_name"),
+              [(i, f"{name} {i}") for i, name in zip(directors_ids, names)])
+    sampler = CatalogSampler(rng, users, directors, first_user, first_director, genres_ids.upsert(list(GENRES))[0])
+    db.session.commit()
+
+    links_count = 0
+    for first in range(first_film, first_film + films, batch_size):
+        count = min(batch_size, first_film + films - first)
+        films_rows, directors_links, genres_links, users_links = sampler.films(first, count)
+        copy_rows(Films.__table__, ("id", "title", "description", "rate", "release_date", "poster_url", "user_id",
+                                    "updated_at"), films_rows)
+        copy_rows(films_directors, ("film_id", "director_id"), directors_links)
+        copy_rows(films_genres, ("film_id", "genres_id"), genres_links)
+        copy_rows(users_films, ("film_id", "user_id"), users_links)
+        db.session.commit()
+        links_count += len(directors_links) + len(genres_links) + len(users_links)
+
+    for index in delayed_indexes:
+        index.create(db.engine)
+    if db.session.get_bind().dialect.name == "postgresql":
+        # rows were inserted with explicit ids, sequences must continue after them
+        for table in (Films.__table__, Directors.__table__, User.__table__):
+            db.session.execute(text(f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+                                    f"(SELECT max(id) FROM {table.name}))"))
+    bump_catalog_generation()
+    if reset:
+        # names caches of running workers know ids of the dropped rows
+        bump_dictionary_generation()
+    db.session.commit()
+    search.rebuild_index()
+    facets.rebuild()
+    film_search.rebuild()
+    # planner statistics of freshly loaded tables, without them sqlite picks wrong indexes for genres filters
+    db.session.execute(text("ANALYZE"))
+    db.session.commit()
+    seconds = time.perf_counter() - started
+    return dict(films=films, users=users, directors=directors, links=links_count, seconds=round(seconds, 3),
+                films_per_second=round(films / seconds, 1) if seconds else 0.0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--films", type=int, default=1000000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--directors", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=2022, help="same seed makes the same catalog")
+    parser.add_argument("--batch-size", type=int, default=50000, help="films written in one transaction")
+    parser.add_argument("--database-uri", default=None, help="database instead of $SQLALCHEMY_DATABASE_URI")
+    parser.add_argument("--reset", action="store_true", help="recreate schema, ALL DATA IS LOST")
+    args = parser.parse_args()
+    if args.database_uri is not None:
+        os.environ["SQLALCHEMY_DATABASE_URI"] = args.database_uri
+    os.environ.setdefault("LOG_MODE", "ERROR")
+    report = generate_catalog(args.films, users=args.users, directors=args.directors, seed=args.seed,
+                              batch_size=args.batch_size, reset=args.reset)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+from datetime import datetime
+import pytest
+from sqlalchemy import event, select
+from films_library import db, database
+from films_library.errors import NotFoundError
+from films_library.models import Films, users_films
+from .conftest import CATALOG_SIZE
+
+# film insert, owner link, names caches sync, directors links, genres links, facets counts, film_search row,
+# full-text index, catalog generation
+KNOWN_NAMES_STATEMENTS = 9
+
+
+def add_film(title="Single transaction", user=1):
+    return database.add_film(title=title, release_date=datetime(2020, 1, 1), user=user, directors=["director0"],
+                             genres="Action,Noir", description="desc", rate=3)
+
+
+@pytest.fixture
+def commits():
+    """ fixture counting database commits while test runs """
+    committed = []
+
+    def count(conn):
+        committed.append(conn)
+    event.listen(db.engine, "commit", count)
+    yield committed
+    event.remove(db.engine, "commit", count)
+
+
+def test_one_transaction(catalog, statements, commits):
+    """ Film with known directors and genres is written by one transaction of few statements """
+    film = add_film()
+    assert len(commits) == 1
+    assert len(statements) <= KNOWN_NAMES_STATEMENTS
+    film_id = film.id
+    film = db.session.get(Films, film_id)
+    assert [director.full_name for director in film.directors] == ["director0"]
+    assert sorted(genre.name for genre in film.genres) == ["Action", "Noir"]
+    assert db.session.execute(select(users_films.c.user_id).where(users_films.c.film_id == film_id)).scalar() == 1
+
+
+def test_duplicate_rolled_back(catalog, commits):
+    """ Film with the same title and release date isn't written at all """
+    add_film()
+    with pytest.raises(ValueError):
+        add_film()
+    assert len(commits) == 1
+    assert Films.query.count() == CATALOG_SIZE + 1
+
+
+def test_unknown_user(catalog):
+    """ Film of not existing user isn't written """
+    with pytest.raises(NotFoundError):
+        add_film(user=100)
+    assert Films.query.count() == CATALOG_SIZE
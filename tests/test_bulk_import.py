@@ -0,0 +1,49 @@
+import io
+import json
+import os
+from films_library import bulk_import, database
+from films_library.models import Films, Directors
+from .conftest import CATALOG_SIZE
+
+FILMS_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), "films.csv")
+
+
+def test_import_csv(catalog):
+    """ tests/films.csv is imported with parallel parsing, second import finds only duplicates """
+    database.add_user(nickname="User 2", email="user2@mail.ua", password="pass2")
+    with open(FILMS_CSV, encoding="utf-8", newline="") as file:
+        report = bulk_import.import_films(file, "csv", batch_size=4, workers=2)
+    assert report["imported"] == 11
+    assert report["invalid"] == 0
+    assert Films.query.count() == CATALOG_SIZE + 11
+    assert Directors.query.filter_by(full_name="Christopher Nolan").count() == 1
+    dark_knight = Films.query.filter_by(title="The Dark Knight").first()
+    assert sorted(genre.name for genre in dark_knight.genres) == ["Action", "Drama"]
+    with open(FILMS_CSV, encoding="utf-8", newline="") as file:
+        assert bulk_import.import_films(file, "csv")["duplicates"] == 11
+
+
+def test_import_ndjson_api(client, catalog, login_user):
+    """ Admin api streams ndjson, bad rows are reported """
+    lines = [json.dumps({"title": "Imported", "description": "d", "directors": ["director0", "new director"],
+                         "rate": 5, "date": "2011.01.01", "user_id": 1, "genres": "Action"}),
+             json.dumps({"title": "Broken", "date": "yesterday", "user_id": 1}),
+             "not json"]
+    response = client.post("/api/films/import/?format=ndjson&workers=1", data=io.BytesIO("\n".join(lines).encode()),
+                           content_type="application/x-ndjson")
+    assert response.status_code == 201
+    assert response.json["imported"] == 1
+    assert response.json["invalid"] == 2
+    assert len(database.find_films_by_filters(directors="new director", page_number=1, pagination_size=10)) == 1
+
+
+def test_import_wrong_types(catalog):
+    """ Records with wrongly typed fields are rejected, not imported or crashed on """
+    lines = [json.dumps({"title": 5, "date": "2011.01.01", "user_id": 1}),
+             json.dumps({"title": "Numbers", "directors": 5, "date": "2011.01.01", "user_id": 1}),
+             json.dumps({"title": "Nested", "genres": ["Action", ["Drama"]], "date": "2011.01.01", "user_id": 1}),
+             json.dumps({"title": "Typed", "directors": ["director0"], "date": "2011.01.01", "user_id": 1})]
+    report = bulk_import.import_films(io.StringIO("\n".join(lines)), "ndjson", workers=1)
+    assert report["imported"] == 1
+    assert report["invalid"] == 3
+    assert Films.query.count() == CATALOG_SIZE + 1
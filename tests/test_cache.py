@@ -0,0 +1,76 @@
+import time
+from datetime import datetime
+from films_library import database
+from films_library.cache import LRUCache, catalog_generation, search_key
+from .conftest import FILMS_URL, LOGIN_URL, PROFILE_URL, USER1_DATA
+
+
+def test_lru_cache_eviction():
+    """ The least recently used and expired values are dropped """
+    cache = LRUCache(max_size=2, ttl=0.05)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+    time.sleep(0.06)
+    assert cache.get("a") is None
+    assert cache.stats()["hits"] == 2
+    assert cache.stats()["misses"] == 2
+
+
+def test_search_key_normalization():
+    """ Same search written differently has the same key """
+    assert search_key(genres="Noir, Action", template="x", cursor=None) == search_key(genres="Action,Noir,Action",
+                                                                                      template="x")
+    assert search_key(cursor="") != search_key(cursor=None)
+    # only names are normalized, search matches other values as they are
+    assert search_key(template="x ") != search_key(template="x")
+    assert search_key(date_from=" 2020") != search_key(date_from="2020")
+
+
+def test_cached_search_invalidated_by_writes(client, catalog, statements):
+    """ Repeated search is served from cache until catalog changes """
+    params = {"template": "Film", "pagination_size": 100}
+    first = client.get(FILMS_URL, query_string=params)
+    statements.clear()
+    assert client.get(FILMS_URL, query_string=params).json == first.json
+    # only catalog generation is read
+    assert len(statements) == 1
+    generation = catalog_generation()
+    database.add_film(title="Film new", release_date=datetime(2020, 1, 1), user=1, directors="director0",
+                      genres="Action", description="desc", rate=1, poster_url="https:/img.png")
+    assert catalog_generation() == generation + 1
+    assert len(client.get(FILMS_URL, query_string=params).json) == len(first.json) + 1
+
+
+def test_search_not_modified(client, catalog, statements):
+    """ Poller's ETag gets 304 without reading films until catalog changes """
+    params = {"genres": "Noir", "pagination_size": 5}
+    etag = client.get(FILMS_URL, query_string=params).headers["ETag"]
+    assert client.get(FILMS_URL, query_string={"pagination_size": "5", "genres": " Noir"}).headers["ETag"] == etag
+    statements.clear()
+    response = client.get(FILMS_URL, query_string=params, headers={"If-None-Match": etag})
+    assert response.status_code == 304 and response.data == b"" and response.headers["ETag"] == etag
+    assert len(statements) == 1 and "films" not in statements[0]
+    assert client.get(FILMS_URL, query_string=dict(params, page_number=2),
+                      headers={"If-None-Match": etag}).status_code == 200
+    database.delete_film(1)
+    response = client.get(FILMS_URL, query_string=params, headers={"If-None-Match": etag})
+    assert response.status_code == 200 and response.headers["ETag"] != etag
+
+
+def test_profile_not_modified(client, catalog):
+    """ Profile is revalidated by ETag, it changes with user's films and admin mode """
+    client.post(LOGIN_URL, data=USER1_DATA)
+    etag = client.get(PROFILE_URL).headers["ETag"]
+    assert client.get(PROFILE_URL, headers={"If-None-Match": etag}).status_code == 304
+    database.set_admin(1, False)
+    response = client.get(PROFILE_URL, headers={"If-None-Match": etag})
+    assert response.status_code == 200 and not response.json["users"]["is_admin"]
+    etag = response.headers["ETag"]
+    database.delete_film(1)
+    assert client.get(PROFILE_URL, headers={"If-None-Match": etag}).status_code == 200
+    # users cache outlives catalog fixture
+    database.set_admin(1, True)
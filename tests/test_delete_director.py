@@ -0,0 +1,59 @@
+from datetime import datetime
+import pytest
+from sqlalchemy import select
+from films_library import db, database
+from films_library.cache import directors_ids
+from films_library.errors import NotFoundError
+from films_library.models import Films, Directors, films_directors
+
+
+def add_film(title, directors):
+    return database.add_film(title=title, release_date=datetime(2020, 1, 1), user=1, directors=directors,
+                             genres="Drama").id
+
+
+def directors_of(film_id):
+    return sorted(db.session.execute(select(Directors.full_name).join(films_directors)
+                                     .where(films_directors.c.film_id == film_id)).scalars())
+
+
+def test_orphaned_films_reassigned(catalog):
+    """ Film loses only deleted director, film without other directors gets "unknown" one """
+    alone = add_film("Alone", ["Solo"])
+    shared = add_film("Shared", ["Solo", "Partner"])
+    database.delete_director("Solo")
+    assert directors_of(alone) == ["unknown"]
+    assert directors_of(shared) == ["Partner"]
+    assert Directors.query.filter_by(full_name="Solo").first() is None
+
+
+def test_batch_delete(catalog):
+    """ Film of several deleted directors gets one "unknown" link """
+    both = add_film("Both", ["First", "Second"])
+    third = add_film("Third", ["First", "Third"])
+    database.delete_director(["First", "Second"])
+    assert directors_of(both) == ["unknown"]
+    assert directors_of(third) == ["Third"]
+    assert database.find_films_by_filters(directors="unknown", page_number=1, pagination_size=50)[-1].id == both
+
+
+def test_not_found(catalog):
+    """ Nothing is deleted if some of directors isn't found """
+    with pytest.raises(NotFoundError):
+        database.delete_director(["director0", "Nobody"])
+    assert Directors.query.filter_by(full_name="director0").first() is not None
+
+
+def test_constant_statements(catalog, statements):
+    """ Count of statements doesn't depend on count of director's films """
+    add_film("One", ["Rare"])
+    for i in range(20):
+        add_film(f"Many {i}", ["Prolific"] if i % 2 else ["Prolific", "Other"])
+    counts = []
+    for name in ("Rare", "Prolific"):
+        directors_ids.clear()
+        statements.clear()
+        database.delete_director(name)
+        counts.append(len(statements))
+    assert counts[0] == counts[1]
+    assert Films.query.filter(Films.title.startswith("Many")).count() == 20
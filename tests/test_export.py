@@ -0,0 +1,29 @@
+import gzip
+import json
+from .conftest import BASE_URL, CATALOG_SIZE
+
+EXPORT_URL = BASE_URL + "films/export/"
+
+
+def test_export_ndjson(client, catalog):
+    """ Every film is exported once with genres and directors """
+    response = client.get(EXPORT_URL)
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    films = [json.loads(line) for line in response.data.decode().splitlines()]
+    assert len(films) == CATALOG_SIZE
+    assert films[0]["genres"] == ["Action"] and films[0]["directors"] == ["director0"]
+
+
+def test_export_gzip(client, catalog):
+    """ Gzip is used if client accepts it """
+    plain = client.get(EXPORT_URL).data
+    response = client.get(EXPORT_URL, headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(response.data) == plain
+
+
+def test_export_updated_since(client, catalog):
+    """ Films not changed since given date aren't exported """
+    assert client.get(EXPORT_URL, query_string={"updated_since": "2999.01.01"}).data == b""
+    assert client.get(EXPORT_URL, query_string={"updated_since": "yesterday"}).status_code == 400
@@ -0,0 +1,65 @@
+from datetime import datetime
+import io
+from films_library import bulk_import, database, facets
+from .conftest import FILMS_URL, LOGIN_URL, USER1_DATA
+
+OLD_DATE = "1900.01.01"
+
+
+def live_counts(genre: str = None):
+    """ Counts recounted from films and links, date filter skips stored counts """
+    return database.count_facets(date_from=OLD_DATE, genres=genre)
+
+
+def test_catalog_counts(client, catalog):
+    """ Unfiltered search facets come from stored counts and match catalog fixture """
+    response = client.get(FILMS_URL, query_string={"facets": "true", "pagination_size": 5})
+    assert response.status_code == 200
+    assert len(response.json["films"]) == 5
+    counts = response.json["facets"]
+    assert counts["genres"] == [{"value": "Action", "films": 9}, {"value": "Drama", "films": 8},
+                                {"value": "Noir", "films": 8}]
+    assert counts["directors"][0] == {"value": "director0", "films": 9}
+    assert counts["years"][0] == {"value": 2000, "films": 4}
+    assert counts == live_counts()
+    assert database.count_facets(genres="Noir") == live_counts("Noir")
+    assert database.count_facets(genres="Noir")["genres"] == [{"value": "Noir", "films": 8}]
+
+
+def test_filtered_counts_is_one_query(catalog, statements):
+    """ Filtered search facets are counted by one statement """
+    counts = database.count_facets(template="Film", directors="director0,director1", date_to="2003.01.01")
+    assert len(statements) == 1
+    assert {item["value"] for item in counts["directors"]} == {"director0", "director1"}
+    assert sum(item["films"] for item in counts["years"]) == sum(item["films"] for item in counts["directors"])
+
+
+def test_counts_follow_changes(client, catalog):
+    """ Stored counts stay equal to recounted ones after every kind of films change """
+    film = database.add_film(title="Changing", release_date=datetime(1990, 5, 1), user=1,
+                             directors=["director0", "New one"], genres="Action,Western", rate=5)
+    assert database.count_facets() == live_counts()
+    assert database.count_facets(genres="Western") == live_counts("Western")
+
+    client.post(LOGIN_URL, data=USER1_DATA)
+    response = client.put(FILMS_URL, data={"id": film.id, "title": "Changed", "date": "1991.01.01",
+                                           "directors": "director1", "genres": "Noir"})
+    assert response.status_code == 200
+    assert database.count_facets() == live_counts()
+    assert database.count_facets(genres="Western")["years"] == []
+    assert database.count_facets(genres="Noir") == live_counts("Noir")
+
+    database.delete_director("director1")
+    assert database.count_facets() == live_counts()
+    assert database.count_facets(genres="Noir") == live_counts("Noir")
+
+    database.delete_film(film.id)
+    assert database.count_facets() == live_counts()
+
+    bulk_import.import_films(io.StringIO('Imported,d,"director2,Other",5,1985.01.01,https://,1,"Drama,War"\n'), "csv")
+    assert database.count_facets() == live_counts()
+    assert database.count_facets(genres="War") == live_counts("War")
+    counts = database.count_facets()
+    facets.rebuild()
+    assert database.count_facets() == counts
+
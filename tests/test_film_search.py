@@ -0,0 +1,60 @@
+from datetime import datetime
+import io
+from films_library import bulk_import, database, db, film_search
+from films_library.models import FilmSearch
+from .conftest import FILMS_URL, LOGIN_URL, USER1_DATA
+
+
+def search_rows():
+    """ film_search rows as comparable tuples with sorted ids lists """
+    return {row.film_id: (row.title_lower, row.rate, row.release_date, sorted(row.genre_ids),
+                          sorted(row.director_ids))
+            for row in db.session.execute(db.select(FilmSearch)).scalars()}
+
+
+def rebuilt_rows():
+    """ film_search rows made from scratch by films and links tables """
+    film_search.rebuild()
+    db.session.expire_all()
+    return search_rows()
+
+
+def test_rows_follow_changes(client, catalog):
+    """ film_search rows stay equal to rebuilt ones after every kind of films change """
+    film = database.add_film(title="Changing", release_date=datetime(1990, 5, 1), user=1,
+                             directors=["director0", "New one"], genres="Action,Western", rate=5)
+    rows = search_rows()
+    assert rows[film.id][0] == "changing"
+    assert len(rows[film.id][3]) == 2 and len(rows[film.id][4]) == 2
+
+    client.post(LOGIN_URL, data=USER1_DATA)
+    response = client.put(FILMS_URL, data={"id": film.id, "title": "Changed", "date": "1991.01.01",
+                                           "directors": "director1", "genres": "Noir"})
+    assert response.status_code == 200
+    assert search_rows()[film.id][:3] == ("changed", 5, datetime(1991, 1, 1))
+    assert search_rows() == rebuilt_rows()
+
+    database.delete_director("director1")
+    assert search_rows() == rebuilt_rows()
+
+    database.delete_film(film.id)
+    assert film.id not in search_rows()
+
+    bulk_import.import_films(io.StringIO('Imported,d,"director2,Other",5,1985.01.01,https://,1,"Drama,War"\n'), "csv")
+    rows = search_rows()
+    assert "imported" in {row[0] for row in rows.values()}
+    assert rows == rebuilt_rows()
+
+
+def test_search_reads_film_search(catalog, statements):
+    """ Filters are served by film_search, page and its relations still take three statements """
+    films = database.find_films_by_filters(template="FILM 0", genres="Action,Noir", directors="director0",
+                                           match_mode="any", sort_by="rate", sort_type="desc",
+                                           page_number=1, pagination_size=5)
+    assert len(statements) == 3
+    assert "film_search" in statements[0]
+    assert {film.title for film in films} == {"Film 00", "Film 03", "Film 06", "Film 09"}
+    assert [film.rate for film in films] == sorted((film.rate for film in films), reverse=True)
+    assert database.count_films(genres="Action,Noir", directors="director0,director1",
+                                match_mode="all") == (0, True)
+    assert database.count_films(genres="Noir", directors="director1", match_mode="all") == (8, True)
@@ -0,0 +1,70 @@
+import os
+import subprocess
+import sys
+import time
+from films_library.logger import Logger
+
+
+class Expensive:
+    """ Value counting its formatting """
+    formatted = 0
+
+    def __str__(self):
+        Expensive.formatted += 1
+        return "expensive"
+
+
+def test_lazy_queued_rotated(tmp_path, monkeypatch):
+    """ Disabled levels aren't formatted, enabled ones are written by listener with rotation """
+    monkeypatch.setenv("LOG_MAX_BYTES", "200")
+    monkeypatch.setenv("LOG_BACKUP_COUNT", "2")
+    path = str(tmp_path / "test.log")
+    log = Logger(path, name="films_test")
+    log.console_handler.setLevel("CRITICAL")
+    log.change_level("INFO")
+    log.debug("skipped %s", Expensive())
+    assert Expensive.formatted == 0
+    for i in range(20):
+        log.info("written %s %s", Expensive(), i)
+    log.stop()
+    assert Expensive.formatted >= 20
+    path = log.log_handler.baseFilename
+    assert path.endswith(f"test.{os.getpid()}.log")
+    assert os.path.exists(path + ".1")
+    with open(path, encoding="utf-8") as file:
+        assert "written expensive 19" in file.read()
+
+
+def test_own_file_after_fork(tmp_path):
+    """ Forked process writes its own file, parent's one isn't touched by it """
+    log = Logger(str(tmp_path / "fork.log"), name="films_fork_test")
+    log.console_handler.setLevel("CRITICAL")
+    pid = os.fork()
+    if pid == 0:
+        log.warning("child record")
+        log.stop()
+        os._exit(0)
+    os.waitpid(pid, 0)
+    log.warning("parent record")
+    log.stop()
+    with open(tmp_path / f"fork.{pid}.log", encoding="utf-8") as file:
+        assert "child record" in file.read()
+    with open(tmp_path / f"fork.{os.getpid()}.log", encoding="utf-8") as file:
+        assert "child record" not in file.read()
+
+
+def test_old_files_pruned(tmp_path):
+    """ Files of finished processes are removed when they are old, running ones and recent ones are kept """
+    finished = subprocess.Popen([sys.executable, "-c", "pass"])
+    finished.wait()
+    old = time.time() - 8 * 24 * 3600
+    names = [f"prune.{finished.pid}.log", f"prune.{finished.pid}.log.1", f"prune.{os.getpid()}.log",
+             f"other.{finished.pid}.log"]
+    for name in names:
+        (tmp_path / name).write_text("record\n")
+        os.utime(tmp_path / name, (old, old))
+    recent = tmp_path / f"prune.{finished.pid + 100000}.log"
+    recent.write_text("record\n")
+    log = Logger(str(tmp_path / "prune.log"), name="films_prune_test")
+    log.stop()
+    assert sorted(path.name for path in tmp_path.iterdir()) == sorted(names[2:] + [recent.name])
@@ -0,0 +1,86 @@
+import os
+import subprocess
+import sys
+from prometheus_client.parser import text_string_to_metric_families
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from films_library import films_app, db
+from .conftest import FILMS_URL, BASE_URL, LOGIN_URL, PROFILE_URL, USER1_DATA
+
+APP_DIR = os.path.dirname(films_app.root_path)
+
+METRICS_URL = BASE_URL + "metrics"
+
+
+def samples(client):
+    """ Metrics samples from endpoint as dict (name, labels) -> value """
+    response = client.get(METRICS_URL)
+    assert response.status_code == 200
+    assert response.content_type.startswith("text/plain")
+    return {(sample.name, tuple(sorted(sample.labels.items()))): sample.value
+            for family in text_string_to_metric_families(response.get_data(as_text=True))
+            for sample in family.samples}
+
+
+def test_request_metrics(client, catalog):
+    """ Films requests are counted by route with their statements and database time """
+    labels = (("method", "GET"), ("route", "/api/films/"))
+    before = samples(client)
+    client.get(FILMS_URL, query_string={"template": "Film 0"})
+    client.get(FILMS_URL, query_string={"template": "Film 1"})
+    after = samples(client)
+    count = ("films_http_request_duration_seconds_count", labels + (("status", "200"),))
+    assert after[count] - before.get(count, 0) == 2
+    statements = ("films_db_statements_per_request_sum", labels)
+    assert after[statements] - before.get(statements, 0) >= 2
+    assert after[("films_db_seconds_per_request_sum", labels)] > 0
+
+
+def test_missing_multiprocess_directory(tmp_path):
+    """ Servers without gunicorn hooks, like uvicorn of read service, start with not existing metrics directory """
+    metrics_dir = tmp_path / "metrics"
+    env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=str(metrics_dir),
+               SQLALCHEMY_DATABASE_URI=films_app.config["SQLALCHEMY_DATABASE_URI"])
+    result = subprocess.run([sys.executable, "-c", "import films_library.read_service"], cwd=APP_DIR, env=env,
+                            capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert metrics_dir.is_dir()
+
+
+def test_replica_statements(client, replica):
+    """ Statements of replicas are counted by their bind """
+    before = samples(client)
+    assert client.get(FILMS_URL, query_string={"template": "Film 0"}).status_code == 200
+    after = samples(client)
+    key = ("films_db_statements_total", (("bind", "replica0"),))
+    assert after[key] - before.get(key, 0) >= 1
+
+
+def test_cache_metrics(client, catalog):
+    """ Hits and misses of search, names and users caches are exported """
+    before = samples(client)
+    query = {"directors": "director1", "template": "cache metrics"}
+    client.get(FILMS_URL, query_string=query)
+    client.get(FILMS_URL, query_string=query)
+    client.post(LOGIN_URL, data=USER1_DATA)
+    client.get(PROFILE_URL)
+    after = samples(client)
+
+    def increase(cache, result):
+        key = ("films_cache_requests_total", (("cache", cache), ("result", result)))
+        return after.get(key, 0) - before.get(key, 0)
+    assert increase("search", "miss") >= 1 and increase("search", "hit") >= 1
+    assert increase("directors", "hit") + increase("directors", "miss") >= 1
+    assert increase("users", "hit") + increase("users", "miss") >= 1
+
+
+def test_failed_statement_leaves_no_timer(catalog):
+    """ Start time of failed statement isn't left on connection """
+    connection = db.session.connection()
+    try:
+        connection.execute(text("SELECT * FROM no_such_table"))
+    except OperationalError:
+        db.session.rollback()
+    connection = db.session.connection()
+    connection.execute(text("SELECT 1"))
+    assert "metrics_started" not in connection.info
@@ -0,0 +1,32 @@
+import re
+from datetime import datetime
+from films_library import database
+from films_library.cache import directors_ids, genres_ids
+
+DICTIONARY_TABLE = re.compile(r"\b(directors|genres)\b")
+
+
+def add_film(title, directors, genres):
+    return database.add_film(title=title, release_date=datetime(2020, 1, 1), user=1, directors=directors,
+                             genres=genres, description="desc", rate=1, poster_url="https:/img.png")
+
+
+def test_known_names_skip_dictionary_tables(catalog, statements):
+    """ Adding film with already seen directors and genres doesn't query directors and genres tables """
+    add_film("Warm up", ["director0", "director1"], "Action,Noir")
+    statements.clear()
+    hits = directors_ids.stats()["hits"]
+    add_film("Cached", ["director0", "director1"], "Action,Noir")
+    assert not [statement for statement in statements if DICTIONARY_TABLE.search(statement)]
+    assert directors_ids.stats()["hits"] > hits
+    assert genres_ids.stats()["hit_rate"] > 0
+
+
+def test_deleted_director_forgotten(catalog):
+    """ Deleted director is dropped from cache and found by its new row after adding again """
+    add_film("Lonely", ["lonely director"], "Drama")
+    database.delete_director("lonely director")
+    assert directors_ids.get_ids(["lonely director"]) == {}
+    film = add_film("Lonely 2", ["lonely director"], "Drama")
+    assert [found.id for found in database.find_films_by_filters(directors="lonely director", page_number=1,
+                                                                 pagination_size=10)] == [film.id]
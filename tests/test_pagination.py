@@ -0,0 +1,59 @@
+import base64
+import pytest
+from films_library import database
+from .conftest import FILMS_URL, CATALOG_SIZE
+
+SORTINGS = [(sort_by, sort_type) for sort_by in (None, "rate", "date") for sort_type in (None, "asc", "desc")]
+
+
+def sort_key(film, sort_by):
+    """ (sort column, id) pair the films are ordered by """
+    if sort_by == "rate":
+        return film.rate, film.id
+    if sort_by == "date":
+        return film.release_date, film.id
+    return film.id, film.id
+
+
+@pytest.mark.parametrize("sort_by,sort_type", SORTINGS)
+def test_cursor_walks_all_films(catalog, sort_by, sort_type):
+    """ Cursor pages cover every film exactly once in the requested order """
+    films, cursor = [], ""
+    while True:
+        page, cursor = database.find_films_after_cursor(cursor=cursor, template="", pagination_size=4,
+                                                        sort_by=sort_by, sort_type=sort_type)
+        films.extend(page)
+        if cursor is None:
+            break
+    assert len(films) == CATALOG_SIZE
+    assert len({film.id for film in films}) == CATALOG_SIZE
+    keys = [sort_key(film, sort_by) for film in films]
+    assert keys == sorted(keys, reverse=sort_type == "desc")
+
+
+def test_cursor_mode_response(client, catalog):
+    """ Cursor mode returns films with next_cursor envelope """
+    first = client.get(FILMS_URL, query_string={"cursor": "", "pagination_size": 10, "sort_by": "rate"})
+    assert first.status_code == 200
+    assert len(first.json["films"]) == 10
+    second = client.get(FILMS_URL, query_string={"cursor": first.json["next_cursor"], "pagination_size": 10,
+                                                 "sort_by": "rate"})
+    assert second.status_code == 200
+    assert {film["id"] for film in first.json["films"]}.isdisjoint(film["id"] for film in second.json["films"])
+
+
+def test_cursor_of_another_sorting(client, catalog):
+    """ Cursor can't be reused with other sort_by/sort_type """
+    first = client.get(FILMS_URL, query_string={"cursor": "", "sort_by": "rate"})
+    wrong = client.get(FILMS_URL, query_string={"cursor": first.json["next_cursor"], "sort_by": "date"})
+    assert wrong.status_code == 403
+
+
+@pytest.mark.parametrize("sort_by, data", [("date", '["date",null,5,1]'), ("date", '["date",null,"x",1]'),
+                                           ("rate", '["rate",null,1,{"a":1}]'), ("rate", '["rate",null,null,1]'),
+                                           (None, '[null,null,"1",1]')])
+def test_broken_cursor_values(client, catalog, sort_by, data):
+    """ Cursor of right shape with wrong values is refused like broken one """
+    cursor = base64.urlsafe_b64encode(data.encode()).decode()
+    query = {"cursor": cursor} if sort_by is None else {"cursor": cursor, "sort_by": sort_by}
+    assert client.get(FILMS_URL, query_string=query).status_code == 403
@@ -0,0 +1,90 @@
+import os
+import subprocess
+import sys
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+from films_library import db, films_app
+from films_library.pools import TimedQueuePool, engine_options
+
+READY_URL = "/api/health/ready"
+
+
+def test_pool_from_config(client):
+    """ Engine pool is made from environment settings """
+    assert isinstance(db.engine.pool, TimedQueuePool)
+    assert db.engine.pool.size() == films_app.config["SQLALCHEMY_ENGINE_OPTIONS"]["pool_size"]
+
+
+def test_ready(client):
+    """ Ready worker answers with pools statistics """
+    response = client.get(READY_URL)
+    assert response.status_code == 200
+    primary = response.json["databases"]["primary"]
+    assert response.json["ready"] and primary["checkouts"] > 0 and "ping_ms" in primary
+    assert {"size", "checked_out", "overflow", "checkout_ms_mean", "checkout_ms_max"} <= primary.keys()
+
+
+def test_not_ready(client):
+    """ Unreachable replica makes worker not ready """
+    db.engines["replica0"] = create_engine("sqlite:////nonexistent/directory/replica.db")
+    try:
+        response = client.get(READY_URL)
+    finally:
+        db.engines.pop("replica0").dispose()
+    assert response.status_code == 503
+    assert not response.json["ready"] and "error" in response.json["databases"]["replica0"]
+
+
+def test_statement_timeout(client, monkeypatch):
+    """ Long statement is interrupted, short ones run """
+    monkeypatch.setitem(films_app.config, "DB_STATEMENT_TIMEOUT_MS", 50)
+    long_statement = text("WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 100000000) "
+                          "SELECT count(*) FROM n")
+    with pytest.raises(OperationalError, match="interrupted"):
+        db.session.execute(long_statement)
+    db.session.rollback()
+    assert db.session.execute(text("SELECT 1")).scalar() == 1
+
+
+def test_new_pool_after_fork(client):
+    """ Forked process opens its own connections, parent's ones keep working """
+    db.session.execute(text("SELECT 1"))
+    parent_pool = db.engine.pool
+    pid = os.fork()
+    if pid == 0:
+        try:
+            ok = db.engine.pool is not parent_pool and db.engine.pool.checkedout() == 0 \
+                and db.session.execute(text("SELECT 1")).scalar() == 1
+        except Exception:
+            ok = False
+        os._exit(0 if ok else 1)
+    assert os.waitpid(pid, 0)[1] == 0
+    assert db.engine.pool is parent_pool
+    assert db.session.execute(text("SELECT 1")).scalar() == 1
+
+
+def test_engine_options_by_url():
+    """ Queue pool sizes are given only to databases with queue pools """
+    assert engine_options("postgresql+psycopg2://user:pass@db/postgres")["poolclass"] is TimedQueuePool
+    assert "pool_size" in engine_options("sqlite:////tmp/films.db", poolclass=None)
+    for uri in ("sqlite://", "sqlite:///:memory:", "sqlite+aiosqlite://"):
+        assert {"poolclass", "pool_size", "max_overflow", "pool_timeout"}.isdisjoint(engine_options(uri))
+
+
+def test_in_memory_database():
+    """ Application and read service work with in-memory sqlite """
+    script = ("import asyncio\n"
+              "from sqlalchemy import text\n"
+              "from films_library import db, read_service\n"
+              "assert db.session.execute(text('SELECT 1')).scalar() == 1\n"
+              "async def ping():\n"
+              "    async with read_service.sessions()() as session:\n"
+              "        assert (await session.execute(text('SELECT 1'))).scalar() == 1\n"
+              "    await read_service.dispose()\n"
+              "asyncio.run(ping())\n")
+    env = dict(os.environ, SQLALCHEMY_DATABASE_URI="sqlite://")
+    env.pop("PROMETHEUS_MULTIPROC_DIR", None)
+    result = subprocess.run([sys.executable, "-c", script], cwd=os.path.dirname(films_app.root_path), env=env,
+                            capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
@@ -0,0 +1,113 @@
+import asyncio
+from urllib.parse import urlencode
+import pytest
+from films_library import database, films_app, trigram
+from films_library.api import search_cache
+from .conftest import FILMS_URL, LOGIN_URL, USER1_DATA, FILM_DATA
+
+pytest.importorskip("aiosqlite")
+read_service = pytest.importorskip("films_library.read_service")
+
+
+def asgi_get(query: dict, path: str = FILMS_URL, headers: dict = None):
+    """ Send GET request to read service application
+
+    :returns: tuple (status, headers dict, body)
+    """
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    async def request():
+        scope = {"type": "http", "method": "GET", "path": path, "query_string": urlencode(query).encode(),
+                 "headers": [(name.lower().encode(), value.encode()) for name, value in (headers or {}).items()]}
+        await read_service.app(scope, receive, send)
+        # pooled connections belong to this event loop
+        await read_service.dispose()
+    asyncio.run(request())
+    return messages[0]["status"], dict(messages[0]["headers"]), messages[1]["body"]
+
+
+@pytest.mark.parametrize("query", [{}, {"pagination_size": 4, "page_number": 2, "sort_by": "rate", "sort_type": "desc"},
+                                   {"genres": "Noir,Action", "directors": "director1", "template": "film 1"},
+                                   {"genres": "Action,Noir", "match_mode": "all"},
+                                   {"date_from": "2002.01.01", "date_to": "2004.01.01", "sort_by": "date"},
+                                   {"search": "desc1"}, {"cursor": "", "pagination_size": 3, "sort_by": "rate"},
+                                   {"date_from": "20020101"}, {"page_number": "x"}, {"genres": "nothing"}])
+def test_same_response(client, catalog, query):
+    """ Read service answers byte to byte like films_app, errors included """
+    search_cache.clear()
+    expected = client.get(FILMS_URL, query_string=query)
+    search_cache.clear()
+    status, headers, body = asgi_get(query)
+    assert status == expected.status_code
+    assert body == expected.data
+    assert headers[b"content-type"] == b"application/json"
+    assert headers.get(b"etag", b"").decode() == expected.headers.get("ETag", "")
+
+
+def test_cursor_pages(client, catalog):
+    """ next_cursor of read service continues search in both applications """
+    status, _, body = asgi_get({"cursor": "", "pagination_size": 10, "sort_by": "date", "sort_type": "desc"})
+    next_cursor = client.get(FILMS_URL, query_string={"cursor": "", "pagination_size": 10, "sort_by": "date",
+                                                      "sort_type": "desc"}).json["next_cursor"]
+    assert status == 200 and next_cursor in body.decode()
+    query = {"cursor": next_cursor, "pagination_size": 10, "sort_by": "date", "sort_type": "desc"}
+    search_cache.clear()
+    assert asgi_get(query)[2] == client.get(FILMS_URL, query_string=query).data
+
+
+def test_reads_names_and_follows_changes(catalog):
+    """ Names unknown to cache are read with the search, cached responses are dropped by catalog changes """
+    search_cache.clear()
+    read_service.directors_ids.clear()
+    assert asgi_get({"directors": "director2"})[0] == 200
+    assert "director2" in read_service.directors_ids.cached_ids(["director2"])[0]
+    database.delete_director("director2")
+    assert asgi_get({"directors": "director2"})[0] == 404
+
+
+def test_not_served(catalog):
+    """ Other paths and searches with counts are left to films_app """
+    assert asgi_get({}, path="/api/users/")[0] == 404
+    assert asgi_get({"facets": "true"})[0] == 400
+    assert asgi_get({"total": "exact"})[0] == 400
+
+
+def test_not_modified(client, catalog):
+    """ ETag of films_app response gets 304 from read service until catalog changes """
+    query = {"genres": "Noir", "pagination_size": 3}
+    etag = client.get(FILMS_URL, query_string=query).headers["ETag"]
+    status, headers, body = asgi_get(query, headers={"If-None-Match": etag})
+    assert status == 304 and body == b"" and headers[b"etag"] == etag.encode()
+    database.delete_director("director2")
+    assert asgi_get(query, headers={"If-None-Match": etag})[0] == 200
+
+
+def test_reads_replica(client, replica, monkeypatch):
+    """ Searches read replica, except ones of client which has just written """
+    monkeypatch.setitem(films_app.config, "SQLALCHEMY_BINDS", {"replica0": {"url": str(replica.url)}})
+    client.post(LOGIN_URL, data=USER1_DATA)
+    assert client.post(FILMS_URL, data=dict(FILM_DATA, title="Fresh film")).status_code == 201
+    search_cache.clear()
+    query = {"template": "Fresh film"}
+    assert asgi_get(query)[0] == 404
+    cookie = f"session={client.get_cookie('session').value}"
+    assert asgi_get(query, headers={"Cookie": cookie})[0] == 200
+    monkeypatch.setitem(films_app.config, "READ_YOUR_WRITES_SECONDS", 0)
+    assert asgi_get(query, headers={"Cookie": cookie})[0] == 404
+
+
+def test_trigram_index_not_used(catalog, monkeypatch):
+    """ Read service matches templates by database without touching films_app trigram setting """
+    monkeypatch.setitem(films_app.config, "TRIGRAM_INDEX", True)
+    monkeypatch.setattr(trigram, "_index", None)
+    search_cache.clear()
+    status, _, _ = asgi_get({"template": "film 1"})
+    assert status == 200
+    assert trigram._index is None
+    assert films_app.config["TRIGRAM_INDEX"]
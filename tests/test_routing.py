@@ -0,0 +1,40 @@
+from datetime import datetime
+import pytest
+from films_library import films_app, database
+from films_library.errors import NotFoundError
+from films_library.models import Films
+from .conftest import FILMS_URL, LOGIN_URL, PROFILE_URL, USER1_DATA, FILM_DATA, CATALOG_SIZE
+
+EXPORT_URL = FILMS_URL + "export/"
+
+
+def test_reads_go_to_replica(client, replica):
+    """ Searches, counts and exports read replica, other reads and writes go to primary """
+    database.add_film(title="Only on primary", release_date=datetime(2010, 1, 1), user=1, directors="someone",
+                      genres="Noir")
+    with pytest.raises(NotFoundError):
+        database.find_films_by_filters(template="Only on primary", page_number=1, pagination_size=10)
+    assert database.count_films(template="Only on primary") == (0, True)
+    assert Films.query.filter_by(title="Only on primary").count() == 1
+    assert len(client.get(EXPORT_URL).data.decode().splitlines()) == CATALOG_SIZE
+
+
+def test_login_uses_primary(client, replica):
+    """ User unknown to replica logs in and sees profile """
+    database.add_user(nickname="Fresh", email="fresh@mail.ua", password="fresh")
+    assert client.post(LOGIN_URL, data={"email": "fresh@mail.ua", "password": "fresh"}).status_code == 200
+    response = client.get(PROFILE_URL)
+    assert response.status_code == 200
+    assert response.json["users"]["nickname"] == "Fresh"
+
+
+def test_read_your_writes(client, replica, monkeypatch):
+    """ Client reads primary shortly after its own write, others read replica """
+    client.post(LOGIN_URL, data=USER1_DATA)
+    assert client.post(FILMS_URL, data=dict(FILM_DATA, title="Fresh film")).status_code == 201
+    query = {"template": "Fresh film"}
+    assert client.get(FILMS_URL, query_string=query).status_code == 200
+    with films_app.test_client() as other:
+        assert other.get(FILMS_URL, query_string=query).status_code == 404
+    monkeypatch.setitem(films_app.config, "READ_YOUR_WRITES_SECONDS", 0)
+    assert client.get(FILMS_URL, query_string=query).status_code == 404
@@ -0,0 +1,80 @@
+from datetime import datetime
+import pytest
+from flask_restx import marshal
+from films_library import database, db
+from films_library.api import film_model
+from films_library.errors import NotFoundError
+
+
+@pytest.fixture
+def crowded_film(catalog):
+    """ film linked with several directors and genres """
+    return database.add_film(title="Crowded", release_date=datetime(2001, 1, 1), user=1,
+                             directors=["director0", "director1", "director2"], genres="Action,Noir,Drama",
+                             description="desc", rate=3, poster_url="https:/img.png")
+
+
+def test_search_is_one_query(catalog, statements):
+    """ Every filter together still costs one films query, plus batch loads of genres and directors """
+    database.find_films_by_filters(template="Film", date_from="2000.01.01", date_to="2010.01.01", page_number=1,
+                                   pagination_size=10, genres="Action,Noir", directors="director0,director1",
+                                   sort_by="rate", sort_type="desc")
+    assert len(statements) == 3
+
+
+def test_film_found_once(crowded_film):
+    """ Film matching several passed directors and genres isn't duplicated """
+    films = database.find_films_by_filters(template="Crowded", page_number=1, pagination_size=10,
+                                           genres="Action,Noir,Drama", directors="director0,director1,director2")
+    assert [film.id for film in films] == [crowded_film.id]
+
+
+def test_match_all(crowded_film):
+    """ match_mode 'all' keeps only films having every passed genre """
+    films = database.find_films_by_filters(page_number=1, pagination_size=100, genres="Action,Noir", match_mode="all")
+    assert [film.id for film in films] == [crowded_film.id]
+    films = database.find_films_by_filters(page_number=1, pagination_size=100, genres="Action,Noir", match_mode="any")
+    assert len(films) > 1
+
+
+def test_nothing_found(catalog):
+    """ Unknown director gives NotFoundError """
+    with pytest.raises(NotFoundError):
+        database.find_films_by_filters(page_number=1, pagination_size=10, directors="nobody")
+
+
+def test_full_text_search_ranking(catalog):
+    """ Full-text search looks at description too and puts the most relevant film first """
+    database.add_film(title="Heat", release_date=datetime(1995, 12, 15), user=1, directors="Michael Mann",
+                      genres="Crime", description="A professional crew of thieves and a detective who hunts them "
+                                                  "through Los Angeles after their last heist goes wrong.",
+                      rate=8, poster_url="https:/img.png")
+    database.add_film(title="Heist", release_date=datetime(2001, 11, 9), user=1, directors="David Mamet",
+                      genres="Crime", description="Old thief plans one last heist.", rate=6,
+                      poster_url="https:/img.png")
+    films = database.find_films_by_filters(search="heist", page_number=1, pagination_size=10)
+    assert [film.title for film in films] == ["Heist", "Heat"]
+    films = database.find_films_by_filters(search="detective", page_number=1, pagination_size=10)
+    assert [film.title for film in films] == ["Heat"]
+
+
+def test_full_text_index_follows_changes(catalog):
+    """ Deleted film disappears from full-text search results """
+    film = database.add_film(title="Solaris", release_date=datetime(1972, 3, 20), user=1, directors="Tarkovsky",
+                             genres="Drama", description="Ocean planet", rate=9, poster_url="https:/img.png")
+    assert len(database.find_films_by_filters(search="ocean", page_number=1, pagination_size=10)) == 1
+    database.delete_film(film.id)
+    with pytest.raises(NotFoundError):
+        database.find_films_by_filters(search="ocean", page_number=1, pagination_size=10)
+
+
+@pytest.mark.parametrize("pagination_size", [1, 5, 20])
+def test_marshalling_page_queries(catalog, statements, pagination_size):
+    """ Marshalled page costs the same count of queries whatever its size:
+    films query plus one query for genres and one for directors """
+    db.session.expunge_all()
+    statements.clear()
+    films = database.find_films_by_filters(page_number=1, pagination_size=pagination_size)
+    marshal(films, film_model)
+    assert len(films) == pagination_size
+    assert len(statements) == 3
@@ -0,0 +1,95 @@
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from films_library import db, database
+from films_library.models import Directors, User
+from films_library.slow_queries import SlowQueryLog, HIDDEN
+
+
+def test_slow_query_explained(catalog):
+    """ Statements over threshold are logged with caller and plan, sampling skips the rest """
+    slow_log = SlowQueryLog(threshold_ms=0)
+    slow_log.install(db.engine)
+    try:
+        database.find_films_by_filters(directors="director1", genres="Noir", page_number=1, pagination_size=5)
+    finally:
+        slow_log.uninstall()
+    search = [record for record in slow_log.records if record["statement"].lstrip().startswith("SELECT films")][0]
+    assert search["caller"] == "database.find_films_by_filters"
+    assert search["parameters"]
+    assert any("films" in line for line in search["plan"])
+
+    skipped = SlowQueryLog(threshold_ms=0, sample_rate=0)
+    skipped.install(db.engine)
+    try:
+        database.find_films_by_filters(template="Film", page_number=1, pagination_size=5)
+    finally:
+        skipped.uninstall()
+    assert skipped.stats()["slow"] > 0
+    assert skipped.stats()["logged"] == 0
+
+
+def test_explain_inside_write(catalog):
+    """ Explaining statements of write transaction doesn't break it """
+    slow_log = SlowQueryLog(threshold_ms=0)
+    slow_log.install(db.engine)
+    try:
+        database.delete_director("director2")
+    finally:
+        slow_log.uninstall()
+    callers = {record["caller"] for record in slow_log.records if record["plan"]}
+    assert "database.delete_director" in callers
+    assert Directors.query.filter_by(full_name="director2").first() is None
+
+
+def test_replica_statements_logged(replica):
+    """ One slow log listens primary and replica, replica_reads() searches are logged from replica """
+    slow_log = SlowQueryLog(threshold_ms=0)
+    slow_log.install(db.engine)
+    slow_log.install(replica)
+    try:
+        with replica.connect() as connection:
+            connection.exec_driver_sql("SELECT count(*) FROM films")
+        database.find_films_by_filters(template="Film", page_number=1, pagination_size=5)
+    finally:
+        slow_log.uninstall()
+    assert any(record["statement"] == "SELECT count(*) FROM films" for record in slow_log.records)
+    assert any(record["caller"] == "database.find_films_by_filters" for record in slow_log.records)
+    logged = slow_log.logged
+    with replica.connect() as connection:
+        connection.exec_driver_sql("SELECT 1")
+    assert slow_log.logged == logged
+
+
+def test_credentials_hidden(catalog):
+    """ Emails and password hashes of users statements don't get to log """
+    slow_log = SlowQueryLog(threshold_ms=0)
+    slow_log.install(db.engine)
+    try:
+        database.add_user(nickname="Secret", email="secret@mail.ua", password="secret")
+        User.query.filter(User.email.in_(["secret@mail.ua", "other@mail.ua"])).all()
+    finally:
+        slow_log.uninstall()
+    records = [record for record in slow_log.records if "users" in record["statement"]]
+    assert any(record["statement"].startswith("INSERT") for record in records)
+    inserted = [record for record in records if record["statement"].startswith("INSERT")][0]
+    assert "Secret" in inserted["parameters"] and HIDDEN in inserted["parameters"]
+    logged = repr([(record["parameters"], record["plan"]) for record in records])
+    password_hash = User.query.filter_by(nickname="Secret").first().password
+    assert "secret@mail.ua" not in logged and password_hash not in logged
+
+
+def test_failed_statement_leaves_no_timer(catalog):
+    """ Failed statement isn't logged and its start time isn't left on connection """
+    slow_log = SlowQueryLog(threshold_ms=0)
+    slow_log.install(db.engine)
+    try:
+        try:
+            db.session.execute(text("SELECT * FROM no_such_table"))
+        except OperationalError:
+            db.session.rollback()
+        connection = db.session.connection()
+        connection.execute(text("SELECT 1"))
+    finally:
+        slow_log.uninstall()
+    assert "slow_query_started" not in connection.info
+    assert [record["statement"] for record in slow_log.records] == ["SELECT 1"]
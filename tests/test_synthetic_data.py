@@ -0,0 +1,38 @@
+from collections import Counter
+import pytest
+from films_library import db, database
+from films_library.models import Films, films_directors, films_genres, users_films
+from .conftest import CATALOG_SIZE
+
+np = pytest.importorskip("numpy")
+synthetic_data = pytest.importorskip("tests.synthetic_data")
+
+
+def test_sampler_is_reproducible():
+    """ Same seed makes the same films and links """
+    def sample():
+        sampler = synthetic_data.CatalogSampler(np.random.default_rng(1), 10, 50, 1, 1,
+                                                {name: i for i, name in enumerate(synthetic_data.GENRES, 1)})
+        films, directors, genres, users = sampler.films(1, 100)
+        return [film[:-1] for film in films], directors, genres, users
+    assert sample() == sample()
+
+
+def test_generate_catalog(catalog):
+    """ Synthetic films are appended after existing ones with links to existing rows, directors are Zipfian """
+    report = synthetic_data.generate_catalog(3000, users=20, directors=200, batch_size=1000)
+    assert report["films"] == 3000
+    assert Films.query.count() == CATALOG_SIZE + 3000
+    synthetic = Films.id > CATALOG_SIZE
+    links = db.session.execute(db.select(films_directors.c.director_id).where(films_directors.c.film_id > CATALOG_SIZE)
+                               ).scalars().all()
+    popularity = Counter(links).most_common()
+    # the most popular director of Zipfian 200 has about 17% of links, with uniform ones it would be 0.5%
+    assert popularity[0][1] > 0.1 * len(links)
+    for table in (films_directors, films_genres, users_films):
+        linked = db.session.execute(db.select(db.func.count(db.distinct(table.c.film_id)))
+                                    .where(table.c.film_id > CATALOG_SIZE)).scalar()
+        assert linked == 3000
+    assert db.session.execute(db.select(db.func.min(Films.rate)).where(synthetic)).scalar() >= 0
+    assert database.find_films_by_filters(genres=["Drama"], page_number=1, pagination_size=10)
+    assert database.find_films_by_filters(search="story", page_number=1, pagination_size=10)
@@ -0,0 +1,51 @@
+from datetime import datetime
+import pytest
+from films_library import database
+from films_library.api import films_total, totals_cache
+from films_library.cache import catalog_generation
+from .conftest import FILMS_URL, CATALOG_SIZE
+
+
+@pytest.mark.parametrize("filters, total", [({}, CATALOG_SIZE), ({"genres": "Noir"}, 8),
+                                             ({"directors": "director0"}, 9), ({"genres": "nothing"}, 0)])
+def test_estimate_is_exact_for_stored_counts(catalog, statements, filters, total):
+    """ Whole catalog, one genre and one director counts are taken from stored counts as exact ones """
+    assert database.count_films(estimate=True, **filters) == (total, True)
+    # names lookup and stored counts
+    assert len(statements) <= 2
+    assert database.count_films(**filters) == (total, True)
+
+
+def test_estimate(catalog):
+    """ Combined filters are estimated close to exact count, text search is counted exactly """
+    filters = dict(date_from="2000.01.01", date_to="2002.12.31", genres="Action,Noir")
+    exact, is_exact = database.count_films(**filters)
+    estimate, is_exact_estimate = database.count_films(estimate=True, **filters)
+    assert is_exact and not is_exact_estimate
+    assert abs(estimate - exact) <= 2
+    assert database.count_films(estimate=True, search="desc1") == database.count_films(search="desc1")
+
+
+def test_total_in_response(client, catalog):
+    """ Total is added to every page of search and says if it is exact """
+    response = client.get(FILMS_URL, query_string={"genres": "Action", "total": "exact", "pagination_size": 2,
+                                                   "page_number": 2})
+    assert response.status_code == 200
+    assert len(response.json["films"]) == 2
+    assert response.json["total"] == 9
+    assert response.json["total_exact"] is True
+    response = client.get(FILMS_URL, query_string={"date_to": "2001.06.01", "total": "estimate"})
+    assert response.json["total_exact"] is False
+    assert client.get(FILMS_URL, query_string={"total": "maybe"}).status_code == 400
+
+
+def test_totals_cache(catalog, statements):
+    """ Totals are cached per filters until catalog changes """
+    totals_cache.clear()
+    assert films_total(catalog_generation(), "exact", genres="Noir") == (8, True)
+    counted = len(statements)
+    assert films_total(catalog_generation(), "exact", genres=" Noir,") == (8, True)
+    assert len(statements) == counted + 1
+    database.add_film(title="One more", release_date=datetime(2010, 1, 1), user=1, directors="someone",
+                      genres="Noir")
+    assert films_total(catalog_generation(), "exact", genres="Noir") == (9, True)
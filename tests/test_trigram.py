@@ -0,0 +1,72 @@
+from datetime import datetime
+from films_library import database, trigram, films_app, db, metrics
+from films_library.cache import catalog_generation, bump_catalog_generation
+
+
+def test_trigram_index_search():
+    """ Index finds case insensitive substrings and follows changes """
+    index = trigram.TrigramIndex(max_films=10)
+    index.build([(1, "The Dark Knight"), (2, "Dark City"), (3, "Knight and Day")])
+    assert index.search("dark") == {1, 2}
+    assert index.search("KNIGHT") == {1, 3}
+    assert index.search("k k") == {1}
+    index.remove(1)
+    index.add(2, "Bright City")
+    assert index.search("dark") == set()
+    # too short or LIKE templates are left for database
+    assert index.search("da") is None
+    assert index.search("d%k") is None
+
+
+def test_trigram_index_bound():
+    """ Index disables itself if catalog doesn't fit """
+    index = trigram.TrigramIndex(max_films=2)
+    index.build([(1, "Film 1"), (2, "Film 2"), (3, "Film 3")])
+    assert not index.enabled
+    assert index.search("film") is None
+    assert index.stats()["films"] == 0
+
+
+def test_search_by_trigram_index(catalog, monkeypatch):
+    """ Template search gives the same films with index """
+    expected = [film.id for film in database.find_films_by_filters(template="lm 1", page_number=1,
+                                                                   pagination_size=100)]
+    monkeypatch.setitem(films_app.config, "TRIGRAM_INDEX", True)
+    monkeypatch.setattr(trigram, "_index", None)
+    trigram.build_index()
+    assert [film.id for film in database.find_films_by_filters(template="lm 1", page_number=1,
+                                                               pagination_size=100)] == expected
+    assert trigram.films_index().stats()["films"] == len(database.Films.query.all())
+    # own writes are applied incrementally
+    index = trigram.films_index()
+    film = database.add_film(title="Trigram", release_date=datetime(2020, 1, 1), user=1, directors="director0",
+                             genres="Action", description="desc", rate=1, poster_url="https:/img.png")
+    assert index.generation == catalog_generation()
+    assert index.search("igra") == {film.id}
+
+
+def test_trigram_index_background_rebuild(catalog, monkeypatch):
+    """ Changes of other workers are noticed at most once per check interval and index is rebuilt
+    in background, while the old one keeps serving searches
+    """
+    monkeypatch.setitem(films_app.config, "TRIGRAM_INDEX", True)
+    monkeypatch.setattr(trigram, "_index", None)
+    # not built index starts building in background, searches are left to database till it's ready
+    trigram.films_index()
+    trigram._rebuild_thread.join()
+    index = trigram.films_index()
+    assert index.generation == catalog_generation()
+    films_count = index.stats()["films"]
+    # change made by other worker: new film and generation jump without index update
+    db.session.execute(database.Films.__table__.insert().values(
+        title="Foreign Trigram", release_date=datetime(2020, 1, 1), user_id=1, rate=1, poster_url="https://"))
+    bump_catalog_generation()
+    db.session.commit()
+    assert trigram.films_index() is index
+    assert index.search("foreign") == set()
+    monkeypatch.setitem(films_app.config, "TRIGRAM_INDEX_CHECK_SECONDS", 0)
+    assert trigram.films_index() is index
+    trigram._rebuild_thread.join()
+    assert index.generation == catalog_generation()
+    assert len(index.search("foreign")) == 1
+    assert metrics.TRIGRAM_INDEX_FILMS._value.get() == films_count + 1
@@ -0,0 +1,58 @@
+import threading
+from datetime import datetime
+import pytest
+from films_library import films_app, db, database
+from films_library.models import User, Directors, Genres, Films
+from .conftest import USER1_DATA, CATALOG_SIZE
+
+THREADS = 8
+FILMS_PER_THREAD = 5
+
+
+def test_add_user_twice(catalog):
+    """ Registration with taken email is rejected without loading users """
+    with pytest.raises(ValueError):
+        database.add_user(nickname="Another", **USER1_DATA)
+    assert User.query.count() == 1
+
+
+def test_add_many_names(catalog):
+    """ Many names are added at once, already known names are only found """
+    found, added = database.add_directors(["director0", "New one", "New two", "New one"])
+    assert added == {"New one", "New two"}
+    assert set(found) == {"director0", "New one", "New two"}
+    assert database.add_director("New one") is None
+    with pytest.raises(ValueError):
+        database.add_genre("Action")
+    database.add_genre("Western")
+    assert Genres.query.filter_by(name="Western").count() == 1
+
+
+def test_concurrent_films_share_new_names(catalog):
+    """ Films with the same new directors and genres are added from parallel threads without errors """
+    errors = []
+    start = threading.Barrier(THREADS)
+
+    def add_films(number):
+        try:
+            with films_app.app_context():
+                start.wait()
+                for i in range(FILMS_PER_THREAD):
+                    database.add_film(title=f"Parallel {number}-{i}", release_date=datetime(2021, 1, 1), user=1,
+                                      directors=["Shared director", f"Director of {i}"],
+                                      genres=f"Shared genre,Genre {i}", rate=1)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=add_films, args=(number,)) for number in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    db.session.expire_all()
+    assert Films.query.count() == CATALOG_SIZE + THREADS * FILMS_PER_THREAD
+    assert Directors.query.filter_by(full_name="Shared director").count() == 1
+    assert Genres.query.filter_by(name="Shared genre").count() == 1
+    shared = Directors.query.filter_by(full_name="Shared director").first()
+    assert shared.films.count() == THREADS * FILMS_PER_THREAD
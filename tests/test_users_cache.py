@@ -0,0 +1,43 @@
+import re
+from films_library import database
+from films_library.cache import users_cache, UsersCache
+from films_library.models import UserSnapshot
+from .conftest import PROFILE_URL, FILMS_URL, USER1_DATA
+
+USERS_TABLE = re.compile(r"\busers\b")
+
+
+def test_profile_served_from_cache(client, catalog, login_user, statements):
+    """ Authenticated requests don't read users table while snapshot is cached """
+    client.get(PROFILE_URL)
+    statements.clear()
+    hits = users_cache.stats()["hits"]
+    response = client.get(PROFILE_URL)
+    assert response.status_code == 200
+    assert response.json["users"]["email"] == USER1_DATA["email"]
+    assert not [statement for statement in statements if USERS_TABLE.search(statement)]
+    assert users_cache.stats()["hits"] == hits + 1
+
+
+def test_anonymous_request_after_login(client, catalog, login_user):
+    """ User loaded by one client's request isn't seen by another client """
+    with client.application.test_client() as anonymous:
+        assert anonymous.get(PROFILE_URL).status_code == 401
+
+
+def test_admin_demotion(client, catalog, login_user):
+    """ Demoted admin loses admin rights with the next request """
+    assert client.get(PROFILE_URL).json["users"]["is_admin"] is True
+    database.set_admin(1, False)
+    assert client.get(PROFILE_URL).json["users"]["is_admin"] is False
+    assert client.post(FILMS_URL + "import/", data="").status_code == 403
+
+
+def test_other_worker_sees_change(catalog):
+    """ Users change made by one worker drops snapshots cached by another one """
+    other_worker = UsersCache(max_size=10, ttl=60, stamp_path=users_cache.stamp_path)
+    assert isinstance(other_worker.load(1), UserSnapshot)
+    assert other_worker.load(1).is_admin is True
+    database.set_admin(1, False)
+    assert other_worker.load(1).is_admin is False
+    assert other_worker.stats()["hits"] == 1